@@ -0,0 +1,131 @@
+import json
+import logging
+
+from pprint import pformat
+
+log = logging.getLogger(__name__)
+
+# Buffered _bulk indexing, shared by es_bulk.bulk_writer (elasticsearch-py)
+# and the kafka collector's simple_es.bulk_buffer (plain requests) - the
+# writers only differ in how a request body is posted. No dependencies
+# beyond the standard library.
+#
+#   Documents are serialized as they are added and buffered as
+# newline-delimited action/source pairs; the buffer is posted as a single
+# _bulk request whenever it holds max_docs documents, before a document that
+# would take it past max_bytes, and when flush() is called at the end of a
+# collection cycle. The memory held for a large set of documents stays
+# bounded, and the first documents are indexed without waiting for the
+# whole set.
+#
+#   Every buffered document carries a label (the shard uiid, thread id,
+# etc.) so that per-item failures reported by the _bulk response can be
+# logged and returned against something meaningful, rather than an opaque
+# position in the request body. A request that fails outright (post raises
+# one of post_errors, or the response has no items) is reported for the
+# whole batch rather than raised.
+#
+#   post is called with the request body and returns the decoded response.
+# The buffer is not thread-safe; use one per collection loop.
+class bulk_buffer(object):
+
+    # buffer a document; returns the flush() result if adding the document
+    # caused the buffer to be posted, otherwise None
+    def add(self, doc, label=None):
+        source_line = json.dumps(doc)
+        # +2 for the newlines terminating the action and source lines
+        doc_bytes = len(self._action_line) + len(source_line) + 2
+
+        # flush ahead of the document that would push the request past the
+        # byte limit - a single oversized document is still sent on its own
+        flush_rc = None
+        if (self._lines and (self._bytes + doc_bytes) > self.max_bytes):
+            flush_rc = self.flush()
+
+        self._lines.append(self._action_line)
+        self._lines.append(source_line)
+        self._labels.append(label)
+        self._bytes += doc_bytes
+
+        if (len(self._labels) >= self.max_docs):
+            count_rc = self.flush()
+            if (flush_rc is None):
+                flush_rc = count_rc
+            else:
+                flush_rc = (flush_rc[0] + count_rc[0], flush_rc[1] + count_rc[1])
+        return flush_rc
+
+    # post the buffered documents; returns a tuple of the number of documents
+    # indexed and the list of labels for the documents that were rejected
+    def flush(self):
+        if not self._labels:
+            return (0, [])
+
+        bulk_body = '\n'.join(self._lines) + '\n'
+        labels = self._labels
+        log.debug("bulk flush (%d docs, %d bytes) to '%s'" % (len(labels), len(bulk_body), self.index))
+        self._lines = []
+        self._labels = []
+        self._bytes = 0
+
+        try:
+            bulk_rc = self._post(bulk_body)
+        except self._post_errors as e:
+            log.error("bulk request (%d docs) to '%s' failed: %s" %
+                (len(labels), self.index, repr(e)))
+            return (0, labels)
+        if ('items' not in bulk_rc):
+            log.error("bulk request (%d docs) to '%s' rejected: %s" %
+                (len(labels), self.index, pformat(bulk_rc.get('error', bulk_rc))))
+            return (0, labels)
+
+        if not bulk_rc.get('errors'):
+            return (len(labels), [])
+
+        # items are returned in the same order as the request actions
+        failed = []
+        for label, item in zip(labels, bulk_rc['items']):
+            item_status = item.get('index', item.get('create', {}))
+            if ('error' in item_status or item_status.get('status', 500) >= 300):
+                failed.append(label)
+                log.debug("bulk item %s rejected [%s]: %s" % (
+                    label, item_status.get('status'), item_status.get('error')))
+        return (len(labels) - len(failed), failed)
+
+    # add every document and flush whatever is left over; label_of gives
+    # each document's label. Returns the number of documents indexed and the
+    # labels of the rejected ones, over all the requests posted
+    def add_all(self, docs, label_of=None):
+        docs_indexed = 0
+        docs_failed = []
+        for doc in docs:
+            if (label_of is None):
+                bulk_rc = self.add(doc)
+            else:
+                bulk_rc = self.add(doc, label=label_of(doc))
+            if (bulk_rc is not None):
+                docs_indexed += bulk_rc[0]
+                docs_failed.extend(bulk_rc[1])
+        bulk_rc = self.flush()
+        docs_indexed += bulk_rc[0]
+        docs_failed.extend(bulk_rc[1])
+        return (docs_indexed, docs_failed)
+
+    @property
+    def pending(self):
+        return len(self._labels)
+
+    def __init__(self, post, index=None, doc_type='doc', max_docs=1000, max_bytes=5*1024*1024,
+            post_errors=()):
+        self._post = post
+        self._post_errors = tuple(post_errors)
+        self.index = index
+        self.doc_type = doc_type
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        # no _id in the action - let elasticsearch generate the document ids
+        self._action_line = json.dumps(
+            {'index': {'_index': index, '_type': doc_type}})
+        self._lines = []
+        self._labels = []
+        self._bytes = 0
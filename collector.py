@@ -0,0 +1,195 @@
+import sys
+import json
+import time
+import socket
+import yaml
+import asyncio
+import functools
+import threading
+import concurrent.futures
+import elasticsearch
+
+from urllib3.connection import HTTPConnection
+
+import scheduler
+
+# local log configs
+from lconfig import *
+
+
+# Single event loop hosting the periodic cluster pollers (shard stats,
+# thread pool stats).
+#
+#   Each poller is a coroutine on one asyncio loop, rather than a daemon
+# thread per cluster. The elasticsearch-py client used here is blocking, so
+# the poll functions themselves are run on a bounded thread pool shared by
+# every poller - the number of OS threads is fixed by max_workers no matter
+# how many clusters are configured. Polls against the same source cluster
+# are additionally limited by a per-cluster semaphore, so the shard and
+# thread pool pollers don't pile onto one cluster at the same time.
+#
+#   A poll function runs a single collection cycle and returns; anything it
+# raises is logged and counted as a failed cycle. Scheduling (skipped ticks
+# on overrun, start jitter and backoff after failures) is handled by
+# scheduler.interval_scheduler.
+class collector_engine(object):
+
+    def add_poller(self, name, cluster_name, interval, poll_fn, *args, **kwargs):
+        poller_name = "%s[%s]" % (name, cluster_name)
+        self._pollers.append({
+            'name': poller_name,
+            'cluster': cluster_name,
+            'interval': interval,
+            # pollers start at a random offset within their first interval
+            'schedule': scheduler.interval_scheduler(
+                interval,
+                start_jitter=interval,
+                backoff_max=self.backoff_max,
+                name=poller_name),
+            'call': functools.partial(poll_fn, *args, **kwargs)
+        })
+
+    async def _poll_loop(self, poller):
+        log = logging.getLogger(__name__)
+        loop = asyncio.get_event_loop()
+        cluster_slots = self._cluster_slots[poller['cluster']]
+
+        sched = poller['schedule']
+        await asyncio.sleep(sched.start())
+        while True:
+            _st = time.time()
+            poll_ok = False
+            async with cluster_slots:
+                try:
+                    await loop.run_in_executor(self._executor, poller['call'])
+                    poll_ok = True
+                except (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout) as e:
+                    log.warning("%s connection error %s" % (poller['name'], str(e)))
+                except Exception as e:
+                    log.exception("%s poll failed: %s" % (poller['name'], repr(e)))
+            log.debug("%s poll complete %2.2f ms" % (poller['name'], (time.time() - _st) * 1000))
+
+            await asyncio.sleep(sched.next_delay(poll_ok))
+
+    def poller_stats(self):
+        return dict((p['name'], p['schedule'].stats()) for p in self._pollers)
+
+    async def _run(self):
+        self._cluster_slots = {}
+        for poller in self._pollers:
+            if (poller['cluster'] not in self._cluster_slots):
+                self._cluster_slots[poller['cluster']] = \
+                    asyncio.Semaphore(self.cluster_concurrency)
+        await asyncio.gather(*[
+            self._poll_loop(poller) for poller in self._pollers])
+
+    # blocks for the lifetime of the collector
+    def run(self):
+        log = logging.getLogger(__name__)
+        log.info("starting %d pollers across %d clusters (%d workers)" % (
+            len(self._pollers),
+            len(set(p['cluster'] for p in self._pollers)),
+            self.max_workers))
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers)
+        try:
+            asyncio.run(self._run())
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def __init__(self, max_workers=16, cluster_concurrency=1, backoff_max=600):
+        self.max_workers = max_workers
+        self.backoff_max = backoff_max
+        self.cluster_concurrency = cluster_concurrency
+        self._pollers = []
+        self._cluster_slots = {}
+        self._executor = None
+
+
+# source cluster clients are shared between the pollers of a cluster
+_source_clients = {}
+_source_clients_lock = threading.Lock()
+
+def source_client(cluster_name, hosts, es_cred):
+    with _source_clients_lock:
+        if (cluster_name not in _source_clients):
+            _source_clients[cluster_name] = elasticsearch.Elasticsearch(
+                hosts=hosts,
+                sniff_on_start=False,
+                sniff_on_connection_fail=False,
+                http_auth=(es_cred['user'], es_cred['pass']))
+        return _source_clients[cluster_name]
+
+
+# urllib3 connection with TCP keep-alive enabled on its sockets, so the
+# pooled connections to the monitoring cluster survive idle intervals and
+# dead peers are detected without waiting on a request timeout
+class keepalive_connection(elasticsearch.Urllib3HttpConnection):
+
+    def __init__(self, keepalive_idle=60, keepalive_interval=15, **kwargs):
+        super(keepalive_connection, self).__init__(**kwargs)
+        sock_opts = list(HTTPConnection.default_socket_options)
+        sock_opts.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        # the idle/interval knobs are not available on every platform
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock_opts.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_idle))
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            sock_opts.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, keepalive_interval))
+        self.pool.conn_kw['socket_options'] = sock_opts
+
+
+# The monitoring (destination) cluster client is shared by every poller
+# writing to the same hosts - one connection pool per destination, rather
+# than one per source cluster. The elasticsearch-py client is thread-safe;
+# maxsize should be at least the engine worker count, otherwise connections
+# beyond the pool size are opened and discarded on every cycle. The first
+# caller for a set of hosts decides the pool settings.
+_dest_clients = {}
+_dest_clients_lock = threading.Lock()
+
+def monitoring_client(hosts, es_cred, maxsize=16, keepalive_idle=60, keepalive_interval=15, timeout=30):
+    dest_key = json.dumps(hosts, sort_keys=True)
+    with _dest_clients_lock:
+        if (dest_key not in _dest_clients):
+            _dest_clients[dest_key] = elasticsearch.Elasticsearch(
+                hosts=hosts,
+                sniff_on_start=False,
+                sniff_on_connection_fail=False,
+                http_auth=(es_cred['user'], es_cred['pass']),
+                connection_class=keepalive_connection,
+                maxsize=maxsize,
+                keepalive_idle=keepalive_idle,
+                keepalive_interval=keepalive_interval,
+                timeout=timeout)
+        return _dest_clients[dest_key]
+
+
+def load_config():
+    try:
+        with open('auth.yml') as f:
+            es_cred = yaml.load(f)['creds']
+    except Exception as e:
+        # log error
+        raise e
+
+    with open('_clusters.yml') as f:
+        clusters = yaml.load(f)
+
+    return es_cred, clusters
+
+
+# run the shard and thread pool pollers for every cluster on one engine
+def main():
+
+    import shard_stats
+    import threadpool_stats
+
+    es_cred, clusters = load_config()
+
+    engine = collector_engine()
+    shard_stats.add_shard_pollers(engine, clusters, es_cred, interval=30)
+    threadpool_stats.add_stat_pollers(engine, clusters, es_cred, interval=30)
+    engine.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import logging
+
+import elasticsearch
+
+import bulk_base
+
+log = logging.getLogger(__name__)
+
+# Batched _bulk writer for the elasticsearch-py clients used by the
+# collectors - a bulk_base.bulk_buffer posting through the client's bulk().
+# Connection errors and requests elasticsearch turns down (TransportError)
+# report the whole batch as failed.
+#
+# The writer is not thread-safe; use one writer per collection loop.
+class bulk_writer(bulk_base.bulk_buffer):
+
+    def __init__(self, es_conn, index=None, doc_type='doc', max_docs=1000, max_bytes=5*1024*1024):
+        super(bulk_writer, self).__init__(
+            lambda bulk_body: es_conn.bulk(body=bulk_body),
+            index=index,
+            doc_type=doc_type,
+            max_docs=max_docs,
+            max_bytes=max_bytes,
+            post_errors=(elasticsearch.TransportError,))
+        self._es = es_conn
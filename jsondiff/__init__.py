@@ -2,9 +2,12 @@ __version__ = '1.1.2'
 
 import sys
 import json
+import math
+import bisect
 
 from .symbols import *
 from .symbols import Symbol
+from .stream import JsonTokenizer, value_events, diff_events
 
 # rules
 # - keys and strings which start with $ are escaped to $$
@@ -49,6 +52,71 @@ class JsonLoader(object):
 default_loader = JsonLoader()
 
 
+# added to the similarity of every matched list element pair, so that of two
+# alignments with the same total similarity the one with more pairs wins;
+# it keeps the score (pairs and total) the same whichever way a list is split
+_match_bonus = 1e-6
+
+
+# hashable stand-in for a value - equal keys mean equal values; missing for
+# values that can't be hashed
+def _structural_key(x):
+    try:
+        return _freeze(x)
+    except TypeError:
+        return missing
+
+
+# dict, list, tuple or set for containers that are diffed; None otherwise -
+# values of different kinds (or two other values) are never similar
+def _container_kind(x):
+    for kind in (dict, list, tuple, set):
+        if isinstance(x, kind):
+            return kind
+    return None
+
+
+# what two containers of the same kind must have in common to be similar
+# at all: a key for dicts; an equal element, or nested containers of the
+# same kind, for lists, tuples and sets. Dicts also get (key, value) for
+# plain values, which picks out likely pairs among dicts with the same keys.
+def _similarity_features(x):
+    kind = _container_kind(x)
+    if kind is None:
+        return set()
+    features = set()
+    if kind is dict:
+        for k, v in x.items():
+            features.add((dict, k))
+            if _container_kind(v) is None:
+                try:
+                    features.add((dict, k, v))
+                except TypeError:
+                    pass
+        return features
+    for v in x:
+        v_kind = _container_kind(v)
+        if v_kind is not None:
+            features.add((kind, v_kind))
+        else:
+            try:
+                features.add((kind, None, v))
+            except TypeError:
+                features.add((kind, None))
+    return features
+
+
+def _freeze(x):
+    if isinstance(x, dict):
+        return (dict, frozenset((k, _freeze(v)) for k, v in x.items()))
+    elif isinstance(x, (list, tuple)):
+        return (type(x), tuple(_freeze(v) for v in x))
+    elif isinstance(x, set):
+        return (set, frozenset(x))
+    hash(x)
+    return x
+
+
 class JsonDiffSyntax(object):
     def emit_set_diff(self, a, b, s, added, removed):
         raise NotImplementedError()
@@ -349,12 +417,49 @@ builtin_syntaxes = {
 }
 
 
+class _DiffContext(object):
+    # the state of a single diff() / similarity() call, passed down the
+    # calls that work it out - nothing call specific is kept on the differ,
+    # so one differ can be shared between threads. scoring() gives the
+    # context for score-only work below a diff, sharing the memo.
+    def __init__(self, score_only=False, memo=None):
+        self.score_only = score_only
+        # (id(a), id(b)) -> (a, b, s) and (a, b, d, s); a and b are kept so
+        # their ids can't be reused while the entry is alive
+        if memo is None:
+            memo = ({}, {})
+        self.memo_s, self.memo_d = memo
+        self._scoring = self if score_only else None
+
+    def scoring(self):
+        if self._scoring is None:
+            self._scoring = _DiffContext(True, (self.memo_s, self.memo_d))
+        return self._scoring
+
+    def reset_memo(self):
+        self.memo_s.clear()
+        self.memo_d.clear()
+
+
 class JsonDiffer(object):
 
     class Options(object):
         pass
 
-    def __init__(self, syntax='compact', load=False, dump=False, marshal=False, loader=default_loader, dumper=default_dumper):
+    # longest list piece diffed with a full similarity matrix
+    list_diff_leaf_size = 128
+    # lists (after trimming equal ends) with more element pairs than this are
+    # first tried anchored on equal elements before the similarity matching
+    # (the anchors are dropped if an alignment across them scores better)
+    list_diff_max_cells = 1 << 16
+    # candidate pairs scored when matching up set and unordered list
+    # elements
+    set_diff_max_pairs = 10000
+    # container pairs remembered per diff() / similarity() call; the memo
+    # starts over when it fills up
+    memo_size = 100000
+
+    def __init__(self, syntax='compact', load=False, dump=False, marshal=False, loader=default_loader, dumper=default_dumper, unordered_keys=None):
         self.options = JsonDiffer.Options()
         self.options.syntax = builtin_syntaxes.get(syntax, syntax)
         self.options.load = load
@@ -362,95 +467,416 @@ class JsonDiffer(object):
         self.options.marshal = marshal
         self.options.loader = loader
         self.options.dumper = dumper
+        # dict keys whose list values are compared without regard to order
+        self.options.unordered_keys = frozenset(unordered_keys or ())
         self._symbol_map = {
             '$' + symbol.label: symbol
             for symbol in _all_symbols_
         }
 
-    def _list_diff_0(self, C, X, Y, i, j):
-        if i > 0 and j > 0:
-            d, s = self._obj_diff(X[i-1], Y[j-1])
-            if s > 0 and C[i][j] == C[i-1][j-1] + s:
-                for annotation in self._list_diff_0(C, X, Y, i-1, j-1):
-                    yield annotation
-                yield (0, d, j-1, s)
-                return
-        if j > 0 and (i == 0 or C[i][j-1] >= C[i-1][j]):
-            for annotation in self._list_diff_0(C, X, Y, i, j-1):
-                yield annotation
-            yield (1, Y[j-1], j-1, 0.0)
-            return
-        if i > 0 and (j == 0 or C[i][j-1] < C[i-1][j]):
-            for annotation in self._list_diff_0(C, X, Y, i-1, j):
-                yield annotation
-            yield (-1, X[i-1], i-1, 0.0)
-            return
-
-    def _list_diff(self, X, Y):
+    def _list_diff_0(self, C, S, X, Y, i, j, ctx):
+        # walks back from (i, j) to the origin - one step per annotation, no
+        # recursion - and returns the annotations in list order
+        path = []
+        while i > 0 or j > 0:
+            if i > 0 and j > 0:
+                s = S[i][j]
+                if s > 0 and C[i][j] == C[i-1][j-1] + s:
+                    d, s = self._obj_diff(X[i-1], Y[j-1], ctx)
+                    path.append((0, d, j-1, s))
+                    i -= 1
+                    j -= 1
+                    continue
+            if j > 0 and (i == 0 or C[i][j-1] >= C[i-1][j]):
+                path.append((1, Y[j-1], j-1, 0.0))
+                j -= 1
+            else:
+                path.append((-1, X[i-1], i-1, 0.0))
+                i -= 1
+        path.reverse()
+        return path
+
+    def _list_item_similarity(self, x, y, ctx):
+        # equal elements score 1.0 and other unequal values 0.0 without
+        # building a diff; only containers of the same kind are diffed
+        if x is y or x == y:
+            return 1.0
+        kind = _container_kind(x)
+        if kind is not None and isinstance(y, kind):
+            return self._obj_similarity(x, y, ctx)
+        return 0.0
+
+    def _list_diff_leaf(self, X, Y, ctx):
         # LCS
         m = len(X)
         n = len(Y)
         # An (m+1) times (n+1) matrix
         C = [[0 for j in range(n+1)] for i in range(m+1)]
+        # element similarities, kept for the backtrack
+        S = [[0.0 for j in range(n+1)] for i in range(m+1)]
         for i in range(1, m+1):
             for j in range(1, n+1):
-                _, s = self._obj_diff(X[i-1], Y[j-1])
+                s = self._list_item_similarity(X[i-1], Y[j-1], ctx)
+                if s > 0:
+                    s += _match_bonus
+                S[i][j] = s
                 # Following lines are part of the original LCS algorithm
                 # left in the code in case modification turns out to be problematic
                 #if X[i-1] == Y[j-1]:
                 #    C[i][j] = C[i-1][j-1] + 1
                 #else:
                 C[i][j] = max(C[i][j-1], C[i-1][j], C[i-1][j-1] + s)
+        return self._list_diff_0(C, S, X, Y, m, n, ctx)
+
+    def _list_diff_scores(self, X, Y, ctx):
+        # last row of the LCS matrix, one row at a time
+        row = [0.0] * (len(Y) + 1)
+        for x in X:
+            diag = row[0]
+            if isinstance(x, (dict, list, tuple, set)):
+                for j, y in enumerate(Y):
+                    up = row[j+1]
+                    best = row[j] if row[j] > up else up
+                    # similarities are at most 1.0, so the pair is only
+                    # scored when it could beat the best neighbour
+                    if diag + 1.0 + _match_bonus > best:
+                        s = self._list_item_similarity(x, y, ctx)
+                        if s > 0 and diag + s + _match_bonus > best:
+                            best = diag + s + _match_bonus
+                    row[j+1] = best
+                    diag = up
+            else:
+                # scalars only ever score 1.0 or 0.0
+                for j, y in enumerate(Y):
+                    up = row[j+1]
+                    best = row[j] if row[j] > up else up
+                    if (x is y or x == y) and diag + 1.0 + _match_bonus > best:
+                        best = diag + 1.0 + _match_bonus
+                    row[j+1] = best
+                    diag = up
+        return row
+
+    def _list_diff_beats(self, X, Y, score, ctx):
+        # whether some alignment of X and Y scores above score. A path
+        # through (i, j) has at most min(i, j) + min(m - i, n - j) pairs, so
+        # only the cells where that could beat score are visited - a narrow
+        # band around the diagonals when score is close to a full match
+        m = len(X)
+        n = len(Y)
+        pairs = score / (1.0 + _match_bonus)
+        if min(m, n) <= pairs:
+            return False
+        unreached = float('-inf')
+        row = None
+        for i in range(m + 1):
+            prev = row
+            row = [unreached] * (n + 1)
+            lo = max(0, int(math.floor(pairs - (m - i))) + 1)
+            hi = min(n, int(math.ceil(i + n - pairs)) - 1)
+            for j in range(lo, hi + 1):
+                if i == 0 and j == 0:
+                    row[j] = 0.0
+                    continue
+                best = row[j-1] if j > 0 else unreached
+                if prev is not None:
+                    if prev[j] > best:
+                        best = prev[j]
+                    if j > 0 and prev[j-1] + 1.0 + _match_bonus > best:
+                        s = self._list_item_similarity(X[i-1], Y[j-1], ctx)
+                        if s > 0 and prev[j-1] + s + _match_bonus > best:
+                            best = prev[j-1] + s + _match_bonus
+                row[j] = best
+        return row[n] > score
+
+    def _list_diff_weighted(self, X, Y, xa, xb, ya, yb, path, ctx):
+        # Hirschberg: split X in half, find where the best path crosses the
+        # split from a forward and a backward score row, and solve the two
+        # halves - linear space; pieces up to list_diff_leaf_size elements
+        # use the full matrix
+        pending = [(xa, xb, ya, yb)]
+        while pending:
+            xa, xb, ya, yb = pending.pop()
+            m = xb - xa
+            n = yb - ya
+            if m == 0:
+                for j in range(ya, yb):
+                    path.append((1, Y[j], j, 0.0))
+            elif n == 0:
+                for i in range(xa, xb):
+                    path.append((-1, X[i], i, 0.0))
+            elif m + n <= self.list_diff_leaf_size:
+                for sign, value, pos, s in self._list_diff_leaf(X[xa:xb], Y[ya:yb], ctx):
+                    path.append((sign, value, pos + (xa if sign == -1 else ya), s))
+            elif m == 1:
+                best_j = None
+                best_s = 0.0
+                for j in range(ya, yb):
+                    s = self._list_item_similarity(X[xa], Y[j], ctx)
+                    if s > best_s:
+                        best_j = j
+                        best_s = s
+                if best_j is None:
+                    path.append((-1, X[xa], xa, 0.0))
+                for j in range(ya, yb):
+                    if j == best_j:
+                        d, s = self._obj_diff(X[xa], Y[j], ctx)
+                        path.append((0, d, j, s))
+                    else:
+                        path.append((1, Y[j], j, 0.0))
+            else:
+                xm = xa + m // 2
+                fwd = self._list_diff_scores(X[xa:xm], Y[ya:yb], ctx)
+                bwd = self._list_diff_scores(X[xm:xb][::-1], Y[ya:yb][::-1], ctx)
+                split = max(range(n+1), key=lambda j: fwd[j] + bwd[n-j])
+                pending.append((xm, xb, ya + split, yb))
+                pending.append((xa, xm, ya, ya + split))
+
+    def _list_diff_anchors(self, X, Y, xa, xb, ya, yb):
+        # patience diff: elements that are equal and occur once on both sides
+        # are matched first (longest increasing run of them), and the gaps
+        # between them are trimmed and anchored again. Gaps without anchors
+        # are left to the similarity matching.
+        kx = dict((i, _structural_key(X[i])) for i in range(xa, xb))
+        ky = dict((j, _structural_key(Y[j])) for j in range(ya, yb))
+        segments = []
+        pending = [('range', xa, xb, ya, yb)]
+        while pending:
+            task = pending.pop()
+            if task[0] != 'range':
+                segments.append(task)
+                continue
+            _, xa, xb, ya, yb = task
+            head = []
+            while xa < xb and ya < yb and kx[xa] is not missing and kx[xa] == ky[ya]:
+                head.append(('match', xa, ya))
+                xa += 1
+                ya += 1
+            tail = []
+            while xa < xb and ya < yb and kx[xb-1] is not missing and kx[xb-1] == ky[yb-1]:
+                xb -= 1
+                yb -= 1
+                tail.append(('match', xb, yb))
+
+            # key -> [count in X, count in Y, position in X, position in Y]
+            counts = {}
+            for i in range(xa, xb):
+                if kx[i] is not missing:
+                    c = counts.setdefault(kx[i], [0, 0, i, None])
+                    c[0] += 1
+            for j in range(ya, yb):
+                c = counts.get(ky[j]) if ky[j] is not missing else None
+                if c is not None:
+                    c[1] += 1
+                    c[3] = j
+            unique = sorted(
+                (c[2], c[3]) for c in counts.values() if c[0] == 1 and c[1] == 1
+            )
+
+            # longest run of unique pairs increasing in both lists
+            tops = []
+            top_j = []
+            prev = []
+            for k, (i, j) in enumerate(unique):
+                t = bisect.bisect_left(top_j, j)
+                prev.append(tops[t-1] if t > 0 else None)
+                if t == len(tops):
+                    tops.append(k)
+                    top_j.append(j)
+                else:
+                    tops[t] = k
+                    top_j[t] = j
+            anchored = []
+            k = tops[-1] if tops else None
+            while k is not None:
+                anchored.append(unique[k])
+                k = prev[k]
+            anchored.reverse()
+
+            pending.extend(tail)
+            if not anchored:
+                if xa < xb or ya < yb:
+                    pending.append(('gap', xa, xb, ya, yb))
+            else:
+                ends = [(xa - 1, ya - 1)] + anchored + [(xb, yb)]
+                for k in range(len(ends) - 1, 0, -1):
+                    (i0, j0), (i1, j1) = ends[k-1], ends[k]
+                    if k < len(ends) - 1:
+                        pending.append(('match', i1, j1))
+                    pending.append(('range', i0 + 1, i1, j0 + 1, j1))
+            pending.extend(reversed(head))
+        return segments
+
+    def _list_diff_path(self, X, Y, xa, xb, ya, yb, ctx):
+        path = []
+        if (xb - xa) * (yb - ya) > self.list_diff_max_cells:
+            for segment in self._list_diff_anchors(X, Y, xa, xb, ya, yb):
+                if segment[0] == 'match':
+                    _, i, j = segment
+                    path.append((0, None, j, 1.0))
+                else:
+                    _, i0, i1, j0, j1 = segment
+                    self._list_diff_weighted(X, Y, i0, i1, j0, j1, path, ctx)
+            # anchoring on equal elements can cost matches that cross them,
+            # so the anchored alignment is only kept when nothing beats it
+            score = sum(step[3] + _match_bonus for step in path if step[0] == 0)
+            if not self._list_diff_beats(X[xa:xb], Y[ya:yb], score + _match_bonus / 2, ctx):
+                return path
+            path = []
+        self._list_diff_weighted(X, Y, xa, xb, ya, yb, path, ctx)
+        return path
+
+    def _list_diff(self, X, Y, ctx):
+        m = len(X)
+        n = len(Y)
+        # common prefix and suffix
+        lo = 0
+        while lo < m and lo < n and (X[lo] is Y[lo] or X[lo] == Y[lo]):
+            lo += 1
+        hi = 0
+        while lo + hi < m and lo + hi < n and (X[m-1-hi] is Y[n-1-hi] or X[m-1-hi] == Y[n-1-hi]):
+            hi += 1
         inserted = []
         deleted = []
         changed = {}
-        tot_s = 0.0
-        for sign, value, pos, s in self._list_diff_0(C, X, Y, len(X), len(Y)):
+        tot_s = float(lo + hi)
+        for sign, value, pos, s in self._list_diff_path(X, Y, lo, m - hi, lo, n - hi, ctx):
             if sign == 1:
                 inserted.append((pos, value))
             elif sign == -1:
-                deleted.insert(0, (pos, value))
+                deleted.append((pos, value))
             elif sign == 0 and s < 1:
                 changed[pos] = value
             tot_s += s
+        deleted.reverse()
         tot_n = len(X) + len(inserted)
         if tot_n == 0:
             s = 1.0
         else:
             s = tot_s / tot_n
+        if ctx.score_only:
+            return None, s
         return self.options.syntax.emit_list_diff(X, Y, s, inserted, changed, deleted), s
 
-    def _set_diff(self, a, b):
+    def _best_pairs(self, xs, ys, ctx):
+        # one-to-one pairing of xs and ys, most similar pairs first, as
+        # [(s, x index, y index)] with s > 0. Only pairs sharing one of their
+        # _similarity_features are scored; past set_diff_max_pairs candidates
+        # the most common features are left out.
+        x_features = [_similarity_features(x) for x in xs]
+        y_index = {}
+        for j, y in enumerate(ys):
+            for feature in _similarity_features(y):
+                y_index.setdefault(feature, []).append(j)
+        x_counts = {}
+        for features in x_features:
+            for feature in features:
+                if feature in y_index:
+                    x_counts[feature] = x_counts.get(feature, 0) + 1
+        used = set()
+        n_pairs = 0
+        costs = [(n * len(y_index[f]), f) for f, n in x_counts.items()]
+        for cost, feature in sorted(costs, key=lambda x: x[0]):
+            n_pairs += cost
+            if n_pairs > self.set_diff_max_pairs:
+                break
+            used.add(feature)
+
+        ranking = []
+        for i, features in enumerate(x_features):
+            candidates = set()
+            for feature in features & used:
+                candidates.update(y_index[feature])
+            for j in sorted(candidates):
+                ranking.append((self._obj_similarity(xs[i], ys[j], ctx), i, j))
+        ranking.sort(reverse=True, key=lambda x: x[0])
+
+        pairs = []
+        xs_left = set(range(len(xs)))
+        ys_left = set(range(len(ys)))
+        for s, i, j in ranking:
+            if s <= 0 or not xs_left or not ys_left:
+                break
+            if i in xs_left and j in ys_left:
+                xs_left.discard(i)
+                ys_left.discard(j)
+                pairs.append((s, i, j))
+        return pairs
+
+    def _set_diff(self, a, b, ctx):
         removed = a.difference(b)
         added = b.difference(a)
         if not removed and not added:
             return {}, 1.0
-        ranking = sorted(
-            (
-                (self._obj_diff(x, y)[1], x, y)
-                for x in removed
-                for y in added
-            ),
-            reverse=True,
-            key=lambda x: x[0]
-        )
-        r2 = set(removed)
-        a2 = set(added)
-        n_common = len(a) - len(removed)
-        s_common = float(n_common)
-        for s, x, y in ranking:
-            if x in r2 and y in a2:
-                r2.discard(x)
-                a2.discard(y)
-                s_common += s
-                n_common += 1
-            if not r2 or not a2:
-                break
+        s_common = float(len(a) - len(removed))
+        for s, i, j in self._best_pairs(list(removed), list(added), ctx):
+            s_common += s
         n_tot = len(a) + len(added)
         s = s_common / n_tot if n_tot != 0 else 1.0
+        if ctx.score_only:
+            return None, s
         return self.options.syntax.emit_set_diff(a, b, s, added, removed), s
 
-    def _dict_diff(self, a, b):
+    def _unordered_list_diff(self, X, Y, ctx):
+        # X and Y as multisets: equal elements match wherever they are, the
+        # rest are paired up by similarity as in sets. Patching keeps X's
+        # order (less the deleted elements) and appends the inserted ones.
+        y_positions = {}
+        y_left = []
+        for j, y in enumerate(Y):
+            key = _structural_key(y)
+            if key is missing:
+                y_left.append(j)
+            else:
+                y_positions.setdefault(key, []).append(j)
+        for positions in y_positions.values():
+            positions.reverse()
+        x_left = []
+        for i, x in enumerate(X):
+            key = _structural_key(x)
+            positions = y_positions.get(key) if key is not missing else None
+            if positions:
+                positions.pop()
+            else:
+                x_left.append(i)
+        for positions in y_positions.values():
+            y_left.extend(positions)
+        y_left.sort()
+
+        paired = {}
+        for s, i, j in self._best_pairs([X[i] for i in x_left], [Y[j] for j in y_left], ctx):
+            paired[x_left[i]] = (s, y_left[j])
+        x_left = set(x_left) - set(paired)
+        y_paired = set(j for s, j in paired.values())
+
+        inserted = []
+        deleted = []
+        changed = {}
+        tot_s = 0.0
+        pos = 0
+        for i, x in enumerate(X):
+            if i in x_left:
+                deleted.append((i, x))
+                continue
+            if i in paired:
+                s, j = paired[i]
+                if s < 1 and not ctx.score_only:
+                    changed[pos] = self._obj_diff(x, Y[j], ctx)[0]
+                tot_s += s
+            else:
+                tot_s += 1.0
+            pos += 1
+        deleted.reverse()
+        for j in y_left:
+            if j not in y_paired:
+                inserted.append((pos, Y[j]))
+                pos += 1
+        tot_n = len(X) + len(inserted)
+        s = tot_s / tot_n if tot_n != 0 else 1.0
+        if ctx.score_only:
+            return None, s
+        return self.options.syntax.emit_list_diff(X, Y, s, inserted, changed, deleted), s
+
+    def _dict_diff(self, a, b, ctx):
         removed = {}
         nremoved = 0
         nadded = 0
@@ -465,7 +891,10 @@ class JsonDiffer(object):
                 removed[k] = v
             else:
                 nmatched += 1
-                d, s = self._obj_diff(v, w)
+                if k in self.options.unordered_keys and _container_kind(v) in (list, tuple) and isinstance(w, _container_kind(v)):
+                    d, s = self._unordered_list_diff(v, w, ctx)
+                else:
+                    d, s = self._obj_diff(v, w, ctx)
                 if s < 1.0:
                     changed[k] = d
                 smatched += 0.5 + 0.5 * s
@@ -475,30 +904,61 @@ class JsonDiffer(object):
                 added[k] = v
         n_tot = nremoved + nmatched + nadded
         s = smatched / n_tot if n_tot != 0 else 1.0
+        if ctx.score_only:
+            return None, s
         return self.options.syntax.emit_dict_diff(a, b, s, added, changed, removed), s
 
-    def _obj_diff(self, a, b):
+    def _memo_diff(self, diff_fn, a, b, ctx):
+        # container pairs are diffed once per call - the list diff scores
+        # pairs, then asks again for the payload of the ones it matched
+        key = (id(a), id(b))
+        if ctx.score_only:
+            hit = ctx.memo_s.get(key)
+            if hit is not None:
+                return None, hit[2]
+        else:
+            hit = ctx.memo_d.get(key)
+            if hit is not None:
+                return hit[2], hit[3]
+        d, s = diff_fn(a, b, ctx)
+        if len(ctx.memo_s) + len(ctx.memo_d) >= self.memo_size:
+            ctx.reset_memo()
+        ctx.memo_s[key] = (a, b, s)
+        if not ctx.score_only:
+            ctx.memo_d[key] = (a, b, d, s)
+        return d, s
+
+    def _obj_similarity(self, a, b, ctx):
+        # the score alone - no diff payloads are built below this call
+        return self._obj_diff(a, b, ctx.scoring())[1]
+
+    def _value_diff(self, a, b, s, ctx):
+        if ctx.score_only:
+            return None, s
+        return self.options.syntax.emit_value_diff(a, b, s), s
+
+    def _obj_diff(self, a, b, ctx):
         if a is b:
-            return self.options.syntax.emit_value_diff(a, b, 1.0), 1.0
+            return self._value_diff(a, b, 1.0, ctx)
         if isinstance(a, dict) and isinstance(b, dict):
-            return self._dict_diff(a, b)
+            return self._memo_diff(self._dict_diff, a, b, ctx)
         elif isinstance(a, tuple) and isinstance(b, tuple):
-            return self._list_diff(a, b)
+            return self._memo_diff(self._list_diff, a, b, ctx)
         elif isinstance(a, list) and isinstance(b, list):
-            return self._list_diff(a, b)
+            return self._memo_diff(self._list_diff, a, b, ctx)
         elif isinstance(a, set) and isinstance(b, set):
-            return self._set_diff(a, b)
+            return self._memo_diff(self._set_diff, a, b, ctx)
         elif a != b:
-            return self.options.syntax.emit_value_diff(a, b, 0.0), 0.0
+            return self._value_diff(a, b, 0.0, ctx)
         else:
-            return self.options.syntax.emit_value_diff(a, b, 1.0), 1.0
+            return self._value_diff(a, b, 1.0, ctx)
 
     def diff(self, a, b, fp=None):
         if self.options.load:
             a = self.options.loader(a)
             b = self.options.loader(b)
 
-        d, s = self._obj_diff(a, b)
+        d, s = self._obj_diff(a, b, _DiffContext())
 
         if self.options.marshal or self.options.dump:
             d = self.marshal(d)
@@ -508,14 +968,30 @@ class JsonDiffer(object):
         else:
             return d
 
+    def diff_iter(self, a, b):
+        # streaming diff: yields (symbol, path, a value, b value) operations,
+        # see stream.diff_events. With load, a and b are JSON text or file
+        # objects, read a chunk at a time.
+        if self.options.load:
+            events_a = JsonTokenizer(a)
+            events_b = JsonTokenizer(b)
+        else:
+            events_a = value_events(a)
+            events_b = value_events(b)
+
+        for op in diff_events(events_a, events_b):
+            if self.options.marshal or self.options.dump:
+                op = self.marshal(op)
+            if self.options.dump:
+                op = self.options.dumper(op)
+            yield op
+
     def similarity(self, a, b):
         if self.options.load:
             a = self.options.loader(a)
             b = self.options.loader(b)
 
-        d, s = self._obj_diff(a, b)
-
-        return s
+        return self._obj_similarity(a, b, _DiffContext())
 
     def patch(self, a, d, fp=None):
         if self.options.load:
@@ -557,19 +1033,45 @@ class JsonDiffer(object):
                 return x[1:]
         return x
 
+    def _transform(self, d, fn):
+        # copy of d with fn applied to dict keys and to the values that
+        # aren't dicts, lists or tuples; walks the containers with an
+        # explicit stack so deep documents don't hit the recursion limit
+        top = []
+        stack = [(d, top, None, None)]
+        while stack:
+            src, parent, key, frame = stack.pop()
+            if frame is None:
+                if isinstance(src, dict):
+                    frame = ({}, iter(src.items()))
+                elif isinstance(src, (list, tuple)):
+                    frame = ([], iter(src))
+                else:
+                    value = fn(src)
+                    if isinstance(parent, dict):
+                        parent[key] = value
+                    else:
+                        parent.append(value)
+                    continue
+            out, items = frame
+            for item in items:
+                stack.append((src, parent, key, frame))
+                if isinstance(out, dict):
+                    stack.append((item[1], out, fn(item[0]), None))
+                else:
+                    stack.append((item, out, None, None))
+                break
+            else:
+                if isinstance(src, tuple):
+                    out = type(src)(out)
+                if isinstance(parent, dict):
+                    parent[key] = out
+                else:
+                    parent.append(out)
+        return top[0]
+
     def unmarshal(self, d):
-        if isinstance(d, dict):
-            return {
-                self._unescape(k): self.unmarshal(v)
-                for k, v in d.items()
-            }
-        elif isinstance(d, (list, tuple)):
-            return type(d)(
-                self.unmarshal(x)
-                for x in d
-            )
-        else:
-            return self._unescape(d)
+        return self._transform(d, self._unescape)
 
     def _escape(self, o):
         if type(o) is Symbol:
@@ -579,24 +1081,17 @@ class JsonDiffer(object):
         return o
 
     def marshal(self, d):
-        if isinstance(d, dict):
-            return {
-                self._escape(k): self.marshal(v)
-                for k, v in d.items()
-            }
-        elif isinstance(d, (list, tuple)):
-            return type(d)(
-                self.marshal(x)
-                for x in d
-            )
-        else:
-            return self._escape(d)
+        return self._transform(d, self._escape)
 
 
 def diff(a, b, fp=None, cls=JsonDiffer, **kwargs):
     return cls(**kwargs).diff(a, b, fp)
 
 
+def diff_iter(a, b, cls=JsonDiffer, **kwargs):
+    return cls(**kwargs).diff_iter(a, b)
+
+
 def patch(a, d, fp=None, cls=JsonDiffer, **kwargs):
     return cls(**kwargs).patch(a, d, fp)
 
@@ -608,6 +1103,7 @@ def similarity(a, b, cls=JsonDiffer, **kwargs):
 __all__ = [
     "similarity",
     "diff",
+    "diff_iter",
     "JsonDiffer",
     "JsonDumper",
     "JsonLoader",
@@ -0,0 +1,409 @@
+import re
+import sys
+import codecs
+
+from json.decoder import scanstring
+
+from .symbols import insert, delete, replace, missing
+
+# Streaming diff for documents too large to load.
+#
+# JsonTokenizer reads JSON text (a file object, str or bytes) a chunk at a
+# time and yields parse events:
+#
+#   ('start_map', None), ('map_key', key), ('end_map', None),
+#   ('start_array', None), ('end_array', None), ('value', scalar)
+#
+# diff_events() walks two event streams side by side and yields diff
+# operations as it goes, with path a tuple of keys and array indices:
+#
+#   (insert, path, missing, b value)
+#   (delete, path, a value, missing)
+#   (replace, path, a value, b value)
+#
+# Object keys are aligned as they arrive: keys in the same order stream
+# through, and a key that isn't next on the other side is set aside until
+# its counterpart turns up (whichever of the two values ends first is
+# loaded). Arrays are compared position by position. Memory follows the
+# nesting depth, plus the inserted, deleted and out-of-order values.
+#
+# Nothing recurses on the nesting depth: the tokenizer, value_events() and
+# _load() keep their own stacks, and the map and array diffs hand nested
+# values back to diff_events() as generators to run rather than calling
+# each other.
+
+PY3 = sys.version_info[0] == 3
+
+if PY3:
+    string_types = str
+else:
+    string_types = basestring
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_number = re.compile(r'-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+_literals = [
+    ('true', True),
+    ('false', False),
+    ('null', None),
+    ('NaN', float('nan')),
+    ('Infinity', float('inf')),
+    ('-Infinity', float('-inf')),
+]
+_closers = {
+    '{': ('}', 'end_map'),
+    '[': (']', 'end_array'),
+}
+_end = object()
+
+
+class JsonTokenizer(object):
+    def __init__(self, src, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self._buf = u''
+        self._pos = 0
+        # characters dropped from the front of the buffer
+        self._offset = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        if isinstance(src, (bytes, string_types)):
+            self._src = None
+            self._buf = self._decode(src, True)
+        else:
+            self._src = src
+
+    def _decode(self, chunk, final=False):
+        if isinstance(chunk, bytes):
+            return self._decoder.decode(chunk, final)
+        return chunk
+
+    def _more(self):
+        # appends the next chunk; False at the end of the input
+        if self._src is None:
+            return False
+        chunk = self._src.read(self.chunk_size)
+        if not chunk:
+            self._src = None
+            self._buf = self._buf[self._pos:] + self._decoder.decode(b'', True)
+        else:
+            self._buf = self._buf[self._pos:] + self._decode(chunk)
+        self._offset += self._pos
+        self._pos = 0
+        return True
+
+    def _error(self, msg):
+        return ValueError("%s: char %d" % (msg, self._offset + self._pos))
+
+    def _peek(self):
+        # the next non-whitespace character, '' at the end of the input; a
+        # single space (json.dump separators) is skipped without the regex
+        buf = self._buf
+        pos = self._pos
+        if pos + 1 < len(buf):
+            c = buf[pos]
+            if c not in ' \t\n\r':
+                return c
+            if c == ' ' and buf[pos+1] not in ' \t\n\r':
+                self._pos = pos + 1
+                return buf[pos+1]
+        while True:
+            self._pos = _whitespace.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._more():
+                return ''
+
+    def _string(self):
+        # find the closing quote before decoding, so that a string spread
+        # over many chunks is scanned once rather than again on each chunk
+        scan = self._pos + 1
+        while True:
+            quote = self._buf.find('"', scan)
+            if quote < 0:
+                # _more() moves the text at _pos to the front of the buffer
+                scan = len(self._buf) - self._pos
+                if not self._more():
+                    raise self._error("Invalid string")
+                continue
+            # an odd number of backslashes escapes the quote
+            bs = quote
+            while self._buf[bs - 1] == '\\':
+                bs -= 1
+            if (quote - bs) % 2 == 0:
+                break
+            scan = quote + 1
+        try:
+            value, end = scanstring(self._buf, self._pos + 1)
+        except ValueError:
+            raise self._error("Invalid string")
+        self._pos = end
+        return value
+
+    def _key(self):
+        if self._peek() != '"':
+            raise self._error("Expecting property name enclosed in double quotes")
+        key = self._string()
+        if self._peek() != ':':
+            raise self._error("Expecting ':' delimiter")
+        self._pos += 1
+        return key
+
+    def _scalar(self):
+        c = self._peek()
+        if c == '"':
+            return self._string()
+        while len(self._buf) - self._pos < 9 and self._more():
+            pass
+        for text, value in _literals:
+            if self._buf.startswith(text, self._pos):
+                self._pos += len(text)
+                return value
+        # a number cut short by the end of the buffer may still go on: "1."
+        # or "1e+" match as "1", so read on until a few characters follow it
+        m = _number.match(self._buf, self._pos)
+        while m is not None and len(self._buf) - m.end() < 3 and self._more():
+            m = _number.match(self._buf, self._pos)
+        if m is None:
+            raise self._error("Expecting value")
+        self._pos = m.end()
+        if m.group(1) or m.group(2):
+            return float(m.group())
+        return int(m.group())
+
+    def __iter__(self):
+        containers = []
+        while True:
+            c = self._peek()
+            if c == '{' or c == '[':
+                self._pos += 1
+                closer, end_event = _closers[c]
+                yield ('start_map' if c == '{' else 'start_array', None)
+                if self._peek() == closer:
+                    self._pos += 1
+                    yield (end_event, None)
+                else:
+                    containers.append(c)
+                    if c == '{':
+                        yield ('map_key', self._key())
+                    continue
+            else:
+                yield ('value', self._scalar())
+
+            # after a value: separators and closing brackets
+            while True:
+                c = self._peek()
+                if not containers:
+                    if c:
+                        raise self._error("Extra data")
+                    return
+                closer, end_event = _closers[containers[-1]]
+                if c == ',':
+                    self._pos += 1
+                    if containers[-1] == '{':
+                        yield ('map_key', self._key())
+                    break
+                elif c == closer:
+                    self._pos += 1
+                    containers.pop()
+                    yield (end_event, None)
+                else:
+                    raise self._error("Expecting ',' delimiter")
+
+
+def value_events(value):
+    # parse events for an already loaded value
+    stack = [iter([(None, value)])]
+    closers = [None]
+    while stack:
+        item = next(stack[-1], _end)
+        if item is _end:
+            stack.pop()
+            end_event = closers.pop()
+            if end_event is not None:
+                yield (end_event, None)
+            continue
+        key, v = item
+        if key is not None:
+            yield ('map_key', key[0])
+        if isinstance(v, dict):
+            yield ('start_map', None)
+            stack.append(((k,), vv) for k, vv in v.items())
+            closers.append('end_map')
+        elif isinstance(v, (list, tuple)):
+            yield ('start_array', None)
+            stack.append((None, vv) for vv in v)
+            closers.append('end_array')
+        else:
+            yield ('value', v)
+
+
+class _EventReader(object):
+    def __init__(self, events):
+        self._events = iter(events)
+        self._unread = []
+
+    def next(self):
+        if self._unread:
+            return self._unread.pop()
+        event = next(self._events, None)
+        if event is None:
+            raise ValueError("Unexpected end of events")
+        return event
+
+    def unread(self, events):
+        self._unread.extend(reversed(events))
+
+
+def _load(reader, event):
+    # the value starting with event, read to its end
+    kind, value = event
+    if kind == 'value':
+        return value
+    root = {} if kind == 'start_map' else []
+    containers = [root]
+    key = None
+    while containers:
+        kind, value = reader.next()
+        if kind == 'map_key':
+            key = value
+            continue
+        elif kind == 'end_map' or kind == 'end_array':
+            containers.pop()
+            continue
+        elif kind == 'start_map':
+            value = {}
+        elif kind == 'start_array':
+            value = []
+        parent = containers[-1]
+        if isinstance(parent, dict):
+            parent[key] = value
+        else:
+            parent.append(value)
+        if kind != 'value':
+            containers.append(value)
+    return root
+
+
+def _read_shorter(ra, rb):
+    # reads the values at ra and rb in step until one of them ends; returns
+    # (True if a ended first, events read from a, events read from b)
+    events = ([], [])
+    depths = [0, 0]
+    while True:
+        for side, reader in ((0, ra), (1, rb)):
+            event = reader.next()
+            events[side].append(event)
+            if event[0] == 'start_map' or event[0] == 'start_array':
+                depths[side] += 1
+            elif event[0] == 'end_map' or event[0] == 'end_array':
+                depths[side] -= 1
+            if depths[side] == 0 and event[0] != 'map_key':
+                return side == 0, events[0], events[1]
+
+
+def _next_key(reader):
+    kind, value = reader.next()
+    if kind == 'map_key':
+        return value
+    return _end
+
+
+# _diff_maps() and _diff_arrays() yield diff operations, and the generator
+# for each nested pair of containers; diff_events() runs a nested generator
+# to its end before resuming the one that yielded it.
+def _diff_maps(ra, rb, path):
+    # keys set aside -> loaded value, until the other side reaches them
+    pending_a = {}
+    pending_b = {}
+    ka = _next_key(ra)
+    kb = _next_key(rb)
+    while ka is not _end or kb is not _end:
+        if ka is not _end and ka == kb:
+            yield _diff_values(ra, rb, ra.next(), rb.next(), path + (ka,))
+            ka = _next_key(ra)
+            kb = _next_key(rb)
+        elif ka is not _end and ka in pending_b:
+            rb_loaded = _EventReader(value_events(pending_b.pop(ka)))
+            yield _diff_values(ra, rb_loaded, ra.next(), rb_loaded.next(), path + (ka,))
+            ka = _next_key(ra)
+        elif kb is not _end and kb in pending_a:
+            ra_loaded = _EventReader(value_events(pending_a.pop(kb)))
+            yield _diff_values(ra_loaded, rb, ra_loaded.next(), rb.next(), path + (kb,))
+            kb = _next_key(rb)
+        elif ka is _end:
+            yield (insert, path + (kb,), missing, _load(rb, rb.next()))
+            kb = _next_key(rb)
+        elif kb is _end:
+            yield (delete, path + (ka,), _load(ra, ra.next()), missing)
+            ka = _next_key(ra)
+        else:
+            a_first, events_a, events_b = _read_shorter(ra, rb)
+            if a_first:
+                loaded = _EventReader(events_a)
+                pending_a[ka] = _load(loaded, loaded.next())
+                rb.unread(events_b)
+                ka = _next_key(ra)
+            else:
+                loaded = _EventReader(events_b)
+                pending_b[kb] = _load(loaded, loaded.next())
+                ra.unread(events_a)
+                kb = _next_key(rb)
+    for k, v in pending_a.items():
+        yield (delete, path + (k,), v, missing)
+    for k, v in pending_b.items():
+        yield (insert, path + (k,), missing, v)
+
+
+def _diff_arrays(ra, rb, path):
+    i = 0
+    ea = ra.next()
+    eb = rb.next()
+    while ea[0] != 'end_array' and eb[0] != 'end_array':
+        yield _diff_values(ra, rb, ea, eb, path + (i,))
+        i += 1
+        ea = ra.next()
+        eb = rb.next()
+    j = i
+    while ea[0] != 'end_array':
+        yield (delete, path + (j,), _load(ra, ea), missing)
+        j += 1
+        ea = ra.next()
+    while eb[0] != 'end_array':
+        yield (insert, path + (i,), missing, _load(rb, eb))
+        i += 1
+        eb = rb.next()
+
+
+def _diff_values(ra, rb, ea, eb, path):
+    if ea[0] == 'start_map' and eb[0] == 'start_map':
+        return _diff_maps(ra, rb, path)
+    elif ea[0] == 'start_array' and eb[0] == 'start_array':
+        return _diff_arrays(ra, rb, path)
+    a = _load(ra, ea)
+    b = _load(rb, eb)
+    if ea[0] != eb[0] or (a != b and not _both_nan(a, b)):
+        return iter([(replace, path, a, b)])
+    return iter([])
+
+
+def _both_nan(a, b):
+    return isinstance(a, float) and isinstance(b, float) and a != a and b != b
+
+
+def diff_events(events_a, events_b):
+    ra = _EventReader(events_a)
+    rb = _EventReader(events_b)
+    stack = [_diff_values(ra, rb, ra.next(), rb.next(), ())]
+    while stack:
+        item = next(stack[-1], _end)
+        if item is _end:
+            stack.pop()
+        elif isinstance(item, tuple):
+            yield item
+        else:
+            stack.append(item)
+
+
+__all__ = [
+    "JsonTokenizer",
+    "value_events",
+    "diff_events",
+]
@@ -0,0 +1,153 @@
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Proxy;
+import java.nio.charset.StandardCharsets;
+import java.util.Arrays;
+
+// Long-lived helper JVM for kafka_jmx.kafka_sidecar - runs kafka tool
+// classes (kafka.admin.ConsumerGroupCommand, ...) in-process, one command at
+// a time, so JVM start-up and classpath scanning happen once per collector
+// rather than once per command.
+//
+// Protocol (stdin/stdout):
+//   request  - one line: the tool class name and its arguments, tab separated
+//   response - "<rc> <stdout bytes> <stderr bytes>\n", followed by the
+//              captured stdout and stderr of the command
+// The helper exits when stdin is closed.
+//
+// Run with the kafka classpath, either straight from source (java 11+):
+//   java -cp '/opt/kafka/current/share/java/kafka/*' KafkaToolSidecar.java
+// or compiled (javac KafkaToolSidecar.java) with this directory added to
+// the classpath.
+//
+// Tools end with kafka's Exit.exit(); the exit procedure is swapped for one
+// that throws, so the status becomes the command rc instead of ending the
+// helper. Tools calling System.exit() directly will still end the helper -
+// the python side restarts it on the next command.
+public class KafkaToolSidecar {
+
+    static class ToolExit extends RuntimeException {
+        final int status;
+
+        ToolExit(int status) {
+            super("exit " + status, null, false, false);
+            this.status = status;
+        }
+    }
+
+    // System.out/err are replaced once, before any tool class is loaded, by
+    // streams that write to the current command's buffer - anything that
+    // captures the stream at class init (scala Console, log4j console
+    // appenders) is redirected as well
+    static class SwitchStream extends OutputStream {
+        volatile OutputStream target;
+
+        SwitchStream(OutputStream target) {
+            this.target = target;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            target.write(b);
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            target.write(b, off, len);
+        }
+
+        @Override
+        public void flush() throws IOException {
+            target.flush();
+        }
+    }
+
+    static void trapKafkaExit() {
+        try {
+            Class<?> exitClass = Class.forName("org.apache.kafka.common.utils.Exit");
+            Class<?> procClass = Class.forName("org.apache.kafka.common.utils.Exit$Procedure");
+            Object exitProc = Proxy.newProxyInstance(
+                procClass.getClassLoader(),
+                new Class<?>[] { procClass },
+                (proxy, method, args) -> {
+                    switch (method.getName()) {
+                        case "execute":
+                            throw new ToolExit((Integer) args[0]);
+                        case "hashCode":
+                            return System.identityHashCode(proxy);
+                        case "equals":
+                            return proxy == args[0];
+                        default:
+                            return "KafkaToolSidecar.exitProcedure";
+                    }
+                });
+            exitClass.getMethod("setExitProcedure", procClass).invoke(null, exitProc);
+            exitClass.getMethod("setHaltProcedure", procClass).invoke(null, exitProc);
+        } catch (ReflectiveOperationException e) {
+            System.err.println("KafkaToolSidecar: kafka Exit procedure not available: " + e);
+        }
+    }
+
+    static int runTool(String[] toolArgs) {
+        try {
+            Method toolMain = Class.forName(toolArgs[0]).getMethod("main", String[].class);
+            toolMain.invoke(null, (Object) Arrays.copyOfRange(toolArgs, 1, toolArgs.length));
+            return 0;
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ToolExit) {
+                return ((ToolExit) cause).status;
+            }
+            cause.printStackTrace();
+            return 1;
+        } catch (ToolExit e) {
+            return e.status;
+        } catch (Throwable e) {
+            e.printStackTrace();
+            return 1;
+        }
+    }
+
+    public static void main(String[] argv) throws IOException {
+        OutputStream frameOut = new BufferedOutputStream(new FileOutputStream(FileDescriptor.out));
+        SwitchStream cmdOut = new SwitchStream(new FileOutputStream(FileDescriptor.err));
+        SwitchStream cmdErr = new SwitchStream(new FileOutputStream(FileDescriptor.err));
+        System.setOut(new PrintStream(cmdOut, true, "UTF-8"));
+        System.setErr(new PrintStream(cmdErr, true, "UTF-8"));
+        trapKafkaExit();
+
+        BufferedReader requests = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = requests.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            ByteArrayOutputStream outBuf = new ByteArrayOutputStream();
+            ByteArrayOutputStream errBuf = new ByteArrayOutputStream();
+            cmdOut.target = outBuf;
+            cmdErr.target = errBuf;
+            int rc = runTool(line.split("\t"));
+            System.out.flush();
+            System.err.flush();
+            cmdOut.target = new FileOutputStream(FileDescriptor.err);
+            cmdErr.target = cmdOut.target;
+
+            byte[] outBytes = outBuf.toByteArray();
+            byte[] errBytes = errBuf.toByteArray();
+            frameOut.write((rc + " " + outBytes.length + " " + errBytes.length + "\n")
+                .getBytes(StandardCharsets.US_ASCII));
+            frameOut.write(outBytes);
+            frameOut.write(errBytes);
+            frameOut.flush();
+        }
+    }
+}
@@ -0,0 +1,106 @@
+import sys
+import time
+import argparse
+
+import kgd_rows
+
+# Benchmark for the ConsumerGroupCommand --describe parser.
+#
+# Generates describe output for a single group with --partitions partitions
+# (half of them without an active consumer, printed as '-') and times
+# kgd_rows.parse_kgd_output(), with and without the final to_doc()
+# serialization, against the previous parser (a dict of strings per line,
+# '-' keys deleted afterwards). On python 3 the memory held by the parsed
+# result is reported as well. The typed rows trade some parse time (the
+# int conversions) for a smaller result and numeric documents.
+#
+#   python bench_kgd_parser.py
+#   python bench_kgd_parser.py --partitions 10000 100000
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def gen_describe_output(n_partitions, n_topics=50):
+    lines = ["TOPIC PARTITION CURRENT-OFFSET LOG-END-OFFSET LAG CONSUMER-ID HOST CLIENT-ID"]
+    for p_idx in range(n_partitions):
+        topic = 'app_topic_%03d' % (p_idx % n_topics)
+        partition = p_idx // n_topics
+        current_offset = 1000000 + p_idx * 7
+        log_end_offset = current_offset + (p_idx % 500)
+        if (p_idx % 2):
+            owner = ['-', '-', '-']
+        else:
+            owner = [
+                'consumer-%d-5e8b0f8c-7f1c-4c39-9a3e-%012d' % (p_idx % 16, p_idx % 16),
+                '/10.1.2.%d' % (p_idx % 16),
+                'consumer-%d' % (p_idx % 16)]
+        lines.append(' '.join([topic, str(partition), str(current_offset), str(log_end_offset),
+            str(log_end_offset - current_offset)] + owner))
+    return '\n'.join(lines) + '\n'
+
+
+# the pre-kgd_rows parser
+def dict_parser(raw_txt, group, timestamp):
+    lines = [line for line in raw_txt.split("\n") if line]
+    gd_fields = ['topic','partition','current_offset','log_end_offset','lag','consumer_id','host','client_id']
+    gd = []
+    for line in lines[1:]:
+        grp_desc = dict(zip(gd_fields, line.split()))
+        for gd_key in list(grp_desc.keys()):
+            if (grp_desc[gd_key] == '-'):
+                del(grp_desc[gd_key])
+        grp_desc['timestamp'] = timestamp
+        grp_desc['group'] = group
+        gd.append(grp_desc)
+    return gd
+
+
+def rows_parser(raw_txt, group, timestamp):
+    return kgd_rows.parse_kgd_output(raw_txt, group=group, timestamp=timestamp)
+
+
+def rows_to_docs(raw_txt, group, timestamp):
+    return [row.to_doc() for row in rows_parser(raw_txt, group, timestamp)]
+
+
+# returns (result, elapsed ms, bytes held by the result or None); the memory
+# is traced on a second run so tracing doesn't skew the timing
+def measure(fn, *args):
+    _st = time.time()
+    rc = fn(*args)
+    elapsed_ms = (time.time() - _st) * 1000
+    held = None
+    if (tracemalloc is not None):
+        del(rc)
+        tracemalloc.start()
+        rc = fn(*args)
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return rc, elapsed_ms, held
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partitions", type=int, nargs='+', default=[100000])
+    args = parser.parse_args()
+
+    print("%10s %-14s %10s %12s" % ('partitions', 'parser', 'ms', 'held MB'))
+    for n_partitions in args.partitions:
+        raw_txt = gen_describe_output(n_partitions)
+        for name, fn in (('dict', dict_parser), ('kgd_row', rows_parser), ('kgd_row+doc', rows_to_docs)):
+            rc, elapsed_ms, held = measure(fn, raw_txt, 'bench_group', 1533081600000)
+            if (len(rc) != n_partitions):
+                print("%s parsed %d of %d partitions" % (name, len(rc), n_partitions))
+                sys.exit(1)
+            held_col = '-'
+            if (held is not None):
+                held_col = '%.1f' % (held / (1024.0 * 1024))
+            print("%10d %-14s %10.2f %12s" % (n_partitions, name, elapsed_ms, held_col))
+            del(rc)
+
+
+if __name__ == '__main__':
+    main()
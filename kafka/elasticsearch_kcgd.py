@@ -4,11 +4,19 @@ import json
 import time
 import requests
 from pprint import pprint, pformat
-from threading import active_count as active_thread_count, enumerate as thread_enumerate
+from multiprocessing import TimeoutError
 
+import group_discovery
 import kafka_jmx
+import kafka_lag
+import kafka_wire
 import simple_es
 
+# the interval scheduler is shared with the collectors at the top of the
+# repo - kcgd.sh runs this from a checkout of the whole repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler
+
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -46,13 +54,16 @@ index_mapping = {
       "dynamic": "false",
       "properties": {
         "client_id":  { "type": "keyword" },
+        "consume_rate": { "type": "float" },
         "consumer_id":  { "type": "keyword" },
         "current_offset": { "type": "long" },
         "group": { "type": "keyword" },
         "host": { "type": "keyword" },
         "lag": { "type": "integer" },
+        "lag_rate": { "type": "float" },
         "log_end_offset": { "type": "long" },
         "partition": { "type": "integer" },
+        "produce_rate": { "type": "float" },
         "timestamp": { "type": "date" },
         "topic": { "type": "keyword" }
       }
@@ -60,33 +71,91 @@ index_mapping = {
   }
 }
 
+# per group/topic rollups written by the lag tracker
+#PUT test_kafka_consumer_groups_rollup
+rollup_index_mapping = {
+  "mappings": {
+    "doc": {
+      "dynamic": "false",
+      "properties": {
+        "consume_rate": { "type": "float" },
+        "group": { "type": "keyword" },
+        "lag": { "type": "long" },
+        "lag_rate": { "type": "float" },
+        "partitions": { "type": "integer" },
+        "produce_rate": { "type": "float" },
+        "timestamp": { "type": "date" },
+        "topic": { "type": "keyword" }
+      }
+    }
+  }
+}
 
 
 
-# runs the sample processes in parallel
-def get_kafka_consumer_group_desc(kcg_cmd, groups):
-
-    kcg_threads = {}
-    for group in groups:
-        kcg_threads[group] = kcg_cmd.describe_t(group)
-    log.debug("kcg java processes initiated - %d dispatch threads:\n%s" % (active_thread_count(), pformat(kcg_threads, indent=4)))
 
-    kcg_desc = {}
-    thread_timeout = 120
-    for group in groups:
-        g_desc = kcg_threads[group].join(thread_timeout)
-        if g_desc is not None:
-            kcg_desc[group] = g_desc
-        else:
+# runs the sample processes in parallel, on the command object's bounded
+# worker pool, and yields (group, kgd_result) as soon as each group returns;
+# the result is None for a group whose describe failed or came back empty
+# batch - describe every group with a single request (one JVM for the jvm
+# backend) instead of a request per group
+# timeout - seconds to wait for the whole set of requests; anything still
+# queued or running after that is reported and left to the pool (hung JVMs
+# are killed by kfk_exec) - describe_iter won't queue those groups again
+# until they've finished, so the pool's backlog stays within one interval
+def iter_kafka_consumer_group_desc(kcg_cmd, groups, batch=False, timeout=120):
+
+    if (batch):
+        kcg_desc = kcg_cmd.describe_groups(groups)
+        if (kcg_desc is None):
+            log.warning("batched kcg request for %d groups returned nothing" % len(groups))
+            return
+        for group in groups:
+            if (group not in kcg_desc):
+                log.warning("kcg request '%s' joined empty" % group)
+            yield (group, kcg_desc.get(group))
+        return
+
+    kcg_requests = kcg_cmd.describe_iter(groups)
+    log.debug("kcg requests queued for %d groups" % len(groups))
+
+    # groups still in flight from an earlier interval aren't queued, and the
+    # iterator stops after the last queued group
+    returned = set()
+    deadline = time.time() + timeout
+    for i in range(len(groups)):
+        try:
+            group, g_desc = kcg_requests.next(max(0, deadline - time.time()))
+        except TimeoutError:
+            break
+        except StopIteration:
+            break
+        returned.add(group)
+        if g_desc is None:
             log.warning("kcg request '%s' joined empty" % group)
+        yield (group, g_desc)
+
+    unreturned = [group for group in groups if group not in returned]
+    if (unreturned):
+        log.warning("%d requests unreturned after timeout (%.2fs): %s" % (len(unreturned), timeout, ', '.join(unreturned)))
 
 
-    if not (active_thread_count() == 1):
-        log.warning("%d threads unreturned after timeout (%.2fs)" % ((active_thread_count()), thread_timeout))
-        log.debug("Active threads:\n%s" % pformat(thread_enumerate(), indent=4))
 
-    return kcg_desc
+# add a document to (or flush) a simple_es.bulk_buffer - returns the number
+# of documents indexed by any request that was posted; documents that
+# weren't indexed are logged by label
+def post_bulk(es_idx, post_fn, *args, **kwargs):
 
+    _st = time.time()
+    bulk_rc = post_fn(*args, **kwargs)
+    if (bulk_rc is None):
+        return 0
+    doc_count, failed = bulk_rc
+    if (doc_count or failed):
+        log.info("elasticsearch bulk index time (%d documents to '%s'): %.3f ms" % (doc_count, es_idx, ((time.time() - _st) * 1000)))
+    if (failed):
+        log.error("%d documents not indexed to '%s': %s" % (len(failed), es_idx, ', '.join([str(label) for label in failed])))
+    return doc_count
 
 
 # run a single pass of the kafka to elasticsearch pipeline
@@ -94,46 +163,63 @@ def get_kafka_consumer_group_desc(kcg_cmd, groups):
 # kfk_cmd - kafka consumer group command object
 # kfk_groups - the list of kafka consumer groups to request
 #
-def run_kf_to_es(es_conn, es_idx, kfk_cmd, kfk_groups):
+# batch - describe all the groups in a single request
+# timeout - seconds to wait for the group descriptions
+# lag_tracker - kafka_lag.lag_tracker; its rates are added to the partition
+#   documents, and the group/topic rollups written to rollup_idx
+# bulk_max_docs, bulk_max_bytes - bulk request size limits
+# discovery - group_discovery.group_discovery; told which groups came back
+#   empty
+#
+#   Each group's rows are added to a bulk buffer as soon as that group's
+# describe returns, and the buffer is posted whenever it fills - slow groups
+# don't hold back the rest, and only one bulk request worth of documents is
+# held at a time.
+#
+# returns False if kafka returned no group descriptions at all
+#
+def run_kf_to_es(es_conn, es_idx, kfk_cmd, kfk_groups, batch=False, timeout=120, lag_tracker=None, rollup_idx=None,
+        bulk_max_docs=1000, bulk_max_bytes=5*1024*1024, discovery=None):
 
     _st = time.time()
-    group_samples = get_kafka_consumer_group_desc(kfk_cmd, kfk_groups)
-    _samplet = time.time()
-    log.info("kafka consumer group description response time: %.3f ms" % ((_samplet - _st) * 1000))
+    es_buffer = simple_es.bulk_buffer(es_conn, index=es_idx, max_docs=bulk_max_docs, max_bytes=bulk_max_bytes)
+    rollup_buffer = simple_es.bulk_buffer(es_conn, index=rollup_idx, max_docs=bulk_max_docs, max_bytes=bulk_max_bytes)
 
+    group_count = 0
     doc_count = 0
-
-    # combine all the group parition descriptions into a single list
-    full_payloads = []
-    for group_name in group_samples.keys():
-        full_payloads = full_payloads + group_samples[group_name]
-
-    try:
-        bulk_rc = es_conn.index_bulk(
-            index = es_idx, 
-            payloads=full_payloads,
-            doctype='doc')
-        _postt = time.time()
-
-        # error checking for stats
-        if (bulk_rc['errors']):
-            for doc_status in bulk_rc['items']:
-                if not (doc_status['index']['status'] == 201):
-                    log.error("error status [%d] in document:\n%s" % (doc_status['index']['status'], pformat(doc_status, indent=4)))
-                else:
-                    doc_count += 1
-        else:
-            doc_count = len(bulk_rc['items'])
-
-        log.info("elasticsearch bulk index time (%d documents): %.3f ms" % (doc_count, ((_postt - _samplet) * 1000)))
-    except KeyError as e:
-        log.error("messed up the document error parsing. dammit. %s" % pformat(e))
-        pass
-    except Exception as e:
-        log.error("Exception in bulk post - dropping errors and continuing: %s " % repr(e))
-        pass
-
-    return
+    for group, g_desc in iter_kafka_consumer_group_desc(kfk_cmd, kfk_groups, batch=batch, timeout=timeout):
+        if (discovery is not None):
+            discovery.report(group, bool(g_desc and g_desc.rows))
+        if (g_desc is None):
+            continue
+        group_count += 1
+        # the rollups are per group/topic, so each group's result is complete
+        # on its own
+        row_rates = None
+        if (lag_tracker is not None):
+            row_rates, rollups = lag_tracker.update(g_desc.rows)
+            for rollup in rollups:
+                doc_count += post_bulk(rollup_idx, rollup_buffer.add, rollup,
+                    label="%s/%s" % (rollup['group'], rollup['topic']))
+        # rows are only turned into documents for serialization
+        for row_idx, row in enumerate(g_desc.rows):
+            row_doc = row.to_doc()
+            if (row_rates is not None):
+                row_doc.update(row_rates[row_idx])
+            doc_count += post_bulk(es_idx, es_buffer.add, row_doc,
+                label="%s/%s/%s" % (row.group, row.topic, row.partition))
+
+    doc_count += post_bulk(es_idx, es_buffer.flush)
+    doc_count += post_bulk(rollup_idx, rollup_buffer.flush)
+
+    log.info("kafka consumer group cycle: %d groups, %d documents indexed in %.3f ms" % (group_count, doc_count, ((time.time() - _st) * 1000)))
+    if (lag_tracker is not None):
+        log.debug("lag tracker: %d partitions tracked, %d offset resets" % (len(lag_tracker), lag_tracker.resets))
+
+    if not group_count:
+        log.warning("no consumer group descriptions returned")
+        return False
+    return True
 
 #
 def main():
@@ -146,21 +232,58 @@ def main():
         config = json.load(config_file)
 
     # load the Kafka Consumer Group command object
-    log.info("kafka server %s:%d" % (config['kafka_bootstrap_server'], config['kafka_bootstrap_port']))
-    kcg_cmd = kafka_jmx.consumer_group_command(
-        server = config['kafka_bootstrap_server'],
-        port = config['kafka_bootstrap_port'])
+    # "jvm" runs ConsumerGroupCommand for every request (or, with
+    # kafka_sidecar, sends it to long-lived helper JVMs), "native" talks to
+    # the brokers directly over the kafka protocol
+    # at most kafka_max_procs requests (JVMs) run at once; a JVM running
+    # longer than kafka_exec_timeout seconds is killed
+    kafka_backend = config.get('kafka_backend', 'jvm')
+    kafka_max_procs = config.get('kafka_max_procs', 4)
+    log.info("kafka server %s:%d (%s backend)" % (config['kafka_bootstrap_server'], config['kafka_bootstrap_port'], kafka_backend))
+    if (kafka_backend == 'native'):
+        kcg_cmd = kafka_wire.consumer_group_client(
+            server = config['kafka_bootstrap_server'],
+            port = config['kafka_bootstrap_port'],
+            max_workers = kafka_max_procs)
+    elif (kafka_backend == 'jvm'):
+        kcg_cmd = kafka_jmx.consumer_group_command(
+            server = config['kafka_bootstrap_server'],
+            port = config['kafka_bootstrap_port'],
+            max_procs = kafka_max_procs,
+            exec_timeout = config.get('kafka_exec_timeout', 120),
+            sidecar = config.get('kafka_sidecar', False))
+    else:
+        log.error("unknown kafka_backend '%s' - expected 'jvm' or 'native'" % kafka_backend)
+        sys.exit(1)
 
     # load up the elastic search object/configs
-    log.info("elasticsearch server %s:%d - target index '%s'" % (
+    log.info("elasticsearch server %s://%s:%d - target index '%s'" % (
+        config.get('elasticsearch_scheme', 'http'),
         config['elasticsearch_server'], 
         config['elasticsearch_port'], 
         config['elasticsearch_index']))
+    es_auth = None
+    if (config.get('es_user')):
+        es_auth = (config['es_user'], config.get('es_pass'))
     es = simple_es.simple_es(
         server=config['elasticsearch_server'],
-        port=config['elasticsearch_port'])
+        port=config['elasticsearch_port'],
+        auth=es_auth,
+        scheme=config.get('elasticsearch_scheme', 'http'),
+        verify=config.get('elasticsearch_verify', True),
+        pool_size=config.get('elasticsearch_pool_size', 4),
+        bulk_gzip=config.get('elasticsearch_gzip', False))
     es_index = config['elasticsearch_index']
 
+    # consume/produce/lag rates from the previous cycle's offsets
+    lag_tracker = None
+    rollup_index = None
+    if (config.get('lag_rates', False)):
+        lag_tracker = kafka_lag.lag_tracker(
+            max_age=config.get('lag_sample_max_age', max(600, 3 * config['interval'])))
+        rollup_index = config.get('elasticsearch_rollup_index', es_index + '_rollup')
+        log.info("lag rates enabled - group/topic rollups to '%s'" % rollup_index)
+
     # setup the interval
     interval = config['interval']
     if (interval == 0):
@@ -168,26 +291,42 @@ def main():
     else:
         log.info("using polling interval %ds" % interval)
 
-    kafka_groups = kcg_cmd.group_list()
-    log.info("Kafka group list:\n%s" % pformat(kafka_groups, indent=4))
-
-    _nextrun = time.time()
+    # the group list is refreshed every group_refresh_interval seconds; groups
+    # that are empty group_empty_threshold cycles in a row are skipped for
+    # group_empty_ttl seconds
+    discovery = group_discovery.group_discovery(
+        kcg_cmd,
+        refresh_interval=config.get('group_refresh_interval', 600),
+        empty_threshold=config.get('group_empty_threshold', 3),
+        empty_ttl=config.get('group_empty_ttl', 1800))
+    log.info("Kafka group list:\n%s" % pformat(discovery.groups(), indent=4))
+
+    # runs stay on the interval grid; overrun ticks are skipped and a cycle
+    # that gets nothing back from kafka backs off exponentially
+    kcg_sched = scheduler.interval_scheduler(
+        interval,
+        backoff_max=config.get('backoff_max', 600),
+        name='kafka_cg')
+    kcg_sched.start()
     while True:
         log.debug("interval expired - initiating dispatch")
 
-        run_kf_to_es(es, es_index, kcg_cmd, kafka_groups)
+        run_ok = run_kf_to_es(es, es_index, kcg_cmd, discovery.groups(),
+            batch=config.get('kafka_batch_describe', False),
+            timeout=config.get('kafka_describe_timeout', 120),
+            lag_tracker=lag_tracker,
+            rollup_idx=rollup_index,
+            bulk_max_docs=config.get('bulk_max_docs', 1000),
+            bulk_max_bytes=config.get('bulk_max_bytes', 5*1024*1024),
+            discovery=discovery)
 
         if (interval == 0): 
            break
-        _nextrun = _nextrun + interval
-        # if time.sleep() is called on a negative number, the routine fails
-        # to return - so ensure that we're not going to lock up the thread 
-        # if one of the preceding calls takes unexpectedly long to return
-        # and overruns the interval
-        sleep_intv = _nextrun - time.time()
-        if (sleep_intv > 0):
-            time.sleep(sleep_intv)
+        kcg_sched.wait(run_ok)
+        log.debug("scheduler stats: %s" % pformat(kcg_sched.stats()))
 
+    kcg_cmd.close()
+    es.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# Consumer group discovery cache for the kafka collector.
+#
+#   The group list is refreshed from the command object (group_list()) every
+# refresh_interval seconds rather than once at start-up, so new groups are
+# picked up and deleted groups dropped without a restart - and without a
+# list request on every cycle. A failed refresh keeps the previous list and
+# is retried on the next call.
+#
+#   Groups that come back empty (failed describe, or no partitions)
+# empty_threshold cycles in a row are left out of the active list for
+# empty_ttl seconds; after that they are tried once more, and another empty
+# result parks them again straight away. Any non-empty result clears the
+# count. Requests that timed out aren't reported, so a slow cluster doesn't
+# park healthy groups.
+#
+#       discovery = group_discovery(kcg_cmd, refresh_interval=600)
+#       for group in discovery.groups():
+#           ...
+#           discovery.report(group, has_rows)
+#
+class group_discovery(object):
+
+    def refresh(self):
+        k_groups = self._kcg_cmd.group_list()
+        if (k_groups is None):
+            log.warning("consumer group list failed - keeping %d known groups" % len(self._groups))
+            return False
+        k_groups = sorted(set(k_groups))
+
+        added = set(k_groups) - set(self._groups)
+        removed = set(self._groups) - set(k_groups)
+        if (added or removed):
+            log.info("consumer groups: %d added %s, %d removed %s" % (
+                len(added), sorted(added), len(removed), sorted(removed)))
+        for group in removed:
+            self._empty_counts.pop(group, None)
+            self._parked.pop(group, None)
+        self._groups = k_groups
+        self._last_refresh = self._clock()
+        self.refreshes += 1
+        return True
+
+    # the groups to describe this cycle
+    def groups(self):
+        now = self._clock()
+        if (self._last_refresh is None or (now - self._last_refresh) >= self.refresh_interval):
+            self.refresh()
+
+        active = []
+        for group in self._groups:
+            parked_until = self._parked.get(group)
+            if (parked_until is not None):
+                if (now < parked_until):
+                    continue
+                # parole - one more empty result parks it again
+                del(self._parked[group])
+                self._empty_counts[group] = self.empty_threshold - 1
+            active.append(group)
+        return active
+
+    # record the outcome of a group's describe
+    def report(self, group, has_rows):
+        if (has_rows):
+            self._empty_counts.pop(group, None)
+            return
+        empty_count = self._empty_counts.get(group, 0) + 1
+        self._empty_counts[group] = empty_count
+        if (empty_count >= self.empty_threshold):
+            log.info("consumer group '%s' empty %d cycles in a row - skipping for %ds" % (
+                group, empty_count, self.empty_ttl))
+            self._parked[group] = self._clock() + self.empty_ttl
+
+    def parked(self):
+        return sorted(self._parked.keys())
+
+    def __init__(self, kcg_cmd, refresh_interval=600, empty_threshold=3, empty_ttl=1800, clock=None):
+        self._kcg_cmd = kcg_cmd
+        self.refresh_interval = refresh_interval
+        self.empty_threshold = empty_threshold
+        self.empty_ttl = empty_ttl
+        self._clock = clock or time.time
+        self._groups = []
+        self._last_refresh = None
+        self._empty_counts = {}
+        # group -> time it's tried again
+        self._parked = {}
+        self.refreshes = 0
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import os
 import sys
+import signal
 import json
 import requests
 import subprocess
@@ -8,34 +9,12 @@ import threading
 import time
 import logging
 
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
 
-log = logging.getLogger(__name__)
+from kgd_rows import kgd_result, parse_kgd_output, as_kgd_row
 
-# override some threading methods so we can easily access return values
-class sthread(threading.Thread):
-    # standard join always returns "None" - modify
-    # join to return the stored function result
-    def join(self, timeout=None):
-       super(sthread, self).join(timeout)
-       return self._return
-    # modify "run" to store the function result
-    def run(self):
-       self._return = None
-       if self._Thread__target is not None:
-           self._return = self._Thread__target(*self._Thread__args, **self._Thread__kwargs)
-
-# and a nice little decorator so we don't have to redeclare for every thread
-def threaded(fn):
-    def wrapper(*k, **kw):
-        t = sthread(target=fn, args=k, kwargs=kw)
-        t.setDaemon(True)
-        t.start()
-        return t
-    return wrapper
-
-def get_t_id():
-    return repr(threading.current_thread())
+log = logging.getLogger(__name__)
 
 # Here's the command we're emulating:
 #
@@ -51,7 +30,123 @@ def get_t_id():
 # kafka.admin.ConsumerGroupCommand --bootstrap-server localhost:9092 --describe --group ocp_application_out
 
 
+# raised by kafka_sidecar.run() when the helper can't be started or dies
+# before it has answered
+class sidecar_error(Exception):
+    pass
+
+
+# Persistent helper JVM (KafkaToolSidecar.java) that runs kafka tool
+# commands in-process, so the JVM start-up is paid once rather than on every
+# command. Commands are written to the helper's stdin one at a time, and
+# answered with a "rc outlen errlen\n" line followed by outlen bytes of
+# stdout and errlen bytes of stderr. A helper that dies, or doesn't answer
+# within the timeout, is killed and started again on the next command.
+class kafka_sidecar(object):
+
+    def _launch_args(self):
+        sidecar_dir = os.path.dirname(os.path.abspath(self.source))
+        # use the compiled class if there is one, otherwise launch from
+        # source (java 11+)
+        if os.path.exists(os.path.join(sidecar_dir, 'KafkaToolSidecar.class')):
+            return self.jvm_args + ['-cp', ':'.join(self.classpath + [sidecar_dir]), 'KafkaToolSidecar']
+        return self.jvm_args + ['-cp', ':'.join(self.classpath), self.source]
+
+    def _start(self):
+        sp_popen_args = [self.jexec] + self._launch_args()
+        log.info("starting kafka sidecar %s" % sp_popen_args)
+        self._proc = subprocess.Popen(sp_popen_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True,
+            preexec_fn=os.setsid)
+        self.starts += 1
+
+    def _read_exact(self, n_bytes):
+        data = self._proc.stdout.read(n_bytes)
+        if (len(data) != n_bytes):
+            raise IOError("kafka sidecar closed its output")
+        return data
+
+    # run a single tool command - returns (rc, stdout, stderr); rc is None if
+    # the command timed out. Raises sidecar_error if the helper failed
+    def run(self, cmd_args, timeout=120):
+        with self._lock:
+            if (self._proc is None or self._proc.poll() is not None):
+                try:
+                    self._start()
+                except OSError as e:
+                    self._proc = None
+                    raise sidecar_error("kafka sidecar failed to start: %s" % repr(e))
+
+            timed_out = threading.Event()
+            proc = self._proc
+            def kill_sidecar():
+                timed_out.set()
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            kill_timer = threading.Timer(timeout, kill_sidecar)
+            kill_timer.daemon = True
+            kill_timer.start()
+            try:
+                proc.stdin.write(('\t'.join(cmd_args) + '\n').encode('utf-8'))
+                proc.stdin.flush()
+                frame_header = proc.stdout.readline()
+                if not frame_header:
+                    raise IOError("kafka sidecar exited (rc %s)" % proc.poll())
+                rc, out_len, err_len = [int(f) for f in frame_header.split()]
+                output = self._read_exact(out_len)
+                stderr = self._read_exact(err_len)
+            except (IOError, OSError, ValueError) as e:
+                self.close()
+                if (timed_out.is_set()):
+                    log.error("kafka sidecar killed after %ds: %s" % (timeout, ' '.join(cmd_args)))
+                    return (None, None, None)
+                raise sidecar_error("kafka sidecar failed: %s" % repr(e))
+            finally:
+                kill_timer.cancel()
+            return (rc, output, stderr)
+
+    # closing stdin ends the helper
+    def close(self):
+        if (self._proc is None):
+            return
+        try:
+            self._proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._proc.wait()
+        self._proc = None
+
+    def __init__(self, jexec, jvm_args, classpath, source=None):
+        self.jexec = jexec
+        self.jvm_args = jvm_args
+        self.classpath = classpath
+        if (source is None):
+            source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'KafkaToolSidecar.java')
+        self.source = source
+        self.starts = 0
+        self._proc = None
+        self._lock = threading.Lock()
+
+
 # TODO: output parser handling is a bit fuzzy - might be best to handle it in the subclasses
+#
+#   JVM runs are bounded: at most max_procs children run at once (callers
+# beyond that wait for a slot), and a child still running after
+# exec_timeout seconds is killed, so a hung broker can't pile up JVMs
+# across intervals. The *_t methods queue work on a persistent pool of
+# max_procs worker threads that is reused from one interval to the next;
+# they return a multiprocessing AsyncResult - use get(timeout) for the
+# result.
+#
+#   With sidecar=True, commands are sent to up to max_procs persistent
+# helper JVMs (kafka_sidecar) instead of starting a JVM per command; the
+# parsers see the same output either way. A command the helper fails on is
+# run in a JVM of its own.
 class kafka_command(object):
 
     def opts(self):
@@ -71,25 +166,15 @@ class kafka_command(object):
         else:
             cmd_args = ' '.join(args).split()
 
-        # split up all arguments for the subprocess.popen array
-        sp_popen_args = [self.jexec] + \
-            self.jvm['HEAP_OPTS'] + \
-            self.jvm['SYS_OPTS'] + \
-            ['-cp',':'.join(self.jvm['CLASSPATH'])] + \
-            cmd_args
+        if (self.sidecar):
+            rc, output, stderr = self._sidecar_exec(cmd_args)
+        else:
+            rc, output, stderr = self._popen_exec(cmd_args)
 
-        log.debug("Initiating subprocess %s" % sp_popen_args)
-        try:
-            p = subprocess.Popen(sp_popen_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-        except subprocess.CalledProcessError as e:
-            log.error("subprocess\n%s\n\nfailed: %s" % (sp_popen_args, repr(e)))
+        if (rc is None):
             return None
-
-        output,stderr = p.communicate()
-        rc = p.returncode
-
         if not (rc == 0):
-            # log stderr
+            log.error("subprocess returned %d: %s\n%s" % (rc, ' '.join(cmd_args), stderr))
             return None
         # it's better to handle the parsing with a subclass,
         # but if you really wanna, it'll run here too
@@ -99,15 +184,110 @@ class kafka_command(object):
         else:
             return self.parser(output)
 
-    @threaded
-    def kfk_exec_t(self, *args):
-        return kfk_exec_out
+    # returns (rc, stdout, stderr); rc is None if the JVM couldn't be started
+    # or was killed
+    def _popen_exec(self, cmd_args):
+        # split up all arguments for the subprocess.popen array
+        sp_popen_args = [self.jexec] + \
+            self.jvm['HEAP_OPTS'] + \
+            self.jvm['SYS_OPTS'] + \
+            ['-cp',':'.join(self.jvm['CLASSPATH'])] + \
+            cmd_args
 
-    def __init__(self, cmd = None, parser = None):
+        timed_out = threading.Event()
+        with self._proc_slots:
+            log.debug("Initiating subprocess %s" % sp_popen_args)
+            try:
+                # own process group, so a timeout kill takes any children of
+                # a wrapper script (java launchers) with it
+                p = subprocess.Popen(sp_popen_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True,
+                    preexec_fn=os.setsid)
+            except (OSError, subprocess.CalledProcessError) as e:
+                log.error("subprocess\n%s\n\nfailed: %s" % (sp_popen_args, repr(e)))
+                return (None, None, None)
+
+            # kill the child if it outlives the timeout - communicate()
+            # returns once its pipes close
+            def kill_child():
+                timed_out.set()
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            kill_timer = threading.Timer(self.exec_timeout, kill_child)
+            kill_timer.daemon = True
+            kill_timer.start()
+            try:
+                output,stderr = p.communicate()
+            finally:
+                kill_timer.cancel()
+            rc = p.returncode
+
+        if (timed_out.is_set()):
+            log.error("subprocess killed after %ds: %s" % (self.exec_timeout, ' '.join(cmd_args)))
+            return (None, None, None)
+        return (rc, output, stderr)
+
+    # one helper per process slot - holding a slot guarantees a free helper.
+    # A command the helper fails on (it couldn't start, or died) is run in a
+    # JVM of its own instead; the helper is started again for the next one
+    def _sidecar_exec(self, cmd_args):
+        with self._proc_slots:
+            with self._pool_lock:
+                if (self._sidecars):
+                    sc = self._sidecars.pop()
+                else:
+                    sc = kafka_sidecar(
+                        self.jexec,
+                        self.jvm['HEAP_OPTS'] + self.jvm['SYS_OPTS'],
+                        self.jvm['CLASSPATH'])
+            try:
+                return sc.run(cmd_args, self.exec_timeout)
+            except sidecar_error as e:
+                log.warning("%s - running the command in its own JVM" % e)
+            finally:
+                with self._pool_lock:
+                    self._sidecars.append(sc)
+        return self._popen_exec(cmd_args)
+
+    # the worker pool is created on first use and kept for the life of the
+    # object
+    def _pool(self):
+        with self._pool_lock:
+            if (self._workers is None):
+                self._workers = ThreadPool(self.max_procs)
+            return self._workers
+
+    def kfk_exec_t(self, *args):
+        return self._pool().apply_async(self.kfk_exec, args)
+
+    # stop the worker pool and any sidecars; running children are still
+    # killed on timeout
+    def close(self):
+        with self._pool_lock:
+            if (self._workers is not None):
+                self._workers.terminate()
+                self._workers = None
+            self._in_flight.clear()
+            sidecars = self._sidecars
+            self._sidecars = []
+        for sc in sidecars:
+            sc.close()
+
+    def __init__(self, cmd = None, parser = None, max_procs = 4, exec_timeout = 120, sidecar = False):
         # set defaults
         self.jexec = 'java'
         self.parser = parser
         self.cmd = cmd
+        self.max_procs = max_procs
+        self.exec_timeout = exec_timeout
+        self._proc_slots = threading.BoundedSemaphore(max_procs)
+        self._workers = None
+        self._pool_lock = threading.Lock()
+        # groups queued or running on the pool (describe_iter)
+        self._in_flight = set()
+        self.sidecar = sidecar
+        self._sidecars = []
         self.jvm = {}
         self.jvm['HEAP_OPTS'] = [
             "-Xmx256M",
@@ -139,53 +319,98 @@ class consumer_group_command(kafka_command):
     def cmd_prefix(self):
         return "%s --bootstrap-server %s:%d" % (self.kfk_cmd, self.kafka_server, self.kafka_port)
 
-    def default_kgd_parser(self, raw_txt):
-        try:
-            lines = filter(None, raw_txt.split("\n"))
-        except AttributeError as e:
-            return None
-        gd_fields = ['topic','partition','current_offset','log_end_offset','lag','consumer_id','host','client_id']
-        gd = []
-        # grab any threaded attributes (includes main thread, so works for single threaded too)
-        t_attrs = self._t_attrs[get_t_id()]
-        # first line is "TOPIC...PARTITION... etc" - skip it
-        for line in lines[1:]:
-            grp_desc = dict(zip(gd_fields, line.split()))
-            # remove empty fields
-            for gd_key in grp_desc.keys():
-                if (grp_desc[gd_key] == '-'):
-                    del(grp_desc[gd_key])
-
-            grp_desc['timestamp'] = t_attrs['cmd_timestamp']
-            grp_desc['group'] = t_attrs['group']
-            #TODO: cleanup the host field
-            gd.append(grp_desc)
-        # return the group descriptions
-        return gd
-
-    # setup the description command - thread safe, but can be called
-    # from main thread
+    # returns a list of kgd_rows (see kgd_rows) - use to_doc() for the
+    # document
+    def default_kgd_parser(self, raw_txt, group, timestamp):
+        #TODO: cleanup the host field
+        return parse_kgd_output(raw_txt, group=group, timestamp=timestamp)
+
+    # describe a single group - returns a kgd_result (group, timestamp,
+    # rows), or None if the command failed. Keeps no state between calls, so
+    # it can be run from any thread or executor
     def describe(self, group):
-        t_id = get_t_id()
-        self._t_attrs[t_id] = {}
         raw_desc_txt = self.kfk_exec("%s --describe --group %s" % (self.cmd_prefix(), group))
+        cmd_timestamp = int(time.time() * 1000)
+        if (raw_desc_txt is None):
+            return None
 
-        self._t_attrs[t_id]['cmd_timestamp'] = int(time.time() * 1000)
-        self._t_attrs[t_id]['group'] = group
-
+        # with a parser set, kfk_exec has already run the output through it;
+        # whatever rows it returned (kgd_rows or documents) become kgd_rows
         if (self.parser is None):
-            return self.default_kgd_parser(raw_desc_txt)
+            rows = self.default_kgd_parser(raw_desc_txt, group, cmd_timestamp)
         else:
-            return self.parser(raw_desc_txt)
+            rows = raw_desc_txt
+        if (rows is None):
+            return None
+        return kgd_result(group, cmd_timestamp, tuple(as_kgd_row(row, group, cmd_timestamp) for row in rows))
 
-    @threaded
     def describe_t(self, group):
-        return self.describe(group)
+        return self._pool().apply_async(self.describe, (group,))
+
+    def _describe_pair(self, group):
+        try:
+            return (group, self.describe(group))
+        except Exception as e:
+            log.exception("describe '%s' failed: %s" % (group, repr(e)))
+            return (group, None)
+        finally:
+            with self._pool_lock:
+                self._in_flight.discard(group)
+
+    # describe the groups on the worker pool - yields (group, kgd_result)
+    # pairs in completion order, so each group can be handled as soon as it
+    # returns (the result is None if the describe failed). Use the
+    # iterator's next(timeout) to bound the wait.
+    #   A group whose describe from an earlier call is still queued or
+    # running (a caller gave up waiting on it) isn't queued again, and isn't
+    # yielded - a slow broker can't grow the pool's queue interval after
+    # interval
+    def describe_iter(self, groups):
+        with self._pool_lock:
+            busy = [group for group in groups if group in self._in_flight]
+            queued = [group for group in groups if group not in self._in_flight]
+            self._in_flight.update(queued)
+        if (busy):
+            log.warning("%d groups still being described, not queued again: %s" % (len(busy), ', '.join(busy)))
+        return self._pool().imap_unordered(self._describe_pair, queued)
+
+    # multi-group output (--all-groups, or repeated --group flags) carries a
+    # GROUP column and repeats the header block for each group, separated by
+    # blank lines and the occasional status message ("Consumer group 'x' has
+    # no active members.") - the rows are grouped by their GROUP value into
+    # a kgd_result per group
+    def batch_kgd_parser(self, raw_txt, cmd_timestamp):
+        rows = parse_kgd_output(raw_txt, timestamp=cmd_timestamp)
+        if (rows is None):
+            return None
+        group_rows = {}
+        for row in rows:
+            if (row.group is not None):
+                group_rows.setdefault(row.group, []).append(row)
+        return dict((group, kgd_result(group, cmd_timestamp, tuple(g_rows)))
+            for group, g_rows in group_rows.items())
+
+    # describe several groups with a single ConsumerGroupCommand run (kafka
+    # 2.4+); groups=None describes every group on the cluster. Returns a dict
+    # of group -> kgd_result; groups missing from the output are missing
+    # from the dict
+    def describe_groups(self, groups=None):
+        if (groups is None):
+            group_args = '--all-groups'
+        else:
+            group_args = ' '.join(['--group %s' % group for group in groups])
+        raw_desc_txt = self.kfk_exec("%s --describe %s" % (self.cmd_prefix(), group_args))
+        cmd_timestamp = int(time.time() * 1000)
+        return self.batch_kgd_parser(raw_desc_txt, cmd_timestamp)
 
     #
     # group listing defs
     def default_kgl_parser(self, raw_txt):
-        return filter(None, raw_txt.split("\n"))
+        if (raw_txt is None):
+            return None
+        if isinstance(raw_txt, bytes):
+            raw_txt = raw_txt.decode('utf-8', 'replace')
+        return [group for group in raw_txt.split("\n") if group.strip()]
 
     #
     def group_list(self):
@@ -196,13 +421,16 @@ class consumer_group_command(kafka_command):
             return self.parser(raw_group_txt)
 
     #
-    def __init__(self, server=None, port=None, cmd=None, parser=None):
+    def __init__(self, server=None, port=None, cmd=None, parser=None, max_procs=4, exec_timeout=120, sidecar=False):
         # not sure how I want to handle the command parsing - pass thru for now
-        super(consumer_group_command, self).__init__(cmd=cmd, parser=parser)
+        super(consumer_group_command, self).__init__(
+            cmd=cmd,
+            parser=parser,
+            max_procs=max_procs,
+            exec_timeout=exec_timeout,
+            sidecar=sidecar)
         self.kfk_cmd = 'kafka.admin.ConsumerGroupCommand'
-        # an internal object dict to handle threaded vars
         self.set_elastic_fields = True
-        self._t_attrs = {}
 
         if (server is None):
             self.kafka_server = os.uname()[1]
@@ -219,19 +447,10 @@ class consumer_group_command(kafka_command):
 def kgl_parser(subp_out):
     return filter(None, subp_out.split("\n"))
 
-# kafka group description parser
+# kafka group description parser - kgd_rows, the same as the default
+# parser; use to_doc() for the document
 def kgd_parser(subp_out):
-    try:
-        lines = filter(None, subp_out.split("\n"))
-    except AttributeError as e:
-        return None
-
-    gd_fields = ['topic','partition','current_offset','log_end_offset','lag','consumer_id','host','client_id']
-    gd = []
-    # first line is "TOPIC...PARTITION... etc" - skip it
-    for line in lines[1:]:
-        gd.append(dict(zip(gd_fields, line.split())))
-    return gd
+    return parse_kgd_output(subp_out)
 
 
 def kafka_command_example_usage():
@@ -250,19 +469,17 @@ def kafka_command_example_usage():
     group_threads = {}
     group_description = {}
     # we can either create a new object or just change the output parser
-    kafka_groups.parser = kgd_parser
+    kafka_cmd.parser = kgd_parser
 
-    # simple thread creation - kfk_exec_t returns the thread object
+    # queue the requests on the worker pool - kfk_exec_t returns an async result
     for group in group_list:
-        group_threads[group] = kafka_groups.kfk_exec_t("kafka.admin.ConsumerGroupCommand --bootstrap-server %s:%d--describe --group %s" % (kafka_server, kafka_port, group)
+        group_threads[group] = kafka_cmd.kfk_exec_t("kafka.admin.ConsumerGroupCommand --bootstrap-server %s:%d--describe --group %s" % (kafka_server, kafka_port, group))
 
     pprint(group_threads)
 
-    # wait for the threads to finish, and capture the output
-    # (standard threading class has been modified here to cause "join()"
-    # to return the target function return value
+    # wait for the requests to finish, and capture the output
     for group in group_list:
-        group_description[group] = group_threads[group].join()
+        group_description[group] = group_threads[group].get()
     # dump out the descriptions
     pprint(group_description)
     return
@@ -288,7 +505,7 @@ def consumer_group_command_example_usage():
     # ...and wait for them to finish; collect the output and proceed
     group_description = {}
     for group in k_groups:
-        group_description[group] = group_threads[group].join()
+        group_description[group] = group_threads[group].get()
 
     pprint(group_description)
     return
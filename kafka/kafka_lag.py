@@ -0,0 +1,104 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# Offset deltas between consumer group samples.
+#
+#   The tracker keeps the previous sample for every (group, topic, partition)
+# and works out per-second rates for each new partition description
+# (kgd_row) - returned alongside the rows, which are left as they are:
+#
+#   consume_rate - committed offset growth (messages consumed/sec)
+#   produce_rate - log end offset growth (messages produced/sec)
+#   lag_rate     - lag growth; negative while the group is catching up
+#
+# and rolls the partitions up per (group, topic) so dashboards can read the
+# totals directly instead of running derivative aggregations over the raw
+# history.
+#
+#   A committed offset that goes backwards (offset reset) or a log end
+# offset that goes backwards (topic re-created) has no meaningful rate - the
+# rates for that partition are skipped for the cycle and start again from
+# the new sample. Samples further apart than max_age seconds don't produce
+# rates either, and partitions not seen for max_age are dropped.
+class lag_tracker(object):
+
+    def _rates(self, prev, curr):
+        rates = {}
+        if (prev is None):
+            return rates
+        dt = (curr[0] - prev[0]) / 1000.0
+        if (dt <= 0 or dt > self.max_age):
+            return rates
+
+        offset_reset = False
+        if (curr[1] is not None and prev[1] is not None):
+            if (curr[1] < prev[1]):
+                offset_reset = True
+            else:
+                rates['consume_rate'] = (curr[1] - prev[1]) / dt
+        if (curr[2] is not None and prev[2] is not None):
+            if (curr[2] < prev[2]):
+                offset_reset = True
+            else:
+                rates['produce_rate'] = (curr[2] - prev[2]) / dt
+        if (offset_reset):
+            self.resets += 1
+            return {}
+        if (curr[3] is not None and prev[3] is not None):
+            rates['lag_rate'] = (curr[3] - prev[3]) / dt
+        return rates
+
+    # samples the partition descriptions of one cycle - returns a list with
+    # the rates of each description ({} when it has none yet), in the same
+    # order, and the (group, topic) rollup documents
+    def update(self, partition_descs):
+        row_rates = []
+        rollups = {}
+        newest_ts = None
+        for gd in partition_descs:
+            key = (gd.group, gd.topic, gd.partition)
+            sample = (gd.timestamp, gd.current_offset, gd.log_end_offset, gd.lag)
+            rates = self._rates(self._samples.get(key), sample)
+            self._samples[key] = sample
+            row_rates.append(rates)
+            if (newest_ts is None or sample[0] > newest_ts):
+                newest_ts = sample[0]
+
+            rollup = rollups.get(key[:2])
+            if (rollup is None):
+                rollup = {
+                    'group': key[0],
+                    'topic': key[1],
+                    'timestamp': sample[0],
+                    'partitions': 0
+                }
+                rollups[key[:2]] = rollup
+            rollup['partitions'] += 1
+            rollup['timestamp'] = max(rollup['timestamp'], sample[0])
+            if (sample[3] is not None):
+                rollup['lag'] = rollup.get('lag', 0) + sample[3]
+            for r_field, r_val in rates.items():
+                rollup[r_field] = rollup.get(r_field, 0.0) + r_val
+
+        if (newest_ts is not None):
+            self.prune(newest_ts)
+        return row_rates, list(rollups.values())
+
+    # drop partitions that haven't been sampled within max_age of now_ms
+    def prune(self, now_ms):
+        cutoff = now_ms - (self.max_age * 1000)
+        stale = [key for key, sample in self._samples.items() if sample[0] < cutoff]
+        for key in stale:
+            del(self._samples[key])
+        if (stale):
+            log.debug("pruned %d stale partition samples" % len(stale))
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __init__(self, max_age=600):
+        self.max_age = max_age
+        self.resets = 0
+        # (group, topic, partition) -> (timestamp, current_offset, log_end_offset, lag)
+        self._samples = {}
@@ -0,0 +1,540 @@
+#!/usr/bin/python
+import os
+import sys
+import socket
+import struct
+import threading
+import time
+import logging
+
+from multiprocessing.pool import ThreadPool
+from pprint import pprint
+
+from kgd_rows import kgd_result, kgd_row
+
+log = logging.getLogger(__name__)
+
+# Native consumer group backend - speaks the Kafka wire protocol directly
+# instead of forking a ConsumerGroupCommand JVM for every request.
+#
+# Only the handful of (old, widely supported) request versions needed to
+# reproduce 'ConsumerGroupCommand --list' and '--describe --group' are
+# implemented:
+#
+#   Metadata v0         - brokers, and the leader of each topic partition
+#   ListGroups v0       - groups coordinated by a broker (asked of every broker)
+#   FindCoordinator v0  - the broker coordinating a group
+#   DescribeGroups v0   - group members and their partition assignments
+#   OffsetFetch v2      - committed offsets for every partition of a group
+#                         (v2 is the first to support fetching all topics;
+#                         brokers 0.10.2+)
+#   ListOffsets v1      - log end offsets, from each partition leader
+#
+# consumer_group_client keeps the group_list()/describe()/describe_t()
+# interface of kafka_jmx.consumer_group_command (describe_t queues on a
+# persistent pool of max_workers threads and returns an AsyncResult), and
+# describe() produces the same kgd_rows as the ConsumerGroupCommand output
+# parser.
+# Connections are made to whatever host:port is configured, so the client
+# can be pointed at a local stand-in broker (tests/test_kafka_wire.py
+# replays captured broker responses).
+
+# api name -> (api key, api version)
+kafka_api = {
+    'list_offsets': (2, 1),
+    'metadata': (3, 0),
+    'offset_fetch': (9, 2),
+    'find_coordinator': (10, 0),
+    'describe_groups': (15, 0),
+    'list_groups': (16, 0)
+}
+
+kafka_error_names = {
+    3: 'UNKNOWN_TOPIC_OR_PARTITION',
+    5: 'LEADER_NOT_AVAILABLE',
+    6: 'NOT_LEADER_FOR_PARTITION',
+    7: 'REQUEST_TIMED_OUT',
+    14: 'COORDINATOR_LOAD_IN_PROGRESS',
+    15: 'COORDINATOR_NOT_AVAILABLE',
+    16: 'NOT_COORDINATOR',
+    25: 'UNKNOWN_MEMBER_ID',
+    29: 'TOPIC_AUTHORIZATION_FAILED',
+    30: 'GROUP_AUTHORIZATION_FAILED',
+    31: 'CLUSTER_AUTHORIZATION_FAILED'
+}
+
+
+class kafka_wire_error(Exception):
+
+    def __init__(self, api, error_code):
+        self.api = api
+        self.error_code = error_code
+        super(kafka_wire_error, self).__init__("%s failed: error %d (%s)" % (
+            api, error_code, kafka_error_names.get(error_code, 'UNKNOWN')))
+
+
+# request body encoding
+class wire_writer(object):
+
+    def int16(self, v):
+        self._parts.append(struct.pack('>h', v))
+        return self
+
+    def int32(self, v):
+        self._parts.append(struct.pack('>i', v))
+        return self
+
+    def int64(self, v):
+        self._parts.append(struct.pack('>q', v))
+        return self
+
+    def string(self, v):
+        if (v is None):
+            return self.int16(-1)
+        v = v.encode('utf-8')
+        self.int16(len(v))
+        self._parts.append(v)
+        return self
+
+    # items=None encodes a null array
+    def array(self, items, write_item):
+        if (items is None):
+            return self.int32(-1)
+        self.int32(len(items))
+        for item in items:
+            write_item(self, item)
+        return self
+
+    def value(self):
+        return b''.join(self._parts)
+
+    def __init__(self):
+        self._parts = []
+
+
+# response body decoding
+class wire_reader(object):
+
+    def _unpack(self, fmt, size):
+        v = struct.unpack_from(fmt, self._data, self._pos)[0]
+        self._pos += size
+        return v
+
+    def int16(self):
+        return self._unpack('>h', 2)
+
+    def int32(self):
+        return self._unpack('>i', 4)
+
+    def int64(self):
+        return self._unpack('>q', 8)
+
+    def string(self):
+        s_len = self.int16()
+        if (s_len < 0):
+            return None
+        v = self._data[self._pos:self._pos + s_len].decode('utf-8')
+        self._pos += s_len
+        return v
+
+    def bytes(self):
+        b_len = self.int32()
+        if (b_len < 0):
+            return None
+        v = self._data[self._pos:self._pos + b_len]
+        self._pos += b_len
+        return v
+
+    def array(self, read_item):
+        n_items = self.int32()
+        if (n_items < 0):
+            return []
+        return [read_item(self) for i in range(n_items)]
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+
+# a single broker connection - requests on a connection are serialized
+class kafka_connection(object):
+
+    def _recv_exact(self, n_bytes):
+        chunks = []
+        while n_bytes > 0:
+            chunk = self._sock.recv(n_bytes)
+            if not chunk:
+                raise socket.error("connection to %s:%d closed" % (self.host, self.port))
+            chunks.append(chunk)
+            n_bytes -= len(chunk)
+        return b''.join(chunks)
+
+    def request(self, api, body=b''):
+        api_key, api_version = kafka_api[api]
+        with self._lock:
+            if (self._sock is None):
+                self._sock = socket.create_connection((self.host, self.port), self.timeout)
+            self._correlation_id = (self._correlation_id + 1) & 0x7fffffff
+            header = wire_writer() \
+                .int16(api_key) \
+                .int16(api_version) \
+                .int32(self._correlation_id) \
+                .string(self.client_id) \
+                .value()
+            try:
+                self._sock.sendall(struct.pack('>i', len(header) + len(body)) + header + body)
+                resp_len = struct.unpack('>i', self._recv_exact(4))[0]
+                resp = wire_reader(self._recv_exact(resp_len))
+            except (socket.error, socket.timeout):
+                self.close()
+                raise
+            if (resp.int32() != self._correlation_id):
+                self.close()
+                raise socket.error("correlation id mismatch from %s:%d" % (self.host, self.port))
+            return resp
+
+    def close(self):
+        if (self._sock is not None):
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+            self._sock = None
+
+    def __init__(self, host, port, client_id=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.timeout = timeout
+        self._sock = None
+        self._correlation_id = 0
+        self._lock = threading.Lock()
+
+
+# protocol level admin requests; broker connections are cached and shared
+class kafka_admin_client(object):
+
+    def _conn(self, host, port):
+        with self._lock:
+            b_conn = self._conns.get((host, port))
+            if (b_conn is None):
+                b_conn = kafka_connection(host, port, client_id=self.client_id, timeout=self.timeout)
+                self._conns[(host, port)] = b_conn
+            return b_conn
+
+    def _bootstrap(self):
+        return self._conn(self.bootstrap_server, self.bootstrap_port)
+
+    # returns ({node_id: (host, port)}, {topic: {partition: leader_id}})
+    # topics=None requests every topic
+    def metadata(self, topics=None):
+        body = wire_writer().array(topics or [], lambda w, t: w.string(t)).value()
+        resp = self._bootstrap().request('metadata', body)
+
+        def read_broker(r):
+            return (r.int32(), r.string(), r.int32())
+
+        def read_partition(r):
+            p_err = r.int16()
+            p_id = r.int32()
+            p_leader = r.int32()
+            r.array(lambda r: r.int32())    # replicas
+            r.array(lambda r: r.int32())    # isr
+            return (p_id, p_leader)
+
+        def read_topic(r):
+            t_err = r.int16()
+            t_name = r.string()
+            return (t_err, t_name, r.array(read_partition))
+
+        brokers = dict((b[0], (b[1], b[2])) for b in resp.array(read_broker))
+        topic_leaders = {}
+        for t_err, t_name, t_partitions in resp.array(read_topic):
+            if (t_err != 0):
+                log.warning("metadata for topic '%s': %s" % (t_name, kafka_wire_error('metadata', t_err)))
+                continue
+            topic_leaders[t_name] = dict(t_partitions)
+        return brokers, topic_leaders
+
+    # groups are only known to their coordinator, so every broker is asked
+    def list_groups(self):
+        brokers, _topics = self.metadata()
+        groups = set()
+        for node_id in sorted(brokers.keys()):
+            resp = self._conn(*brokers[node_id]).request('list_groups')
+            g_err = resp.int16()
+            if (g_err != 0):
+                raise kafka_wire_error('list_groups', g_err)
+            for group_id, protocol_type in resp.array(lambda r: (r.string(), r.string())):
+                groups.add(group_id)
+        return sorted(groups)
+
+    def find_coordinator(self, group):
+        resp = self._bootstrap().request(
+            'find_coordinator', wire_writer().string(group).value())
+        c_err = resp.int16()
+        c_node = resp.int32()
+        c_host = resp.string()
+        c_port = resp.int32()
+        if (c_err != 0):
+            raise kafka_wire_error('find_coordinator', c_err)
+        return (c_host, c_port)
+
+    # returns {'state':..., 'protocol_type':..., 'members': [...]}, where each
+    # member carries its (topic, partition) assignment
+    def describe_group(self, group, coordinator=None):
+        if (coordinator is None):
+            coordinator = self.find_coordinator(group)
+        resp = self._conn(*coordinator).request(
+            'describe_groups',
+            wire_writer().array([group], lambda w, g: w.string(g)).value())
+
+        def read_member(r):
+            return {
+                'member_id': r.string(),
+                'client_id': r.string(),
+                'client_host': r.string(),
+                'metadata': r.bytes(),
+                'assignment': r.bytes()
+            }
+
+        def read_group(r):
+            return {
+                'error_code': r.int16(),
+                'group': r.string(),
+                'state': r.string(),
+                'protocol_type': r.string(),
+                'protocol': r.string(),
+                'members': r.array(read_member)
+            }
+
+        g_desc = resp.array(read_group)[0]
+        if (g_desc['error_code'] != 0):
+            raise kafka_wire_error('describe_groups', g_desc['error_code'])
+
+        for member in g_desc['members']:
+            member['partitions'] = []
+            # consumer protocol assignment: version, [topic [partition]], user data
+            if (g_desc['protocol_type'] == 'consumer' and member['assignment']):
+                a_reader = wire_reader(member['assignment'])
+                a_reader.int16()
+                for t_name, t_partitions in a_reader.array(
+                        lambda r: (r.string(), r.array(lambda r: r.int32()))):
+                    for p_id in t_partitions:
+                        member['partitions'].append((t_name, p_id))
+            del(member['metadata'])
+            del(member['assignment'])
+        return g_desc
+
+    # committed offsets for every partition of a group - {(topic, partition): offset}
+    def offset_fetch(self, group, coordinator=None):
+        if (coordinator is None):
+            coordinator = self.find_coordinator(group)
+        body = wire_writer().string(group).array(None, None).value()
+        resp = self._conn(*coordinator).request('offset_fetch', body)
+
+        def read_partition(r):
+            return (r.int32(), r.int64(), r.string(), r.int16())
+
+        committed = {}
+        for t_name, t_partitions in resp.array(
+                lambda r: (r.string(), r.array(read_partition))):
+            for p_id, p_offset, p_meta, p_err in t_partitions:
+                if (p_err != 0):
+                    log.warning("offset fetch %s/%s:%d: %s" % (
+                        group, t_name, p_id, kafka_wire_error('offset_fetch', p_err)))
+                    continue
+                if (p_offset >= 0):
+                    committed[(t_name, p_id)] = p_offset
+        f_err = resp.int16()
+        if (f_err != 0):
+            raise kafka_wire_error('offset_fetch', f_err)
+        return committed
+
+    # log end offsets, requested from each partition leader
+    # {(topic, partition): offset}
+    def log_end_offsets(self, partitions):
+        topics = sorted(set(t for t, p in partitions))
+        if not topics:
+            return {}
+        brokers, topic_leaders = self.metadata(topics)
+
+        by_leader = {}
+        for t_name, p_id in partitions:
+            leader = topic_leaders.get(t_name, {}).get(p_id)
+            if (leader is None or leader not in brokers):
+                log.warning("no leader for %s:%d" % (t_name, p_id))
+                continue
+            by_leader.setdefault(leader, {}).setdefault(t_name, []).append(p_id)
+
+        end_offsets = {}
+        for leader, l_topics in by_leader.items():
+            body = wire_writer() \
+                .int32(-1) \
+                .array(sorted(l_topics.items()), lambda w, t: w
+                    .string(t[0])
+                    .array(t[1], lambda w, p: w.int32(p).int64(-1))) \
+                .value()
+            resp = self._conn(*brokers[leader]).request('list_offsets', body)
+
+            def read_partition(r):
+                return (r.int32(), r.int16(), r.int64(), r.int64())
+
+            for t_name, t_partitions in resp.array(
+                    lambda r: (r.string(), r.array(read_partition))):
+                for p_id, p_err, p_ts, p_offset in t_partitions:
+                    if (p_err != 0):
+                        log.warning("list offsets %s:%d: %s" % (
+                            t_name, p_id, kafka_wire_error('list_offsets', p_err)))
+                        continue
+                    end_offsets[(t_name, p_id)] = p_offset
+        return end_offsets
+
+    def close(self):
+        with self._lock:
+            for b_conn in self._conns.values():
+                b_conn.close()
+            self._conns = {}
+
+    def __init__(self, server, port=9092, client_id='elasticsearch_kcgd', timeout=30):
+        self.bootstrap_server = server
+        self.bootstrap_port = port
+        self.client_id = client_id
+        self.timeout = timeout
+        self._conns = {}
+        self._lock = threading.Lock()
+
+
+# drop-in replacement for kafka_jmx.consumer_group_command
+class consumer_group_client(object):
+
+    def group_list(self):
+        try:
+            return self._admin.list_groups()
+        except (kafka_wire_error, socket.error, socket.timeout) as e:
+            log.error("group list failed: %s" % repr(e))
+            return None
+
+    # a kgd_result with one kgd_row per partition with a committed offset or
+    # an assigned member - the same fields ConsumerGroupCommand --describe
+    # reports
+    def describe(self, group):
+        try:
+            coordinator = self._admin.find_coordinator(group)
+            g_desc = self._admin.describe_group(group, coordinator=coordinator)
+            committed = self._admin.offset_fetch(group, coordinator=coordinator)
+
+            owners = {}
+            for member in g_desc['members']:
+                for tp in member['partitions']:
+                    owners[tp] = member
+            partitions = sorted(set(committed.keys()) | set(owners.keys()))
+            end_offsets = self._admin.log_end_offsets(partitions)
+        except (kafka_wire_error, socket.error, socket.timeout) as e:
+            log.error("describe '%s' failed: %s" % (group, repr(e)))
+            return None
+
+        cmd_timestamp = int(time.time() * 1000)
+        gd = []
+        for t_name, p_id in partitions:
+            grp_desc = kgd_row(
+                group=group,
+                topic=t_name,
+                partition=p_id,
+                current_offset=committed.get((t_name, p_id)),
+                log_end_offset=end_offsets.get((t_name, p_id)),
+                timestamp=cmd_timestamp)
+            if (grp_desc.current_offset is not None and grp_desc.log_end_offset is not None):
+                grp_desc.lag = grp_desc.log_end_offset - grp_desc.current_offset
+            member = owners.get((t_name, p_id))
+            if (member is not None):
+                grp_desc.consumer_id = member['member_id']
+                grp_desc.host = member['client_host']
+                grp_desc.client_id = member['client_id']
+            gd.append(grp_desc)
+        return kgd_result(group, cmd_timestamp, tuple(gd))
+
+    def _pool(self):
+        with self._pool_lock:
+            if (self._workers is None):
+                self._workers = ThreadPool(self.max_workers)
+            return self._workers
+
+    def describe_t(self, group):
+        return self._pool().apply_async(self.describe, (group,))
+
+    def _describe_pair(self, group):
+        try:
+            return (group, self.describe(group))
+        except Exception as e:
+            log.exception("describe '%s' failed: %s" % (group, repr(e)))
+            return (group, None)
+        finally:
+            with self._pool_lock:
+                self._in_flight.discard(group)
+
+    # same as consumer_group_command.describe_iter - groups still queued or
+    # running from an earlier call are skipped
+    def describe_iter(self, groups):
+        with self._pool_lock:
+            busy = [group for group in groups if group in self._in_flight]
+            queued = [group for group in groups if group not in self._in_flight]
+            self._in_flight.update(queued)
+        if (busy):
+            log.warning("%d groups still being described, not queued again: %s" % (len(busy), ', '.join(busy)))
+        return self._pool().imap_unordered(self._describe_pair, queued)
+
+    # same interface as consumer_group_command.describe_groups - there's no
+    # process start-up to amortize here, so the groups are described in turn
+    def describe_groups(self, groups=None):
+        if (groups is None):
+            groups = self.group_list()
+            if (groups is None):
+                return None
+        gd = {}
+        for group in groups:
+            g_desc = self.describe(group)
+            if (g_desc is not None):
+                gd[group] = g_desc
+        return gd
+
+    def close(self):
+        with self._pool_lock:
+            if (self._workers is not None):
+                self._workers.terminate()
+                self._workers = None
+            self._in_flight.clear()
+        self._admin.close()
+
+    def __init__(self, server=None, port=None, client_id='elasticsearch_kcgd', timeout=30, max_workers=4):
+        self.max_workers = max_workers
+        self._workers = None
+        self._pool_lock = threading.Lock()
+        self._in_flight = set()
+        if (server is None):
+            self.kafka_server = os.uname()[1]
+        else:
+            self.kafka_server = server
+        if (port is None):
+            self.kafka_port = 9092
+        else:
+            self.kafka_port = port
+        self._admin = kafka_admin_client(
+            self.kafka_server,
+            self.kafka_port,
+            client_id=client_id,
+            timeout=timeout)
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG)
+    kcg_client = consumer_group_client()
+    k_groups = kcg_client.group_list()
+    print ("Kafka group list: %s" % repr(k_groups))
+    for group in k_groups or []:
+        pprint(kcg_client.describe(group))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
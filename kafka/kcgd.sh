@@ -1,7 +1,7 @@
 #!/bin/sh
 #
 # Run as cronjob
-# * * * * * /home/kafka/elasticsearch_kafka_cgd/kcgd.sh
+# * * * * * /home/kafka/elastic-monitoring/kafka/kcgd.sh
 #
 # Description
 #   This collects kafka consumer group description statistics from the cluster
@@ -14,6 +14,8 @@
 #
 #
 # This sh wrapper just ensures the execution occurs in the proper directory
+# - a checkout of the whole repo, since the collector imports the shared
+# scheduler.py and bulk_base.py from the top of it
 #
-cd /home/kafka/elasticsearch_kafka_cgd
+cd /home/kafka/elastic-monitoring/kafka
 python elasticsearch_kcgd.py --config config.json
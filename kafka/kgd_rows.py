@@ -0,0 +1,172 @@
+import logging
+
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Typed records for ConsumerGroupCommand --describe output.
+#
+#   Each partition is held as a kgd_row (fixed __slots__, integer offsets)
+# from parsing until the document is serialized with to_doc(), rather than
+# a dict of strings per line - the offsets are indexed as numbers instead of
+# being coerced by elasticsearch, and a large describe costs a fraction of
+# the memory.
+#
+#   The parser is driven by the header line, so it follows the column layout
+# of the different tool versions:
+#
+#   0.9      GROUP, TOPIC, PARTITION, CURRENT OFFSET, LOG END OFFSET, LAG, OWNER
+#   0.10     GROUP TOPIC PARTITION CURRENT-OFFSET LOG-END-OFFSET LAG OWNER
+#   0.10.2+  TOPIC PARTITION CURRENT-OFFSET LOG-END-OFFSET LAG CONSUMER-ID HOST CLIENT-ID
+#   2.x      GROUP TOPIC PARTITION CURRENT-OFFSET LOG-END-OFFSET LAG CONSUMER-ID HOST CLIENT-ID
+#
+# Multi-group output repeats the header per group; rows take their group
+# from the GROUP column when there is one. Status messages, blank lines and
+# rows that don't line up with the header are skipped, and '-' (no value)
+# leaves the field unset.
+
+# the result of describing one group - the rows are a tuple, and the group
+# and sample timestamp travel with them, so a describe can run on any
+# executor (threads, processes, asyncio) without shared state
+kgd_result = namedtuple('kgd_result', ['group', 'timestamp', 'rows'])
+
+# column headers -> row fields
+kgd_header_fields = {
+    'GROUP': 'group',
+    'TOPIC': 'topic',
+    'PARTITION': 'partition',
+    'CURRENT-OFFSET': 'current_offset',
+    'CURRENT OFFSET': 'current_offset',
+    'LOG-END-OFFSET': 'log_end_offset',
+    'LOG END OFFSET': 'log_end_offset',
+    'LAG': 'lag',
+    'CONSUMER-ID': 'consumer_id',
+    'OWNER': 'consumer_id',
+    'HOST': 'host',
+    'CLIENT-ID': 'client_id'
+}
+
+kgd_int_fields = frozenset(['partition', 'current_offset', 'log_end_offset', 'lag'])
+
+# document field order; unset (None) fields are left out of the document
+kgd_fields = (
+    'group', 'topic', 'partition', 'current_offset', 'log_end_offset', 'lag',
+    'consumer_id', 'host', 'client_id', 'timestamp')
+
+
+class kgd_row(object):
+    __slots__ = kgd_fields
+
+    def to_doc(self):
+        doc = {}
+        for field in kgd_fields:
+            value = getattr(self, field)
+            if (value is not None):
+                doc[field] = value
+        return doc
+
+    def __repr__(self):
+        return "kgd_row(%s)" % ', '.join(
+            "%s=%r" % (field, getattr(self, field)) for field in kgd_fields
+            if getattr(self, field) is not None)
+
+    def __init__(self, group=None, topic=None, partition=None, current_offset=None,
+            log_end_offset=None, lag=None, consumer_id=None, host=None, client_id=None,
+            timestamp=None):
+        self.group = group
+        self.topic = topic
+        self.partition = partition
+        self.current_offset = current_offset
+        self.log_end_offset = log_end_offset
+        self.lag = lag
+        self.consumer_id = consumer_id
+        self.host = host
+        self.client_id = client_id
+        self.timestamp = timestamp
+
+
+# header line -> (column separator, [(column index, field, typed int)]);
+# None if the line isn't a describe header
+def _column_plan(line):
+    if (',' in line):
+        sep = ','
+        cols = [col.strip() for col in line.split(',')]
+    else:
+        sep = None
+        cols = line.split()
+    if not cols or cols[0] not in ('GROUP', 'TOPIC'):
+        return None
+    plan = []
+    for col_idx, col in enumerate(cols):
+        field = kgd_header_fields.get(col)
+        if (field is not None):
+            plan.append((col_idx, field, field in kgd_int_fields))
+    return (sep, len(cols), plan)
+
+
+# parse describe output into a list of kgd_rows; group and timestamp are
+# applied to every row (a GROUP column overrides the group)
+def parse_kgd_output(raw_txt, group=None, timestamp=None):
+    if (raw_txt is None):
+        return None
+    if isinstance(raw_txt, bytes):
+        raw_txt = raw_txt.decode('utf-8', 'replace')
+
+    rows = []
+    col_plan = None
+    for line in raw_txt.split("\n"):
+        if not line.strip():
+            continue
+        header_plan = _column_plan(line)
+        if (header_plan is not None):
+            col_plan = header_plan
+            continue
+        if (col_plan is None):
+            continue
+
+        sep, n_cols, plan = col_plan
+        if (sep is None):
+            cols = line.split()
+        else:
+            cols = [col.strip() for col in line.split(sep)]
+        if (len(cols) != n_cols):
+            continue
+
+        row = kgd_row(group=group, timestamp=timestamp)
+        for col_idx, field, is_int in plan:
+            value = cols[col_idx]
+            if (value == '-'):
+                continue
+            if (is_int):
+                try:
+                    value = int(value)
+                except ValueError:
+                    continue
+            setattr(row, field, value)
+        rows.append(row)
+    return rows
+
+
+# a row from a custom parser as a kgd_row - parsers may return kgd_rows or
+# documents (dicts of field -> value, offsets as numbers or strings); fields
+# the row doesn't carry are dropped, and group and timestamp fill in where
+# the row has none
+def as_kgd_row(row, group=None, timestamp=None):
+    if not isinstance(row, kgd_row):
+        doc = row
+        row = kgd_row()
+        for field in kgd_fields:
+            value = doc.get(field)
+            if (value is None or value == '-'):
+                continue
+            if (field in kgd_int_fields):
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    continue
+            setattr(row, field, value)
+    if (row.group is None):
+        row.group = group
+    if (row.timestamp is None):
+        row.timestamp = timestamp
+    return row
@@ -1,10 +1,17 @@
 import sys
 import os
+import io
+import gzip
 import json
 import time
 import requests
 import logging
 from pprint import pformat
+from requests.adapters import HTTPAdapter
+
+# bulk_base is shared with the collectors at the top of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bulk_base
 
 log = logging.getLogger(__name__)
 
@@ -20,18 +27,32 @@ log = logging.getLogger(__name__)
 #       take more than a day or two to implement, then find a way to get
 #       approval to use the "official" elasticsearch-py package instead
 #
+# Requests go through a single requests.Session, so connections to the
+# server are kept alive and reused (up to pool_size of them) rather than
+# opened for every post. bulk_gzip compresses _bulk request bodies
+# (elasticsearch always accepts gzip request bodies); scheme='https' with
+# verify (True, False, or a CA bundle path) for TLS.
+#
 # simple_es
 class simple_es(object):
 
+    def _request(self, method, url, data=None, headers=None):
+        try:
+            return self._session.request(method, url,
+                data=data,
+                headers=headers,
+                auth=self._auth,
+                verify=self._verify,
+                timeout=self._timeout)
+        except requests.exceptions.ConnectionError as e:
+            log.debug("%s %s failed: %s" % (method, url, repr(e)))
+            raise e
+
     def index_post(self, index=None, payload=None, doctype='doc'):
         url = "%s/%s/doc/" % (self._url, index)
         js_payload = json.dumps(payload)
         log.debug("index doc (%d bytes) %s" % (len(js_payload), url))
-        try:
-            idx_post = requests.post(url, data=js_payload, auth=self._auth)
-        except ConnectionError as e:
-            log.debug("status code: %d" % idx_post.status_code)
-            raise e
+        idx_post = self._request('POST', url, data=js_payload, headers=self._json_headers)
         return json.loads(idx_post.content)
 
     # bulk post format - each document must be preceded by an "action" line,
@@ -49,21 +70,32 @@ class simple_es(object):
         for payload in payloads:
             payload_lines.append(action_line)
             payload_lines.append(json.dumps(payload))
-        # each actionline and payload must be newline deliminated
-        bulk_payload = "\n".join(payload_lines)
+        # each actionline and payload must be newline deliminated, including
+        # the last one
+        bulk_payload = "\n".join(payload_lines) + "\n"
 
         snippet_len = (1024, len(bulk_payload))[len(bulk_payload) < 1024]
         log.debug("bulk payload formatted:\n\n%s\n...\n" % bulk_payload[:snippet_len])
-        try:
-           bulk_post = requests.post(url, data=bulk_payload, auth=self._auth)
-        except ConnectionError as e:
-            log.debug("status code: %d" %bulk_post.status_code)
-            raise e
+        return self.post_bulk_body(bulk_payload)
+
+    # post an already formatted bulk body
+    def post_bulk_body(self, bulk_payload):
+        url = "%s/_bulk" % (self._url)
+        bulk_data = bulk_payload.encode('utf-8')
+        headers = self._bulk_headers
+        if (self.bulk_gzip):
+            gz_buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=gz_buf, mode='wb', compresslevel=self.gzip_level) as gz:
+                gz.write(bulk_data)
+            log.debug("bulk payload compressed %d -> %d bytes" % (len(bulk_data), gz_buf.tell()))
+            bulk_data = gz_buf.getvalue()
+            headers = self._bulk_gzip_headers
+        bulk_post = self._request('POST', url, data=bulk_data, headers=headers)
         return json.loads(bulk_post.content)
 
     def index_get(self, index=None):
         idx_get_url = "%s/%s" % (self._url, index)
-        idx_get = requests.get(idx_get_url, auth=self._auth)
+        idx_get = self._request('GET', idx_get_url)
         return json.loads(idx_get.content)
 
     def set_auth(self, user=None, password=None):
@@ -79,18 +111,53 @@ class simple_es(object):
            pass
 
     def info(self):
-        info_get = requests.get(self._url, auth=self._auth)
+        info_get = self._request('GET', self._url)
         return json.loads(info_get.content)
 
-    def __init__(self, server = None, auth = None, port = 9200):
+    def close(self):
+        self._session.close()
+
+    def __init__(self, server = None, auth = None, port = 9200, scheme = 'http', verify = True,
+            pool_size = 4, bulk_gzip = False, gzip_level = 6, timeout = 60):
         if (server is None):
-            self.server = os.uname()[1]
+            self._server = os.uname()[1]
         else:
             self._server = server
         self._port = port
-        # do http/https here
-        self._url = "http://%s:%d" % (self._server, self._port)
+        self._url = "%s://%s:%d" % (scheme, self._server, self._port)
         self._auth = auth
+        self._verify = verify
+        self._timeout = timeout
+        self.bulk_gzip = bulk_gzip
+        self.gzip_level = gzip_level
+
+        self._json_headers = {'Content-Type': 'application/json'}
+        self._bulk_headers = {'Content-Type': 'application/x-ndjson'}
+        self._bulk_gzip_headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+
+        # one pool for this server - pool_size is the number of connections
+        # kept open for reuse
+        self._session = requests.Session()
+        pool_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', pool_adapter)
+        self._session.mount('https://', pool_adapter)
+
+
+# Buffered bulk indexing through simple_es - a bulk_base.bulk_buffer (the
+# same buffering as es_bulk.bulk_writer, which needs elasticsearch-py)
+# posting with post_bulk_body(). A request that fails, or a response that
+# isn't JSON, reports the whole batch as failed.
+class bulk_buffer(bulk_base.bulk_buffer):
+
+    def __init__(self, es_conn, index=None, doctype='doc', max_docs=1000, max_bytes=5*1024*1024):
+        super(bulk_buffer, self).__init__(
+            lambda bulk_payload: es_conn.post_bulk_body(bulk_payload),
+            index=index,
+            doc_type=doctype,
+            max_docs=max_docs,
+            max_bytes=max_bytes,
+            post_errors=(requests.exceptions.RequestException, ValueError))
+        self._es = es_conn
 
 
 #
@@ -0,0 +1,106 @@
+import time
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+# Interval scheduler shared by the collectors (the collector engine pollers
+# and the kafka consumer group loop).
+#
+#   Runs are kept on a fixed grid (start + n * interval), so the schedule
+# doesn't drift with the time spent in each cycle. The caller reports how
+# each cycle went and sleeps for the returned delay:
+#
+#       sched = interval_scheduler(30, start_jitter=30)
+#       time.sleep(sched.start())
+#       while True:
+#           ok = run_cycle()
+#           time.sleep(sched.next_delay(ok))
+#
+# or just sched.wait(ok) for the sleep.
+#
+# - skip missed ticks: a cycle that overruns its interval doesn't trigger
+#   back-to-back catch-up runs; the ticks it ran over are skipped and the
+#   next run is the next tick in the future
+# - start jitter: the first run is offset by a random amount up to
+#   start_jitter seconds, so pollers started together spread themselves
+#   across the interval
+# - backoff: after consecutive failed cycles the next run is pushed out by
+#   1, 2, 4, ... intervals (capped at backoff_max seconds), so a struggling
+#   source isn't retried in a hot loop
+#
+#   The kafka collector (kafka/elasticsearch_kcgd.py) imports this module
+# from the top of the repo as well, so it runs from a checkout of the whole
+# repo.
+#
+_clock = getattr(time, 'monotonic', time.time)
+
+class interval_scheduler(object):
+
+    # returns the delay before the first run
+    def start(self):
+        offset = 0.0
+        if (self.start_jitter):
+            offset = random.uniform(0, self.start_jitter)
+        self._nextrun = self._clock() + offset
+        return offset
+
+    # record the result of the cycle that just ran and return the delay
+    # until the next one
+    def next_delay(self, success=True):
+        now = self._clock()
+        if (self._nextrun is None):
+            self._nextrun = now
+
+        self.runs += 1
+        step = 1
+        if (success):
+            self._consecutive_failures = 0
+        else:
+            self.failures += 1
+            self._consecutive_failures += 1
+            step = min(
+                2 ** (self._consecutive_failures - 1),
+                max(1, int(self.backoff_max // self.interval)))
+            if (step > 1):
+                self.backoff_skipped += step - 1
+                log.warning("%s: %d consecutive failures - backing off %ds" % (
+                    self.name, self._consecutive_failures, step * self.interval))
+        self._nextrun = self._nextrun + (step * self.interval)
+
+        if (self._nextrun < now):
+            missed = int((now - self._nextrun) // self.interval) + 1
+            self._nextrun = self._nextrun + (missed * self.interval)
+            self.overruns += 1
+            self.skipped += missed
+            log.warning("%s: cycle overran the %ds interval - skipped %d tick(s) (%d overruns, %d skipped total)" % (
+                self.name, self.interval, missed, self.overruns, self.skipped))
+
+        return self._nextrun - now
+
+    def wait(self, success=True):
+        time.sleep(self.next_delay(success))
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'backoff_skipped': self.backoff_skipped
+        }
+
+    def __init__(self, interval, start_jitter=0, backoff_max=600, name=None, clock=None):
+        self.interval = interval
+        self.start_jitter = start_jitter
+        self.backoff_max = backoff_max
+        self.name = name
+        self._clock = clock or _clock
+        self._nextrun = None
+        self._consecutive_failures = 0
+        # counters
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.backoff_skipped = 0
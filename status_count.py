@@ -1,3 +1,4 @@
+import os
 import sys
 import json
 import yaml
@@ -7,6 +8,12 @@ import requests
 import elasticsearch
 import regex
 import threading
+import argparse
+
+from multiprocessing.pool import ThreadPool
+
+import es_bulk
+import scheduler
 
 import logging
 import logging.config
@@ -52,8 +59,8 @@ PUT test_status_count_summary
         "status": {"type": "keyword" },
         "@timestamp": {"type": "date" },
         "interval": {"type": "keyword" },
-        "doc_count": {"type": long },
-        "doc_count_total": {"type": long },
+        "doc_count": {"type": "long" },
+        "doc_count_total": {"type": "long" },
         "beat.name": {"type": "keyword" },
         "pipeline.kafka_topic_id": {"type": "keyword" },
         "pipeline.egress.hostname": {"type": "keyword" },
@@ -73,8 +80,8 @@ index_mappings = {
         "status": {"type": "keyword" },
         "@timestamp": {"type": "date" },
         "interval": {"type": "keyword" },
-        "doc_count": {"type": long },
-        "doc_count_total": {"type": long },
+        "doc_count": {"type": "long" },
+        "doc_count_total": {"type": "long" },
       }
     }
   }
@@ -113,6 +120,23 @@ def reindex_aggregation(agg_response):
     # Start extracting from the nested aggs and start flattening
     reindexed_docs = []
     for s_bucket in status_buckets:
+        # composite aggregation pages are already flat - one bucket per
+        # status, or per status/sub-key pair
+        if (isinstance(s_bucket['key'], dict)):
+            c_key = dict(s_bucket['key'])
+            c_doc = {
+                'status': c_key.pop('status'),
+                '@timestamp': agg_response['interval_timestamp'],
+                'interval': agg_response['interval']
+            }
+            if (c_key):
+                c_doc.update(c_key)
+                c_doc['doc_count'] = s_bucket['doc_count']
+            else:
+                c_doc['doc_count_total'] = s_bucket['doc_count']
+            reindexed_docs.append(c_doc)
+            continue
+
         try:
             reindexed_docs.append({
                 'status': s_bucket['key'],
@@ -146,8 +170,8 @@ def gen_subagg_query(primary, secondaries):
             "range": {
                 "@timestamp": {
                     # default five minutes
-                    "gte": long((time.time() - 300) * 1000),
-                    "lte": long(time.time() * 1000),
+                    "gte": int((time.time() - 300) * 1000),
+                    "lte": int(time.time() * 1000),
                     "format": "epoch_millis"
                 }
             }
@@ -172,8 +196,503 @@ def gen_subagg_query(primary, secondaries):
     return (q_template)
 
 
+# Composite aggregation alternative to gen_subagg_query - the plain terms
+# aggregations return the top 10 buckets only, so high cardinality keys
+# (beat.name, pipeline.egress.hostname) get truncated. A composite
+# aggregation returns every bucket, a page at a time; the aggregation is
+# still named after the primary key so the pages go through
+# reindex_aggregation() unchanged. Requires elasticsearch 6.1+.
+def gen_composite_query(primary, secondary=None, size=1000):
+
+    c_sources = [{primary: {"terms": {"field": primary}}}]
+    if (secondary is not None):
+        c_sources.append({secondary: {"terms": {"field": secondary}}})
+
+    q_template = gen_subagg_query(primary, [])
+    q_template['aggs'] = {
+        ("%s" % primary): {
+            "composite": {
+                "size": size,
+                "sources": c_sources
+            }
+        }
+    }
+    return (q_template)
+
+
+# Page through the composite aggregations for a window - the status totals,
+# then status/sub-key pairs for each of the agg_keys - and yield the
+# flattened documents as each page arrives, so only a page of buckets is
+# held at a time regardless of cardinality. Raises ValueError if a page
+# can't be flattened.
+def iter_composite_docs(es_conn, interval_duration, interval_start, interval_end, page_size=1000):
+
+    logger = logging.getLogger(__name__)
+    for agg_key in [None] + agg_keys:
+        agg_query_json = gen_composite_query('status', agg_key, size=page_size)
+        agg_query_json['query']['range']['@timestamp']['gte'] = interval_start
+        agg_query_json['query']['range']['@timestamp']['lte'] = interval_end
+
+        while True:
+            logger.debug("submitting query: %s" %
+                json.dumps(agg_query_json, indent=4))
+            ridx_aggs = es_conn.search(index='filebeat-*', body=agg_query_json)
+            ridx_aggs['interval'] = interval_duration
+            ridx_aggs['interval_timestamp'] = interval_end
+
+            doc_list = reindex_aggregation(ridx_aggs)
+            if (doc_list is None):
+                raise ValueError("could not flatten %s page for window %d" %
+                    (agg_key or 'status', interval_end))
+            for doc in doc_list:
+                yield doc
+
+            # pre-6.3 responses don't include after_key - use the last bucket
+            c_buckets = ridx_aggs['aggregations']['status']['buckets']
+            if (len(c_buckets) < page_size):
+                break
+            agg_query_json['aggs']['status']['composite']['after'] = \
+                ridx_aggs['aggregations']['status'].get('after_key', c_buckets[-1]['key'])
+
+
+# the query windows for a backfill, most recent first - (start, end)
+# timestamps in milliseconds, ending one interval before the last closed
+# interval boundary
+def backfill_windows(interval_duration, n_windows, now=None):
+    if (now is None):
+        now = time.time()
+    # timestamps are still in seconds at this point...
+    _set_ts = int(now)
+    interval_end = _set_ts - (_set_ts % interval_names[interval_duration])
+    # convert to milliseconds
+    interval_end = interval_end * 1000
+    interval_delta = interval_names[interval_duration] * 1000
+
+    windows = []
+    for i in range(n_windows):
+        interval_end = interval_end - interval_delta
+        windows.append((interval_end - interval_delta, interval_end))
+    return windows
+
+
+# run the aggregation for a single window; returns the flattened documents,
+# or None if the query failed
+def query_window(es_conn, interval_duration, interval_start, interval_end):
+
+    logger = logging.getLogger(__name__)
+    agg_query_json = gen_subagg_query('status', agg_keys)
+    agg_query_json['query']['range']['@timestamp']['gte'] = interval_start
+    agg_query_json['query']['range']['@timestamp']['lte'] = interval_end
+
+    # submit the query and add the timestamp info to the response
+    logger.debug("submitting query: %s" %
+        json.dumps(agg_query_json, indent=4))
+    try:
+        ridx_aggs = es_conn.search(index='filebeat-*', body=agg_query_json)
+    except elasticsearch.TransportError as e:
+        logger.error("could not complete query %s", repr(e))
+        return None
+
+    ridx_aggs['interval'] = interval_duration
+    ridx_aggs['interval_timestamp'] = interval_end
+
+    return reindex_aggregation(ridx_aggs)
+
+
+# The checkpoint file records the end timestamps of the windows whose
+# documents have all been indexed, so an interrupted backfill picks up where
+# it stopped. It's rewritten (via a temp file + rename) after every bulk
+# flush.
+def load_checkpoint(filename, interval_duration):
+
+    logger = logging.getLogger(__name__)
+    try:
+        with open(filename) as f:
+            checkpoint = json.load(f)
+    except (IOError, OSError, ValueError):
+        return set()
+
+    if (checkpoint.get('interval') != interval_duration):
+        logger.warning("checkpoint %s is for interval '%s' - ignoring" %
+            (filename, checkpoint.get('interval')))
+        return set()
+    return set(checkpoint.get('completed', []))
+
+
+def save_checkpoint(filename, interval_duration, completed):
+    write_json_file(filename, {
+        'interval': interval_duration,
+        'completed': sorted(completed)
+    })
+
+
+# the flattened documents for a window - with page_size set, streamed from
+# the composite aggregation pages. Raises ValueError (or the
+# elasticsearch.TransportError) if the window can't be queried.
+def iter_window_docs(es_conn, interval_duration, window, page_size=None):
+    if (page_size is None):
+        doc_list = query_window(es_conn, interval_duration, window[0], window[1])
+        if (doc_list is None):
+            raise ValueError("could not query window %d" % window[1])
+        for doc in doc_list:
+            yield doc
+    else:
+        for doc in iter_composite_docs(
+                es_conn, interval_duration, window[0], window[1], page_size=page_size):
+            yield doc
+
+
+# index documents through a bulk writer of their own; returns True only if
+# every document was indexed. A failed query or request (connection
+# errors, 5xx, search_phase_execution_exception) fails the window rather
+# than raising.
+def index_docs(es_conn, doc_iter, label=None, bulk_max_docs=1000):
+
+    logger = logging.getLogger(__name__)
+    w_writer = es_bulk.bulk_writer(
+        es_conn,
+        index='test_status_count_summary',
+        doc_type='doc',
+        max_docs=bulk_max_docs)
+    try:
+        w_indexed, w_failed = w_writer.add_all(doc_iter, label_of=lambda doc: label)
+    except (elasticsearch.TransportError, ValueError) as e:
+        logger.error("could not complete window %s: %s" % (label, repr(e)))
+        return False
+    if (w_failed):
+        logger.error("%d documents rejected for window %s" % (len(w_failed), label))
+        return False
+    return True
+
+
+# query a window and index its documents; on_doc is called with each
+# document as it's indexed
+def index_window(es_conn, interval_duration, window, page_size=None,
+        bulk_max_docs=1000, on_doc=None):
+
+    def window_docs():
+        for doc in iter_window_docs(es_conn, interval_duration, window, page_size=page_size):
+            if (on_doc is not None):
+                on_doc(doc)
+            yield doc
+
+    return index_docs(es_conn, window_docs(), label=window[1], bulk_max_docs=bulk_max_docs)
+
+
+def write_json_file(filename, obj):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(obj, f)
+    os.rename(tmp_filename, filename)
+
+
+# Windows are queried by a pool of worker threads; the flattened documents
+# are fed back to this thread and written through a bulk writer. A window
+# is checkpointed once every one of its documents has been flushed without
+# error - windows with failed queries or rejected documents are left for
+# the next run.
+#
+# In composite mode (page_size set) each worker streams its window's pages
+# straight into its own bulk writer instead, so a window is never held in
+# memory in full; the window is handed back with no documents, or as failed,
+# and checkpointed as soon as it's back since its writer has been flushed.
+def run_backfill(es_conn, interval_duration, windows, concurrency=4,
+        checkpoint_file=None, bulk_max_docs=1000, page_size=None):
+
+    logger = logging.getLogger(__name__)
+    completed = set()
+    if (checkpoint_file is not None):
+        completed = load_checkpoint(checkpoint_file, interval_duration)
+    todo = [w for w in windows if w[1] not in completed]
+    logger.info("backfilling %d of %d %s windows (%d workers)" % (
+        len(todo), len(windows), interval_duration, concurrency))
+
+    idx_writer = es_bulk.bulk_writer(
+        es_conn,
+        index='test_status_count_summary',
+        doc_type='doc',
+        max_docs=bulk_max_docs)
+    buffered_windows = set()   # fully buffered since the last flush
+    failed_windows = set()
+
+    def record_flush(bulk_rc):
+        failed_windows.update(bulk_rc[1])
+        completed.update(buffered_windows - failed_windows)
+        buffered_windows.clear()
+        if (checkpoint_file is not None):
+            save_checkpoint(checkpoint_file, interval_duration, completed)
+
+    def run_window(window):
+        if (page_size is None):
+            return window[1], query_window(es_conn, interval_duration, window[0], window[1])
+        if (index_window(es_conn, interval_duration, window,
+                page_size=page_size, bulk_max_docs=bulk_max_docs)):
+            return window[1], []
+        return window[1], None
+
+    worker_pool = ThreadPool(concurrency)
+    try:
+        n_done = 0
+        for interval_end, doc_list in worker_pool.imap_unordered(run_window, todo):
+            n_done += 1
+            if (doc_list is None):
+                failed_windows.add(interval_end)
+                continue
+            if (page_size is not None):
+                completed.add(interval_end)
+                if (checkpoint_file is not None):
+                    save_checkpoint(checkpoint_file, interval_duration, completed)
+            else:
+                for doc in doc_list:
+                    bulk_rc = idx_writer.add(doc, label=interval_end)
+                    if (bulk_rc is not None):
+                        record_flush(bulk_rc)
+                buffered_windows.add(interval_end)
+            logger.debug("window %d complete (%d/%d)" % (interval_end, n_done, len(todo)))
+        record_flush(idx_writer.flush())
+    finally:
+        worker_pool.close()
+        worker_pool.join()
+
+    logger.info("backfill complete: %d windows indexed, %d failed" % (
+        len(completed), len(failed_windows)))
+    return completed, failed_windows
+
+
+# The last indexed interval_timestamp for an interval - from the state file
+# if we have one, otherwise the newest document in the summary index.
+# Returns None if there's no record of the interval at all.
+def last_indexed_window(es_conn, interval_duration, state):
+
+    logger = logging.getLogger(__name__)
+    if (interval_duration in state):
+        return state[interval_duration]
+
+    try:
+        last_rc = es_conn.search(
+            index='test_status_count_summary',
+            body={
+                "query": {"term": {"interval": interval_duration}},
+                "aggs": {"last": {"max": {"field": "@timestamp"}}},
+                "size": 0
+            })
+    except elasticsearch.NotFoundError:
+        return None
+    last_ts = last_rc['aggregations']['last']['value']
+    if (last_ts is None):
+        return None
+    logger.info("resuming %s from summary index at %d" % (interval_duration, last_ts))
+    return int(last_ts)
+
+
+# Coarser interval documents derived from the finest interval's documents,
+# rather than re-querying filebeat-* for every resolution. Fine documents
+# are summed into each coarse window they fall in, keyed by status and
+# sub-key/value; a coarse window is complete once the fine window ending on
+# its boundary has been added. Windows are aligned the same way as the
+# queried ones (interval multiples from the epoch), so the rolled up
+# documents match what a direct query for the coarse interval would return.
+#
+# Note: the default terms aggregations are truncated to the top 10 keys per
+# fine window, so rollups of those undercount the long tail - use composite
+# mode when rolling up.
+class interval_rollup(object):
+
+    def add(self, doc):
+        fine_ts = doc['@timestamp']
+        if ('doc_count_total' in doc):
+            r_field = None
+            r_count = 'doc_count_total'
+        else:
+            r_field = [k for k in agg_keys if k in doc][0]
+            r_count = 'doc_count'
+        r_key = (doc['status'], r_field, doc.get(r_field))
+
+        for interval_duration in self.durations:
+            delta = interval_names[interval_duration] * 1000
+            # fine window ending at fine_ts falls in the coarse window ending
+            # on the next coarse boundary at or after it
+            c_end = -(-fine_ts // delta) * delta
+            c_window = self._windows.setdefault((interval_duration, c_end), {})
+            c_doc = c_window.get(r_key)
+            if (c_doc is None):
+                c_doc = dict(doc)
+                c_doc['@timestamp'] = c_end
+                c_doc['interval'] = interval_duration
+                c_window[r_key] = c_doc
+            else:
+                c_doc[r_count] += doc[r_count]
+
+    # pop the coarse windows completed by the fine window ending at fine_ts,
+    # as (interval, window end, documents)
+    def closed(self, fine_ts):
+        c_closed = []
+        for w_key in sorted(self._windows.keys(), key=lambda k: k[1]):
+            if (w_key[1] <= fine_ts):
+                c_closed.append((w_key[0], w_key[1], list(self._windows.pop(w_key).values())))
+        return c_closed
+
+    def __init__(self, durations):
+        self.durations = durations
+        self._windows = {}
+
+
+# Continuous mode - rather than rescanning a fixed range, remember the last
+# completed window for each interval and, on every tick, query only the
+# windows that have closed since. Windows are indexed (and the state file
+# updated) as soon as each one completes; a failed window stops that
+# interval until the next tick. Ticks follow the finest interval, starting
+# settle seconds after a window boundary to give late events time to land.
+#
+# The state file is written after a window's documents have been flushed,
+# so a crash between the two re-indexes that one window (as duplicates) on
+# the next start.
+#
+# With rollup, only the finest of the durations is queried; the others are
+# built locally through interval_rollup. On startup the fine windows back to
+# the start of the oldest incomplete coarse window are re-queried to rebuild
+# the rollups - fine documents that were already indexed aren't re-indexed.
+def run_daemon(es_conn, durations, state_file='status_count.state',
+        settle=60, bulk_max_docs=1000, page_size=None, rollup=False):
+
+    logger = logging.getLogger(__name__)
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        state = {}
+
+    def closed_window_end(interval_duration):
+        delta = interval_names[interval_duration]
+        _set_ts = int(time.time() - settle)
+        return (_set_ts - (_set_ts % delta)) * 1000
+
+    fine_duration = min(durations, key=lambda d: interval_names[d])
+    coarse_durations = []
+    if (rollup):
+        coarse_durations = [d for d in durations if d != fine_duration]
+        for interval_duration in coarse_durations:
+            if (interval_names[interval_duration] % interval_names[fine_duration]):
+                raise ValueError("%s is not a multiple of %s" % (interval_duration, fine_duration))
+
+    for interval_duration in durations:
+        last_ts = last_indexed_window(es_conn, interval_duration, state)
+        if (last_ts is None):
+            if (interval_duration in coarse_durations):
+                # rolled up from here - the open window is the first one
+                last_ts = closed_window_end(interval_duration)
+            else:
+                # nothing recorded - start with the most recently closed window
+                last_ts = closed_window_end(interval_duration) - \
+                    (interval_names[interval_duration] * 1000)
+        state[interval_duration] = last_ts
+
+    if (rollup):
+        query_durations = [fine_duration]
+        rollups = interval_rollup(coarse_durations)
+        # fine windows are replayed from the oldest incomplete coarse window
+        fine_position = min(state[d] for d in durations)
+    else:
+        query_durations = durations
+    pending_rollups = []
+
+    tick = interval_names[fine_duration]
+    # first tick lands settle seconds after the next finest window boundary
+    _now = time.time()
+    time.sleep((tick - (_now % tick) + settle) % tick)
+    d_sched = scheduler.interval_scheduler(tick, name='status_count')
+    d_sched.start()
+    while True:
+        tick_ok = True
+        if not (rollup):
+            for interval_duration in query_durations:
+                delta = interval_names[interval_duration] * 1000
+                window_end = state[interval_duration] + delta
+                while (window_end <= closed_window_end(interval_duration)):
+                    if not index_window(es_conn, interval_duration,
+                            (window_end - delta, window_end),
+                            page_size=page_size, bulk_max_docs=bulk_max_docs):
+                        tick_ok = False
+                        break
+                    logger.info("indexed %s window %d" % (interval_duration, window_end))
+                    state[interval_duration] = window_end
+                    write_json_file(state_file, state)
+                    window_end = window_end + delta
+        else:
+            delta = interval_names[fine_duration] * 1000
+            window_end = fine_position + delta
+            while (window_end <= closed_window_end(fine_duration)):
+                window = (window_end - delta, window_end)
+                # a window's documents are only rolled up once it has completed
+                window_docs = []
+                if (window_end > state[fine_duration]):
+                    window_ok = index_window(es_conn, fine_duration, window,
+                        page_size=page_size, bulk_max_docs=bulk_max_docs,
+                        on_doc=window_docs.append)
+                else:
+                    try:
+                        window_docs.extend(iter_window_docs(
+                            es_conn, fine_duration, window, page_size=page_size))
+                        window_ok = True
+                    except (elasticsearch.TransportError, ValueError) as e:
+                        logger.error("could not replay window %d: %s" % (window_end, repr(e)))
+                        window_ok = False
+                if not (window_ok):
+                    tick_ok = False
+                    break
+
+                for doc in window_docs:
+                    rollups.add(doc)
+                fine_position = window_end
+                if (window_end > state[fine_duration]):
+                    logger.info("indexed %s window %d" % (fine_duration, window_end))
+                    state[fine_duration] = window_end
+                    write_json_file(state_file, state)
+                pending_rollups.extend(rollups.closed(window_end))
+                window_end = window_end + delta
+
+            # completed rollups are kept until they've been indexed
+            unsent_rollups = []
+            blocked = set()   # keep each interval's rollups in order
+            for interval_duration, c_end, c_docs in pending_rollups:
+                if (c_end <= state[interval_duration]):
+                    continue
+                if (interval_duration not in blocked and index_docs(es_conn, c_docs, label=c_end, bulk_max_docs=bulk_max_docs)):
+                    logger.info("indexed %s rollup %d (%d docs)" % (interval_duration, c_end, len(c_docs)))
+                    state[interval_duration] = c_end
+                else:
+                    tick_ok = False
+                    blocked.add(interval_duration)
+                    unsent_rollups.append((interval_duration, c_end, c_docs))
+            pending_rollups = unsent_rollups
+            write_json_file(state_file, state)
+        d_sched.wait(tick_ok)
+
+
 def main():
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interval", type=str, default='15m', choices=sorted(interval_names.keys()))
+    parser.add_argument("--days", type=int, default=30, help="days to backfill")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent window queries")
+    parser.add_argument("--checkpoint", type=str, default='status_count.checkpoint',
+        help="resume file of completed windows")
+    parser.add_argument("--bulk-size", type=int, default=1000, help="max documents per _bulk request")
+    parser.add_argument("--composite", action='store_true',
+        help="page through every bucket with composite aggregations")
+    parser.add_argument("--page-size", type=int, default=1000, help="composite aggregation page size")
+    parser.add_argument("--daemon", action='store_true',
+        help="run continuously, querying only newly closed windows")
+    parser.add_argument("--daemon-intervals", type=str, nargs='+', default=['15m', '1h'],
+        choices=sorted(interval_names.keys()))
+    parser.add_argument("--state-file", type=str, default='status_count.state',
+        help="last completed window per interval (daemon mode)")
+    parser.add_argument("--settle", type=int, default=60,
+        help="seconds to wait after a window closes before querying it")
+    parser.add_argument("--rollup", action='store_true',
+        help="query only the finest daemon interval and derive the rest locally")
+    args = parser.parse_args()
+
     logger = logging.getLogger(__name__)
     es_cred = None
     try:
@@ -191,56 +710,31 @@ def main():
         hosts=[{'host': 'localhost', 'port': '9200'}],
         sniff_on_start=False,
         sniff_on_connection_fail=False,
+        maxsize=max(10, args.concurrency + 1),
         http_auth=(es_cred['user'], es_cred['pass']))
 
-
-
-    interval_duration = '15m'
-    # timestamps are still in seconds at this point...
-    _set_ts = long(time.time())
-    interval_end = _set_ts - (_set_ts % interval_names[interval_duration])
-    interval_start = interval_end - interval_names[interval_duration]
-    # convert to milliseconds
-    interval_end = interval_end * 1000
-    interval_start = interval_start * 1000
-    interval_delta = interval_names[interval_duration] * 1000
-
-    run_thirty_days = int(60/15) * 24 * 30
-
-    # generate the aggregation query
-    agg_query_json = gen_subagg_query('status', agg_keys)
-    for i in range(run_thirty_days):
-        interval_end = interval_end - interval_delta
-        interval_start = interval_start - interval_delta
-
-        agg_query_json['query']['range']['@timestamp']['gte'] = interval_start
-        agg_query_json['query']['range']['@timestamp']['lte'] = interval_end
-
-        # submit the query and add the timestamp info to the response
-        logger.debug("submitting query: %s" %
-            json.dumps(agg_query_json, indent=4))
-        try:
-            ridx_aggs = test_es.search(index='filebeat-*', body=agg_query_json)
-        except (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout) as e:
-            logger.error("could not complete query %s", repr(e))
-            continue
-
-        ridx_aggs['interval'] = interval_duration
-        ridx_aggs['interval_timestamp'] = interval_end
-
-        doc_list = reindex_aggregation(ridx_aggs)
-
-        for doc in doc_list:
-            try:
-                test_es.index(
-                    index='test_status_count_summary',
-                    doc_type='doc',
-                    body=json.dumps(doc))
-            except (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout) as e:
-                logger.error("could not complete query %s", repr(e))
-                continue
-
-        print ("ran iteration %d" % i)
+    if (args.daemon):
+        run_daemon(
+            test_es,
+            args.daemon_intervals,
+            state_file=args.state_file,
+            settle=args.settle,
+            bulk_max_docs=args.bulk_size,
+            page_size=(None, args.page_size)[args.composite],
+            rollup=args.rollup)
+
+    interval_duration = args.interval
+    n_windows = (args.days * interval_names['1d']) // interval_names[interval_duration]
+    windows = backfill_windows(interval_duration, n_windows)
+
+    run_backfill(
+        test_es,
+        interval_duration,
+        windows,
+        concurrency=args.concurrency,
+        checkpoint_file=args.checkpoint,
+        bulk_max_docs=args.bulk_size,
+        page_size=(None, args.page_size)[args.composite])
 
     sys.exit(0)
 
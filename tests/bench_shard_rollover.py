@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import argparse
+
+# run from tests/ - the collectors live at the top of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shard_stats
+
+# Benchmark for the shard_stats day-rollover merge.
+#
+# Generates synthetic _cat/shards rows for the 22:00-24:00 window, where
+# both the current and the next day's indexes exist, and times
+# shard_stats.merge_shard_rollover() over them. With --compare, the previous
+# list-based filter (a linear 'in' scan of the next-day uiids for every
+# current-day shard) is timed over the same rows.
+#
+#   python tests/bench_shard_rollover.py
+#   python tests/bench_shard_rollover.py --rows 10000 50000 --compare
+#
+# test_shard_stats.py checks the merge against the list-based filter on the
+# same generated rows.
+
+idx_pstr = '-2018.07.31'
+idx_pstr2 = '-2018.08.01'
+
+
+# half the rows belong to the current day, half to the next day; the next
+# day covers every other template, so half the current-day rows are dropped
+def gen_shard_rows(n_rows, shards_per_index=5):
+    rows = []
+    t_idx = -1
+    while True:
+        t_idx += 1
+        template = 'filebeat_app%05d' % t_idx
+        for day_sfx in (idx_pstr, idx_pstr2):
+            if (day_sfx == idx_pstr2 and t_idx % 2):
+                continue
+            for shard in range(shards_per_index):
+                for prirep in ('p', 'r'):
+                    rows.append({
+                        'index': template + day_sfx,
+                        'shard': str(shard),
+                        'prirep': prirep,
+                        'state': 'STARTED',
+                        'docs': '123456',
+                        'store': '98765432',
+                        'ip': '10.0.0.%d' % (shard + 1),
+                        'node': 'node%02d' % shard
+                    })
+                    if (len(rows) >= n_rows):
+                        return rows
+
+
+# the pre-merge implementation: current-day rows filtered against a list
+# of next-day uiids
+def list_rollover(es_shardinfo, idx_pstr, idx_pstr2):
+    updated_shard_uuids = []
+    shard_stats_to_push = []
+    current_day_sstats = []
+    for _shard in es_shardinfo:
+        if (idx_pstr in _shard['index']):
+            curr_day = True
+            s_template = _shard['index'].replace(idx_pstr, '')
+        else:
+            curr_day = False
+            s_template = _shard['index'].replace(idx_pstr2, '')
+        s_uiid = "%03d.%s-%s" % (int(_shard['shard']), _shard['prirep'], s_template)
+        sh_data = {'shard': {'shard_uiid': s_uiid}, 'row': _shard}
+        if (curr_day):
+            current_day_sstats.append(sh_data)
+        else:
+            shard_stats_to_push.append(sh_data)
+            updated_shard_uuids.append(s_uiid)
+    for s_data in current_day_sstats:
+        if (s_data['shard']['shard_uiid'] in updated_shard_uuids):
+            pass
+        else:
+            shard_stats_to_push.append(s_data)
+    return shard_stats_to_push
+
+
+def time_call(fn, *args):
+    _st = time.time()
+    rc = fn(*args)
+    return rc, (time.time() - _st) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument("--compare", action='store_true',
+        help="also time the list-based filter (slow for large row counts)")
+    args = parser.parse_args()
+
+    print("%10s %10s %14s %14s" % ('rows', 'pushed', 'merge ms', 'list ms'))
+    for n_rows in args.rows:
+        rows = gen_shard_rows(n_rows)
+        pushed, merge_ms = time_call(
+            shard_stats.merge_shard_rollover, rows, idx_pstr, idx_pstr2)
+        list_col = '-'
+        if (args.compare):
+            l_pushed, list_ms = time_call(list_rollover, rows, idx_pstr, idx_pstr2)
+            if (len(l_pushed) != len(pushed)):
+                print("push count mismatch: %d != %d" % (len(l_pushed), len(pushed)))
+                sys.exit(1)
+            list_col = '%.2f' % list_ms
+        print("%10d %10d %14.2f %14s" % (len(rows), len(pushed), merge_ms, list_col))
+
+
+if __name__ == '__main__':
+    main()
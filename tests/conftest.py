@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the collectors import each other as top level modules from their own
+# directories, so make the repo root and kafka/ importable for the tests
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (root, os.path.join(root, 'kafka')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
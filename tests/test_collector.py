@@ -0,0 +1,125 @@
+import socket
+import threading
+import time
+
+import pytest
+
+elasticsearch = pytest.importorskip('elasticsearch')
+import collector
+import scheduler
+
+
+class engine_stopped(Exception):
+    pass
+
+
+# the engine's interval_scheduler, without the start jitter, recording each
+# schedule by poller name; the engine is stopped once stop_poller has run
+# stop_after cycles
+def recording_schedules(stop_poller, stop_after):
+    schedules = {}
+
+    class recording_schedule(scheduler.interval_scheduler):
+
+        def start(self):
+            self.start_jitter = 0
+            return super(recording_schedule, self).start()
+
+        def next_delay(self, success=True):
+            delay = super(recording_schedule, self).next_delay(success)
+            if (self.name == stop_poller and self.runs >= stop_after):
+                raise engine_stopped()
+            return delay
+
+        def __init__(self, interval, **kwargs):
+            super(recording_schedule, self).__init__(interval, **kwargs)
+            schedules[self.name] = self
+
+    return recording_schedule, schedules
+
+
+# a poll function that records when it ran, and on which thread
+class recorded_poll(object):
+
+    def __call__(self):
+        st = time.time()
+        time.sleep(self.duration)
+        self.spans.append((st, time.time(), threading.current_thread().name))
+        if (self.error is not None):
+            raise self.error
+
+    def __init__(self, duration, error=None):
+        self.duration = duration
+        self.error = error
+        self.spans = []
+
+
+def overlaps(spans_a, spans_b):
+    return any(a_st < b_end and b_st < a_end
+        for a_st, a_end, _ in spans_a for b_st, b_end, _ in spans_b)
+
+
+def test_engine_serializes_a_cluster_and_backs_off(monkeypatch):
+    schedule_class, schedules = recording_schedules('slow[a]', 6)
+    monkeypatch.setattr(collector.scheduler, 'interval_scheduler', schedule_class)
+
+    slow = recorded_poll(0.1)
+    failing = recorded_poll(0.02, error=RuntimeError("bad response"))
+    refused = recorded_poll(0.02, error=elasticsearch.ConnectionError("connection refused"))
+    other_cluster = recorded_poll(0.1)
+    engine = collector.collector_engine(max_workers=4, backoff_max=600)
+    engine.add_poller('slow', 'a', 0.05, slow)
+    engine.add_poller('failing', 'a', 0.05, failing)
+    engine.add_poller('refused', 'a', 0.05, refused)
+    engine.add_poller('slow', 'b', 0.05, other_cluster)
+    with pytest.raises(engine_stopped):
+        engine.run()
+
+    # polls run on the engine's worker threads, one at a time per cluster
+    assert all(name.startswith('ThreadPoolExecutor') for poll in (slow, failing, other_cluster)
+        for st, end, name in poll.spans)
+    assert len(slow.spans) == 6 and failing.spans and refused.spans
+    assert not overlaps(slow.spans, failing.spans)
+    assert not overlaps(slow.spans, refused.spans)
+    assert not overlaps(failing.spans, refused.spans)
+    assert overlaps(slow.spans, other_cluster.spans)
+
+    # exceptions count as failed cycles and push the next run out by 1, 2,
+    # 4 ... intervals
+    stats = engine.poller_stats()
+    assert stats['slow[a]']['failures'] == 0
+    for name in ('failing[a]', 'refused[a]'):
+        failures = stats[name]['failures']
+        assert failures == stats[name]['runs'] >= 1
+        assert stats[name]['backoff_skipped'] == sum(2 ** n - 1 for n in range(failures))
+    # backed off, the failing pollers run less often than the healthy one
+    assert len(failing.spans) < len(slow.spans)
+
+
+def test_monitoring_client_shared_per_hosts(monkeypatch):
+    monkeypatch.setattr(collector, '_dest_clients', {})
+    cred = {'user': 'mon', 'pass': 'secret'}
+    hosts = [{'host': 'mon1', 'port': 9200}, {'host': 'mon2', 'port': 9200}]
+    client = collector.monitoring_client(hosts, cred, maxsize=8)
+    # the same hosts, however the dicts were built, get the same client
+    assert collector.monitoring_client([{'port': 9200, 'host': 'mon1'}, {'port': 9200, 'host': 'mon2'}], cred) \
+        is client
+    assert collector.monitoring_client(hosts[:1], cred) is not client
+    assert len(collector._dest_clients) == 2
+
+
+def test_keepalive_socket_options(monkeypatch):
+    monkeypatch.setattr(collector, '_dest_clients', {})
+    cred = {'user': 'mon', 'pass': 'secret'}
+    client = collector.monitoring_client([{'host': 'mon1', 'port': 9200}], cred,
+        keepalive_idle=45, keepalive_interval=5)
+    connection = client.transport.connection_pool.connections[0]
+    assert isinstance(connection, collector.keepalive_connection)
+
+    # every new connection in the pool has keep-alive enabled on its socket
+    sock_opts = connection.pool._new_conn().socket_options
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in sock_opts
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        assert (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 45) in sock_opts
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        assert (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5) in sock_opts
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+elasticsearch = pytest.importorskip('elasticsearch')
+import es_bulk
+
+
+# answers _bulk requests, rejecting the documents whose label is in reject
+class fake_es(object):
+
+    def bulk(self, body):
+        docs = [json.loads(line) for line in body.splitlines()[1::2]]
+        self.requests.append(docs)
+        items = []
+        for doc in docs:
+            if (doc['id'] in self.reject):
+                items.append({'index': {'status': 400, 'error': {'type': 'mapper_parsing_exception'}}})
+            else:
+                items.append({'index': {'status': 201}})
+        return {'errors': any('error' in item['index'] for item in items), 'items': items}
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.requests = []
+
+
+def test_add_all_counts_every_request():
+    es = fake_es(reject=['doc-2', 'doc-6'])
+    writer = es_bulk.bulk_writer(es, index='test', max_docs=3)
+    docs = [{'id': 'doc-%d' % n} for n in range(8)]
+    assert writer.add_all(docs, label_of=lambda doc: doc['id']) == (6, ['doc-2', 'doc-6'])
+    assert [len(docs) for docs in es.requests] == [3, 3, 2]
+    assert writer.pending == 0
+
+
+def test_add_all_nothing_to_post():
+    es = fake_es()
+    assert es_bulk.bulk_writer(es, index='test').add_all([]) == (0, [])
+    assert es.requests == []
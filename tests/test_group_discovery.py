@@ -0,0 +1,123 @@
+import group_discovery
+
+
+class fake_clock(object):
+
+    def __call__(self):
+        return self.now
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+
+# group_list() returns the next of lists in turn (None for a failed list
+# request), and repeats the last one after that
+class stub_lister(object):
+
+    def group_list(self):
+        self.calls += 1
+        if (len(self.lists) > 1):
+            return self.lists.pop(0)
+        return self.lists[0]
+
+    def __init__(self, *lists):
+        self.lists = list(lists)
+        self.calls = 0
+
+
+def discovery_for(lister, clock, **kwargs):
+    return group_discovery.group_discovery(lister, clock=clock, **kwargs)
+
+
+def test_list_cached_until_refresh_interval():
+    clock = fake_clock()
+    lister = stub_lister(['b', 'a'], ['a', 'c'])
+    discovery = discovery_for(lister, clock, refresh_interval=600)
+    assert discovery.groups() == ['a', 'b']
+    clock.now += 599
+    assert discovery.groups() == ['a', 'b']
+    assert lister.calls == 1
+    clock.now += 1
+    assert discovery.groups() == ['a', 'c']
+    assert lister.calls == 2
+    assert discovery.refreshes == 2
+
+
+def test_failed_refresh_keeps_last_list():
+    clock = fake_clock()
+    lister = stub_lister(['a', 'b'], None, None, ['b'])
+    discovery = discovery_for(lister, clock, refresh_interval=600)
+    assert discovery.groups() == ['a', 'b']
+    clock.now += 600
+    assert discovery.groups() == ['a', 'b']
+    # a failed refresh is tried again on the next call
+    clock.now += 1
+    assert discovery.groups() == ['a', 'b']
+    clock.now += 1
+    assert discovery.groups() == ['b']
+    assert lister.calls == 4
+    assert discovery.refreshes == 2
+
+
+def test_failed_first_list():
+    clock = fake_clock()
+    discovery = discovery_for(stub_lister(None, ['a']), clock)
+    assert discovery.groups() == []
+    assert discovery.groups() == ['a']
+
+
+def test_empty_groups_parked_and_paroled():
+    clock = fake_clock()
+    discovery = discovery_for(stub_lister(['a', 'b']), clock,
+        refresh_interval=10 ** 6, empty_threshold=3, empty_ttl=1800)
+    for _ in range(2):
+        assert discovery.groups() == ['a', 'b']
+        discovery.report('a', False)
+        discovery.report('b', True)
+    # the third empty result in a row parks it
+    discovery.report('a', False)
+    assert discovery.parked() == ['a']
+    assert discovery.groups() == ['b']
+    clock.now += 1799
+    assert discovery.groups() == ['b']
+
+    # parole - tried again, and one more empty result parks it straight away
+    clock.now += 1
+    assert discovery.groups() == ['a', 'b']
+    assert discovery.parked() == []
+    discovery.report('a', False)
+    assert discovery.parked() == ['a']
+    assert discovery.groups() == ['b']
+
+    # a group with rows on parole stays active
+    clock.now += 1800
+    assert discovery.groups() == ['a', 'b']
+    discovery.report('a', True)
+    discovery.report('a', False)
+    discovery.report('a', False)
+    assert discovery.groups() == ['a', 'b']
+
+
+def test_rows_clear_the_empty_count():
+    clock = fake_clock()
+    discovery = discovery_for(stub_lister(['a']), clock, empty_threshold=2)
+    discovery.groups()
+    discovery.report('a', False)
+    discovery.report('a', True)
+    discovery.report('a', False)
+    assert discovery.groups() == ['a']
+
+
+def test_removed_groups_forgotten():
+    clock = fake_clock()
+    lister = stub_lister(['a', 'b'], ['b'], ['a', 'b'])
+    discovery = discovery_for(lister, clock, refresh_interval=60, empty_threshold=1)
+    discovery.groups()
+    discovery.report('a', False)
+    assert discovery.parked() == ['a']
+    clock.now += 60
+    assert discovery.groups() == ['b']
+    assert discovery.parked() == []
+    # back again, with a clean slate
+    clock.now += 60
+    assert discovery.groups() == ['a', 'b']
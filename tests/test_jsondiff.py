@@ -0,0 +1,322 @@
+import random
+import sys
+import threading
+from collections import Counter
+
+import pytest
+
+from jsondiff import JsonDiffer, CompactJsonDiffSyntax, _freeze, _DiffContext
+
+
+def random_doc(rnd, depth=0):
+    kind = rnd.randrange(7 if depth < 3 else 3)
+    if kind == 0:
+        return rnd.randrange(5)
+    elif kind == 1:
+        return rnd.choice(['x', 'y', '$z'])
+    elif kind == 2:
+        return rnd.choice([None, True, 1.5])
+    elif kind in (3, 4):
+        return dict((k, random_doc(rnd, depth + 1)) for k in rnd.sample('abcde', rnd.randrange(4)))
+    elif kind == 5:
+        return [random_doc(rnd, depth + 1) for _ in range(rnd.randrange(5))]
+    return set(rnd.sample(range(6), rnd.randrange(4)))
+
+
+def random_pairs(seed, count):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        a = random_doc(rnd)
+        b = random_doc(rnd) if rnd.random() < 0.3 else edit_doc(rnd, a)
+        yield a, b
+
+
+# a copy of x with a few random changes
+def edit_doc(rnd, x):
+    if rnd.random() < 0.2:
+        return random_doc(rnd)
+    if isinstance(x, dict):
+        y = dict((k, edit_doc(rnd, v)) for k, v in x.items() if rnd.random() < 0.9)
+        if rnd.random() < 0.3:
+            y[rnd.choice('abcdef')] = random_doc(rnd, 2)
+        return y
+    if isinstance(x, list):
+        y = [edit_doc(rnd, v) for v in x if rnd.random() < 0.9]
+        if rnd.random() < 0.3:
+            y.insert(rnd.randrange(len(y) + 1), random_doc(rnd, 2))
+        return y
+    if isinstance(x, set):
+        return set(v for v in x if rnd.random() < 0.8) | set(rnd.sample(range(8), 1))
+    return x
+
+
+@pytest.mark.parametrize('syntax', ['compact', 'symmetric'])
+@pytest.mark.parametrize('marshal', [False, True])
+def test_patch_round_trip(syntax, marshal):
+    differ = JsonDiffer(syntax=syntax, marshal=marshal)
+    for a, b in random_pairs(1, 500):
+        d = differ.diff(a, b)
+        assert differ.patch(a, d) == b
+        if syntax == 'symmetric':
+            assert differ.unpatch(b, d) == a
+
+
+# counts the payloads built
+class CountingSyntax(CompactJsonDiffSyntax):
+
+    def __init__(self):
+        self.emitted = 0
+
+    def emit_set_diff(self, *args):
+        self.emitted += 1
+        return CompactJsonDiffSyntax.emit_set_diff(self, *args)
+
+    def emit_list_diff(self, *args):
+        self.emitted += 1
+        return CompactJsonDiffSyntax.emit_list_diff(self, *args)
+
+    def emit_dict_diff(self, *args):
+        self.emitted += 1
+        return CompactJsonDiffSyntax.emit_dict_diff(self, *args)
+
+    def emit_value_diff(self, *args):
+        self.emitted += 1
+        return CompactJsonDiffSyntax.emit_value_diff(self, *args)
+
+
+def test_similarity_builds_no_payloads():
+    syntax = CountingSyntax()
+    differ = JsonDiffer(syntax=syntax)
+    for a, b in random_pairs(2, 300):
+        s = differ.similarity(a, b)
+        assert syntax.emitted == 0
+        # the same score diff() works out
+        assert s == differ._obj_diff(a, b, _DiffContext())[1]
+        syntax.emitted = 0
+
+
+# counts the container diffs worked out
+class CountingDiffer(JsonDiffer):
+
+    def __init__(self, **kwargs):
+        JsonDiffer.__init__(self, **kwargs)
+        self.dict_diffs = 0
+
+    def _dict_diff(self, a, b, ctx):
+        self.dict_diffs += 1
+        return JsonDiffer._dict_diff(self, a, b, ctx)
+
+
+def test_memo_diffs_each_pair_once():
+    # matching the outer lists scores every old record against every new
+    # one; building the payload for the matched lists then needs those
+    # scores again, and the payloads of the matched records
+    old = [[{'id': n, 'tags': ['t%d' % n, 'common']} for n in range(6)]]
+    new = [[{'id': n, 'tags': ['t%d' % n, 'changed']} for n in range(6)]]
+    differ = CountingDiffer()
+    d = differ.diff(old, new)
+    assert differ.patch(old, d) == new
+    assert differ.dict_diffs == 6 * 6 + 6
+    # the memo only lives for the one call
+    differ.diff(old, new)
+    assert differ.dict_diffs == 2 * (6 * 6 + 6)
+
+
+def test_memo_size_bounded():
+    class SmallMemo(JsonDiffer):
+        memo_size = 4
+    differ = SmallMemo()
+    for a, b in random_pairs(3, 200):
+        d = differ.diff(a, b)
+        assert differ.patch(a, d) == b
+        assert differ.similarity(a, b) == JsonDiffer().similarity(a, b)
+
+
+class LeafDiffer(JsonDiffer):
+    # the whole list in one similarity matrix
+    list_diff_leaf_size = 10 ** 9
+    list_diff_max_cells = 10 ** 12
+
+
+def test_long_list_backtrack():
+    # 6000 steps back through the matrix - well past the recursion limit
+    a = list(range(6000))
+    b = [-1, 2999, -2]
+    for syntax in ('compact', 'symmetric'):
+        differ = LeafDiffer(syntax=syntax)
+        d = differ.diff(a, b)
+        assert differ.patch(a, d) == b
+        if syntax == 'symmetric':
+            assert differ.unpatch(b, d) == a
+
+
+def test_long_list_changes():
+    a = [{'n': n, 'v': 'x'} for n in range(6000)]
+    b = list(a)
+    for n in (10, 2500, 5990):
+        b[n] = {'n': n, 'v': 'y'}
+    del b[4000]
+    b.insert(100, 'new')
+    for syntax in ('compact', 'symmetric'):
+        differ = JsonDiffer(syntax=syntax)
+        d = differ.diff(a, b)
+        assert differ.patch(a, d) == b
+        if syntax == 'symmetric':
+            assert differ.unpatch(b, d) == a
+
+
+# nested one level per step: [{'$key': (... [{'$key': ('$leaf', n)}] ...)}]
+def nested_doc(depth):
+    d = ('$leaf', depth)
+    for n in range(depth):
+        d = [{'$key': d}] if n % 2 else ({'$key': d},)
+    return d
+
+
+# the levels of a nested_doc, walked without recursion
+def nested_levels(d):
+    levels = []
+    while not (isinstance(d, tuple) and len(d) == 2 and not isinstance(d[0], dict)):
+        levels.append(type(d))
+        assert len(d) == 1 and len(d[0]) == 1
+        key = list(d[0].keys())[0]
+        levels.append(key)
+        d = d[0][key]
+    levels.append(d)
+    return levels
+
+
+def test_deep_marshal():
+    depth = 5000
+    d = nested_doc(depth)
+    differ = JsonDiffer()
+    marshaled = differ.marshal(d)
+    levels = nested_levels(marshaled)
+    assert levels[-1] == ('$$leaf', depth)
+    assert set(levels[1:-1:2]) == set(['$$key'])
+    # tuples and lists are kept as they were
+    assert levels[0:-1:2] == nested_levels(d)[0:-1:2]
+    assert nested_levels(differ.unmarshal(marshaled)) == nested_levels(d)
+
+
+# the pairing before the feature index: every pair scored, most similar
+# first
+class BruteForceDiffer(JsonDiffer):
+
+    def _best_pairs(self, xs, ys, ctx):
+        ranking = sorted(
+            ((self._obj_similarity(x, y, ctx), i, j) for i, x in enumerate(xs) for j, y in enumerate(ys)),
+            reverse=True,
+            key=lambda x: x[0])
+        pairs = []
+        xs_left = set(range(len(xs)))
+        ys_left = set(range(len(ys)))
+        for s, i, j in ranking:
+            if s <= 0 or not xs_left or not ys_left:
+                break
+            if i in xs_left and j in ys_left:
+                xs_left.discard(i)
+                ys_left.discard(j)
+                pairs.append((s, i, j))
+        return pairs
+
+
+def random_record(rnd):
+    record = dict((k, rnd.randrange(3)) for k in rnd.sample('abcd', rnd.randrange(4)))
+    if rnd.random() < 0.3:
+        record['tags'] = [rnd.choice('xyz') for _ in range(rnd.randrange(3))]
+    return record
+
+
+def random_tuple(rnd):
+    return tuple(rnd.choice([0, 1, 2, 'x', 'y', (1, 2), ('x',)]) for _ in range(rnd.randrange(4)))
+
+
+def test_best_pairs_match_brute_force():
+    rnd = random.Random(4)
+    for _ in range(300):
+        make = rnd.choice([random_record, random_tuple])
+        xs = [make(rnd) for _ in range(rnd.randrange(8))]
+        # the callers match up equal elements first
+        ys = [y for y in (make(rnd) for _ in range(rnd.randrange(8))) if y not in xs]
+        assert JsonDiffer()._best_pairs(xs, ys, _DiffContext()) == \
+            BruteForceDiffer()._best_pairs(xs, ys, _DiffContext())
+
+
+def test_set_diff_matches_brute_force():
+    rnd = random.Random(5)
+    for _ in range(300):
+        a = set(random_tuple(rnd) for _ in range(rnd.randrange(8)))
+        b = set(random_tuple(rnd) for _ in range(rnd.randrange(8)))
+        for syntax in ('compact', 'symmetric'):
+            d = JsonDiffer(syntax=syntax).diff(a, b)
+            assert d == BruteForceDiffer(syntax=syntax).diff(a, b)
+            assert JsonDiffer(syntax=syntax).patch(a, d) == b
+        assert JsonDiffer().similarity(a, b) == BruteForceDiffer().similarity(a, b)
+
+
+def test_best_pairs_capped():
+    class FewPairs(JsonDiffer):
+        set_diff_max_pairs = 5
+    rnd = random.Random(6)
+    for _ in range(100):
+        a = {'items': [random_record(rnd) for _ in range(10)]}
+        b = {'items': [random_record(rnd) for _ in range(10)]}
+        differ = FewPairs(unordered_keys=['items'])
+        pairs = differ._best_pairs(a['items'], b['items'], _DiffContext())
+        assert len(set(i for s, i, j in pairs)) == len(pairs)
+        assert len(set(j for s, i, j in pairs)) == len(pairs)
+        d = differ.diff(a, b)
+        assert Counter(map(_freeze, differ.patch(a, d)['items'])) == Counter(map(_freeze, b['items']))
+
+
+def test_unordered_keys():
+    a = {'tags': ['x', 'y', {'id': 1}, 'y'], 'order': [1, 2]}
+    differ = JsonDiffer(unordered_keys=['tags'])
+    # a pure reorder is no change
+    b = {'tags': ['y', {'id': 1}, 'y', 'x'], 'order': [1, 2]}
+    assert differ.diff(a, b) == {}
+    assert differ.similarity(a, b) == 1.0
+    # other keys still keep their order
+    b = {'tags': ['y', {'id': 1}, 'y', 'x'], 'order': [2, 1]}
+    assert list(differ.diff(a, b).keys()) == ['order']
+    # patching keeps the old order and appends new elements
+    b = {'tags': ['z', {'id': 2}, 'y', 'x'], 'order': [1, 2]}
+    for syntax in ('compact', 'symmetric'):
+        differ = JsonDiffer(syntax=syntax, unordered_keys=['tags'])
+        d = differ.diff(a, b)
+        assert differ.patch(a, d) == {'tags': ['x', 'y', {'id': 2}, 'z'], 'order': [1, 2]}
+        if syntax == 'symmetric':
+            assert differ.unpatch(differ.patch(a, d), d) == a
+
+
+
+def test_differ_shared_between_threads():
+    # lists of records long enough for the calls to interleave: matching
+    # them up scores the records, while diff() builds payloads
+    rnd = random.Random(8)
+    pairs = []
+    for _ in range(10):
+        a = [random_record(rnd) for _ in range(30)]
+        b = [edit_doc(rnd, record) for record in a]
+        rnd.shuffle(b)
+        pairs.append(({'items': a, 'ids': set(range(5))}, {'items': b, 'ids': set(range(3, 8))}))
+    expected = [(JsonDiffer(syntax='symmetric').diff(a, b), JsonDiffer().similarity(a, b)) for a, b in pairs]
+
+    differ = JsonDiffer(syntax='symmetric')
+    results = {}
+
+    def run(n):
+        results[n] = [(differ.diff(a, b), differ.similarity(a, b)) for a, b in pairs]
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+    # switch threads as often as possible
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(60)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert [results.get(n) for n in range(4)] == [expected] * 4
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from jsondiff import JsonDiffer, diff, patch, similarity
+
+
+class LeafDiffer(JsonDiffer):
+    # the whole list in one similarity matrix
+    list_diff_leaf_size = 10 ** 9
+    list_diff_max_cells = 10 ** 12
+
+
+class HirschbergDiffer(JsonDiffer):
+    # split down to tiny pieces, no anchors
+    list_diff_leaf_size = 4
+    list_diff_max_cells = 10 ** 12
+
+
+class AnchoredDiffer(JsonDiffer):
+    # anchor everything first
+    list_diff_leaf_size = 4
+    list_diff_max_cells = 10
+
+
+differs = [LeafDiffer, HirschbergDiffer, AnchoredDiffer, JsonDiffer]
+
+
+def random_element(rnd, depth=0):
+    kind = rnd.randrange(6 if depth < 2 else 3)
+    if kind == 0:
+        return rnd.randrange(6)
+    elif kind == 1:
+        return 'u%d' % rnd.randrange(20)
+    elif kind == 2:
+        return None
+    elif kind in (3, 4):
+        return {'a': random_element(rnd, depth + 1), 'b': rnd.randrange(3)}
+    return [random_element(rnd, depth + 1) for _ in range(rnd.randrange(4))]
+
+
+def random_pair(rnd):
+    a = [random_element(rnd) for _ in range(rnd.randrange(25))]
+    if rnd.random() < 0.5:
+        b = [random_element(rnd) for _ in range(rnd.randrange(25))]
+    else:
+        b = list(a)
+        for _ in range(rnd.randrange(6)):
+            op = rnd.randrange(3)
+            if op == 0 and b:
+                del b[rnd.randrange(len(b))]
+            elif op == 1:
+                b.insert(rnd.randrange(len(b) + 1), random_element(rnd))
+            elif b:
+                b[rnd.randrange(len(b))] = random_element(rnd)
+    return a, b
+
+
+def test_anchor_across_similar_elements():
+    X = ['marker'] + [{'id': i, 'state': 'ok', 'n': i} for i in range(300)]
+    Y = [{'id': i, 'state': 'failed', 'n': i} for i in range(300)] + ['marker']
+    expected = LeafDiffer().similarity(X, Y)
+    assert expected == pytest.approx(0.828, abs=1e-3)
+    for cls in (HirschbergDiffer, AnchoredDiffer, JsonDiffer):
+        assert cls().similarity(X, Y) == pytest.approx(expected)
+    d = AnchoredDiffer().diff(X, Y)
+    assert AnchoredDiffer().patch(X, d) == Y
+
+
+@pytest.mark.parametrize('cls', [HirschbergDiffer, AnchoredDiffer])
+def test_paths_score_like_the_matrix(cls):
+    rnd = random.Random(21)
+    for _ in range(400):
+        a, b = random_pair(rnd)
+        assert cls().similarity(a, b) == pytest.approx(LeafDiffer().similarity(a, b), abs=1e-9), (a, b)
+
+
+@pytest.mark.parametrize('cls', differs)
+@pytest.mark.parametrize('syntax', ['compact', 'symmetric', 'explicit'])
+def test_paths_patch_back(cls, syntax):
+    rnd = random.Random(hash(syntax) % 1000)
+    differ = cls(syntax=syntax)
+    for _ in range(200):
+        a, b = random_pair(rnd)
+        d = differ.diff(a, b)
+        if syntax != 'explicit':
+            assert differ.patch(a, d) == b, (a, b, d)
+        if syntax == 'symmetric':
+            assert differ.unpatch(b, d) == a, (a, b, d)
+
+
+def test_small_lists_use_the_matrix():
+    a = ['x', {'k': 1, 'v': 2}, 'y']
+    b = [{'k': 1, 'v': 3}, 'y', 'z']
+    assert diff(a, b) == LeafDiffer().diff(a, b)
+
+
+def test_long_lists_with_scattered_changes():
+    rnd = random.Random(3)
+    a = [{'id': i, 'v': 'x%d' % i, 'tags': [i, i + 1]} for i in range(5000)]
+    b = [dict(x) for x in a]
+    picked = rnd.sample(range(5000), 30)
+    for i in picked[:20]:
+        b[i]['v'] = 'changed'
+    for i in sorted(picked[20:], reverse=True):
+        del b[i]
+    b.insert(2500, 'new')
+    d = diff(a, b)
+    assert patch(a, d) == b
+    # 10 deleted, 1 inserted, 20 with one of their six values changed
+    assert similarity(a, b) == pytest.approx((4970 + 20 * 5 / 6.0) / 5001)
@@ -0,0 +1,184 @@
+import io
+import json
+import math
+import random
+from json.decoder import scanstring
+
+import pytest
+
+from jsondiff import diff_iter
+from jsondiff.stream import JsonTokenizer, value_events, diff_events
+from jsondiff.symbols import insert, delete, replace, missing
+
+
+def random_value(rnd, depth=0):
+    kind = rnd.randrange(8 if depth < 4 else 5)
+    if kind == 0:
+        return rnd.randrange(-10**12, 10**12)
+    elif kind == 1:
+        return rnd.uniform(-1e6, 1e6) * 10 ** rnd.randrange(-30, 30)
+    elif kind == 2:
+        return rnd.choice([12345678901.25, 1.5e-7, -0.0, 2e+20, 1e100, 7.0])
+    elif kind == 3:
+        return ''.join(rnd.choice(u'ab"\\\né中\U0001f600 ') for _ in range(rnd.randrange(6)))
+    elif kind == 4:
+        return rnd.choice([True, False, None])
+    elif kind in (5, 6):
+        return dict(('k%d' % i, random_value(rnd, depth + 1)) for i in range(rnd.randrange(5)))
+    return [random_value(rnd, depth + 1) for _ in range(rnd.randrange(5))]
+
+
+def typed(events):
+    # events with the type of each scalar, since 1 == 1.0 == True
+    return [(kind, type(value), value) for kind, value in events]
+
+
+def tokenize(text, chunk_size, binary):
+    if binary:
+        src = io.BytesIO(text.encode('utf-8'))
+    else:
+        src = io.StringIO(text)
+    return list(JsonTokenizer(src, chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3])
+@pytest.mark.parametrize('binary', [False, True])
+def test_tokenizer_matches_json_loads(chunk_size, binary):
+    rnd = random.Random(chunk_size)
+    for n in range(300):
+        value = random_value(rnd)
+        text = json.dumps(value, ensure_ascii=n % 2 == 0,
+                          indent=rnd.choice([None, 1]),
+                          separators=rnd.choice([None, (',', ':')]))
+        expected = typed(value_events(json.loads(text)))
+        assert typed(tokenize(text, chunk_size, binary)) == expected, text
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3])
+def test_tokenizer_numbers_across_chunks(chunk_size):
+    for text in ['12345678901.25', '[1.5,2e+10,-3E-2,0.0,-0]', '{"a":1.25e7}',
+                 '[123, 4.5 , 6e1]', '-Infinity', '[NaN,Infinity]']:
+        # every split point of the text in turn
+        for lead in range(chunk_size):
+            src = io.StringIO(text)
+            tokenizer = JsonTokenizer(src, chunk_size=chunk_size)
+            tokenizer._buf = src.read(lead)
+            events = list(tokenizer)
+            expected = list(value_events(json.loads(text)))
+            assert repr(events) == repr(expected), (text, lead)
+
+
+@pytest.mark.parametrize('text', ['[1.]', '[1e]', '[-]', '01', '[1,]', '{"a" 1}', '[1 2]', '"abc'])
+def test_tokenizer_rejects_invalid(text):
+    for chunk_size in (1, 2, 3, 65536):
+        with pytest.raises(ValueError):
+            list(JsonTokenizer(io.StringIO(text), chunk_size=chunk_size))
+
+
+def ops(a, b):
+    return sorted(((op[0].label, op[1], repr(op[2]), repr(op[3])) for op in diff_events(value_events(a), value_events(b))))
+
+
+def test_diff_keys_in_different_order():
+    a = {'x': 1, 'y': {'p': [1, 2], 'q': 'v'}, 'z': [3]}
+    b = {'z': [3], 'y': {'q': 'w', 'p': [1, 2]}, 'x': 1}
+    assert ops(a, b) == [('replace', ('y', 'q'), "'v'", "'w'")]
+
+
+def test_diff_reordered_keys_with_changes_on_both_sides():
+    a = {'a': 1, 'b': {'deep': list(range(10))}, 'c': 3, 'gone': 0}
+    b = {'new': 5, 'c': 4, 'b': {'deep': list(range(9))}, 'a': 1}
+    assert ops(a, b) == sorted([
+        ('replace', ('c',), '3', '4'),
+        ('delete', ('b', 'deep', 9), '9', repr(missing)),
+        ('delete', ('gone',), '0', repr(missing)),
+        ('insert', ('new',), repr(missing), '5'),
+    ])
+
+
+def test_diff_reordered_keys_from_text():
+    a = json.dumps({'k%d' % i: {'v': i} for i in range(50)})
+    b = json.dumps(dict(reversed([('k%d' % i, {'v': i if i != 7 else -7}) for i in range(50)])))
+    result = list(diff_iter(a, b, load=True))
+    assert [(op[0], op[1], op[2], op[3]) for op in result] == [(replace, ('k7', 'v'), 7, -7)]
+
+
+def test_diff_reordered_keys_matches_applying_ops():
+    rnd = random.Random(5)
+    for _ in range(200):
+        a = dict(('k%d' % i, random_value(rnd, 2)) for i in range(8))
+        b = dict(a)
+        for k in rnd.sample(sorted(b), 3):
+            b[k] = random_value(rnd, 2)
+        del b[rnd.choice(sorted(b))]
+        b['extra'] = 1
+        items = list(b.items())
+        rnd.shuffle(items)
+        b = dict(items)
+        seen = set()
+        for op, path, va, vb in diff_events(value_events(a), value_events(b)):
+            assert (op, path) not in seen
+            seen.add((op, path))
+            if op is insert:
+                assert va is missing and vb is not missing
+            elif op is delete:
+                assert vb is missing and va is not missing
+        assert (insert, ('extra',)) in seen
+        changed = set(path[0] for op, path in seen)
+        assert changed == set(k for k in set(a) | set(b) if a.get(k, missing) != b.get(k, missing))
+
+
+def test_diff_nan_is_unchanged():
+    assert list(diff_iter({'a': float('nan')}, {'a': float('nan')})) == []
+    assert list(diff_iter('[NaN, 1]', '[NaN, 1]', load=True)) == []
+    result = list(diff_iter('[NaN]', '[1.5]', load=True))
+    assert len(result) == 1 and result[0][0] is replace and math.isnan(result[0][2])
+
+
+# text nested depth levels deep, alternating objects and arrays, around leaf
+def nested_text(depth, leaf):
+    opening = ''.join('{"k":' if n % 2 else '[0,' for n in range(depth))
+    closing = ''.join('}' if n % 2 else ']' for n in reversed(range(depth)))
+    return opening + leaf + closing
+
+
+def test_diff_deeply_nested():
+    depth = 5000
+    a = nested_text(depth, '{"x":1,"y":2}')
+    b = nested_text(depth, '{"y":3,"x":1,"z":[4]}')
+    result = list(diff_events(JsonTokenizer(io.StringIO(a), chunk_size=100),
+                              JsonTokenizer(io.StringIO(b), chunk_size=100)))
+    path = tuple('k' if n % 2 else 1 for n in range(depth))
+    assert sorted((op.label, p[-1], va, vb) for op, p, va, vb in result) == \
+        sorted([('replace', 'y', 2, 3), ('insert', 'z', missing, [4])])
+    assert all(p[:-1] == path for op, p, va, vb in result)
+
+
+def test_diff_deeply_nested_reordered_keys():
+    # the nested values set aside while the keys are realigned
+    depth = 3000
+    a = '{"p":%s,"q":%s}' % (nested_text(depth, '1'), nested_text(depth, '2'))
+    b = '{"q":%s,"p":%s}' % (nested_text(depth, '2'), nested_text(depth, '5'))
+    result = list(diff_iter(a, b, load=True))
+    assert [(op[0], op[1][0], op[1][-1], op[2], op[3]) for op in result] == [(replace, 'p', 'k', 1, 5)]
+
+
+def test_tokenizer_long_string_scanned_once(monkeypatch):
+    import jsondiff.stream
+    calls = []
+    def counting_scanstring(s, end):
+        calls.append(end)
+        return scanstring(s, end)
+    monkeypatch.setattr(jsondiff.stream, 'scanstring', counting_scanstring)
+    value = 'ab\\"c' * 50000
+    events = list(JsonTokenizer(io.StringIO(json.dumps([value])), chunk_size=1000))
+    assert events == [('start_array', None), ('value', value), ('end_array', None)]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4])
+def test_tokenizer_escaped_quotes_across_chunks(chunk_size):
+    for value in ['\\', '\\\\', '"', '\\"', 'a\\\\"b', '\\' * 7 + '"']:
+        text = json.dumps([value, value])
+        assert list(JsonTokenizer(io.StringIO(text), chunk_size=chunk_size)) == \
+            list(value_events([value, value])), text
@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+from multiprocessing import TimeoutError
+
+import kafka_jmx
+import kafka_wire
+from kgd_rows import kgd_result
+
+
+def blocked_client(cls, release):
+    if (cls is kafka_jmx.consumer_group_command):
+        client = cls(server='localhost', port=9092, max_procs=2)
+    else:
+        client = cls(server='localhost', port=9092, max_workers=2)
+    started = []
+
+    def describe(group):
+        started.append(group)
+        if (group.startswith('slow')):
+            release.wait(10)
+        return kgd_result(group, 0, ())
+    client.describe = describe
+    return client, started
+
+
+@pytest.mark.parametrize('cls', [kafka_jmx.consumer_group_command, kafka_wire.consumer_group_client])
+def test_describe_iter_skips_groups_in_flight(cls):
+    release = threading.Event()
+    client, started = blocked_client(cls, release)
+    try:
+        first = client.describe_iter(['slow', 'fast'])
+        assert first.next(5)[0] == 'fast'
+        with pytest.raises(TimeoutError):
+            first.next(0.1)
+
+        # 'slow' is still running - only 'fast' is queued again
+        second = client.describe_iter(['slow', 'fast'])
+        assert [group for group, g_desc in second] == ['fast']
+        assert started.count('slow') == 1
+
+        release.set()
+        assert first.next(5)[0] == 'slow'
+        third = client.describe_iter(['slow', 'fast'])
+        assert sorted(group for group, g_desc in third) == ['fast', 'slow']
+    finally:
+        release.set()
+        client.close()
+
+
+describe_output = (
+    "\n"
+    "GROUP      TOPIC   PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG  CONSUMER-ID  HOST       CLIENT-ID\n"
+    "orders-app orders  0          1500            1750            250  consumer-1   /10.1.2.3  consumer-1\n"
+    "orders-app orders  1          -               900             -    consumer-1   /10.1.2.3  consumer-1\n")
+
+
+def doc_parser(raw_txt):
+    fields = ['group', 'topic', 'partition', 'current_offset', 'log_end_offset', 'lag', 'consumer_id', 'host', 'client_id']
+    return [dict(zip(fields, line.split())) for line in raw_txt.split("\n")[2:] if line]
+
+
+# the default parser, kgd_parser and a parser returning documents all give
+# kgd_rows
+@pytest.mark.parametrize('parser', [None, kafka_jmx.kgd_parser, doc_parser])
+def test_describe_parsers_return_rows(parser):
+    client = kafka_jmx.consumer_group_command(server='localhost', port=9092, parser=parser)
+    client._popen_exec = lambda cmd_args: (0, describe_output, '')
+    try:
+        result = client.describe('orders-app')
+    finally:
+        client.close()
+    assert [row.to_doc() for row in result.rows] == [
+        {'group': 'orders-app', 'topic': 'orders', 'partition': 0, 'current_offset': 1500,
+         'log_end_offset': 1750, 'lag': 250, 'consumer_id': 'consumer-1', 'host': '/10.1.2.3',
+         'client_id': 'consumer-1', 'timestamp': result.timestamp},
+        {'group': 'orders-app', 'topic': 'orders', 'partition': 1, 'log_end_offset': 900,
+         'consumer_id': 'consumer-1', 'host': '/10.1.2.3', 'client_id': 'consumer-1',
+         'timestamp': result.timestamp},
+    ]
+
+
+# kafka 2.4+ --describe --all-groups: a header block per group, with status
+# messages between them; 'ghost' is gone and 'idle' has no partitions
+batch_describe_output = (
+    "\n"
+    "GROUP           TOPIC           PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG             CONSUMER-ID     HOST            CLIENT-ID\n"
+    "orders-app      orders          0          1500            1750            250             consumer-1      /10.1.2.3       consumer-1\n"
+    "orders-app      orders          1          -               900             -               consumer-1      /10.1.2.3       consumer-1\n"
+    "\n"
+    "Consumer group 'billing' has no active members.\n"
+    "\n"
+    "GROUP           TOPIC           PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG             CONSUMER-ID     HOST            CLIENT-ID\n"
+    "billing         invoices        0          42              50              8               -               -               -\n"
+    "\n"
+    "Error: Consumer group 'ghost' does not exist.\n"
+    "\n"
+    "GROUP           TOPIC           PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG             CONSUMER-ID     HOST            CLIENT-ID\n"
+    "\n"
+    "Consumer group 'idle' has no active members.\n"
+    "\n"
+    "GROUP           TOPIC           PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG             CONSUMER-ID     HOST            CLIENT-ID\n"
+    "payments-app    payments        0          7               7               0               consumer-2      /10.1.2.4       consumer-2\n"
+    "orders-app      orders          2          10              12              2               consumer-3      /10.1.2.5       consumer-3\n")
+
+
+@pytest.mark.parametrize('groups, group_args', [
+    (None, ['--all-groups']),
+    (['orders-app', 'billing', 'ghost', 'idle', 'payments-app'],
+        ['--group', 'orders-app', '--group', 'billing', '--group', 'ghost', '--group', 'idle', '--group', 'payments-app']),
+])
+def test_describe_groups(groups, group_args):
+    client = kafka_jmx.consumer_group_command(server='localhost', port=9092)
+    commands = []
+
+    def popen_exec(cmd_args):
+        commands.append(cmd_args)
+        return (0, batch_describe_output, '')
+    client._popen_exec = popen_exec
+    try:
+        results = client.describe_groups(groups)
+    finally:
+        client.close()
+    assert commands[0][-len(group_args) - 1:] == ['--describe'] + group_args
+
+    # groups with no rows are left out
+    assert sorted(results.keys()) == ['billing', 'orders-app', 'payments-app']
+    rows = dict((group, [(row.group, row.topic, row.partition, row.lag, row.consumer_id) for row in result.rows])
+        for group, result in results.items())
+    assert rows == {
+        'orders-app': [
+            ('orders-app', 'orders', 0, 250, 'consumer-1'),
+            ('orders-app', 'orders', 1, None, 'consumer-1'),
+            ('orders-app', 'orders', 2, 2, 'consumer-3')],
+        'billing': [('billing', 'invoices', 0, 8, None)],
+        'payments-app': [('payments-app', 'payments', 0, 0, 'consumer-2')],
+    }
+    timestamps = set(row.timestamp for result in results.values() for row in result.rows)
+    assert timestamps == set(result.timestamp for result in results.values())
+    assert len(timestamps) == 1
+    assert all(result.group == group for group, result in results.items())
+
+
+def test_describe_groups_failed():
+    client = kafka_jmx.consumer_group_command(server='localhost', port=9092)
+    client._popen_exec = lambda cmd_args: (1, '', 'broker not available')
+    try:
+        assert client.describe_groups() is None
+    finally:
+        client.close()
@@ -0,0 +1,105 @@
+import os
+import stat
+import threading
+import time
+
+import kafka_jmx
+
+
+# stands in for the java launcher: sleeps for the seconds given as the last
+# argument (in a child process, like a wrapper script starting the JVM),
+# logging when it starts and ends
+sleeper_script = """#!/bin/sh
+for last; do :; done
+echo "start $$ $(date +%%s.%%N)" >> %(log)s
+sleep "$last" &
+echo $! > %(pids)s/$$
+wait
+echo "end $$ $(date +%%s.%%N)" >> %(log)s
+echo slept
+"""
+
+
+def sleeper_command(tmp_path, **kwargs):
+    log_file = str(tmp_path / 'runs.log')
+    pid_dir = tmp_path / 'pids'
+    pid_dir.mkdir()
+    script = tmp_path / 'java'
+    script.write_text(sleeper_script % {'log': log_file, 'pids': str(pid_dir)})
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    cmd = kafka_jmx.kafka_command(**kwargs)
+    cmd.jexec = str(script)
+    return cmd, log_file, pid_dir
+
+
+def runs(log_file):
+    starts = {}
+    spans = []
+    with open(log_file) as f:
+        for line in f:
+            event, pid, ts = line.split()
+            if (event == 'start'):
+                starts[pid] = float(ts)
+            else:
+                spans.append((starts.pop(pid), float(ts)))
+    return spans, starts
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # reaped by init or left a zombie - either way not running
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().split()[2] != 'Z'
+    except IOError:
+        return False
+
+
+def test_exec_output(tmp_path):
+    cmd, log_file, pid_dir = sleeper_command(tmp_path)
+    rc, output, stderr = cmd._popen_exec(['kafka.admin.ConsumerGroupCommand', '0'])
+    assert (rc, output.strip(), stderr) == (0, b'slept', b'')
+
+
+def test_timeout_kills_the_process_group(tmp_path):
+    cmd, log_file, pid_dir = sleeper_command(tmp_path, exec_timeout=1)
+    st = time.time()
+    assert cmd._popen_exec(['kafka.admin.ConsumerGroupCommand', '30']) == (None, None, None)
+    assert 1 <= time.time() - st < 10
+
+    # the wrapper never finished, and the sleep it started went with it
+    spans, running = runs(log_file)
+    assert spans == [] and len(running) == 1
+    sleep_pid = int((pid_dir / os.listdir(str(pid_dir))[0]).read_text())
+    for _ in range(50):
+        if not pid_alive(sleep_pid):
+            break
+        time.sleep(0.1)
+    assert not pid_alive(sleep_pid)
+
+
+def test_children_limited_to_max_procs(tmp_path):
+    cmd, log_file, pid_dir = sleeper_command(tmp_path, max_procs=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cmd._popen_exec(['cmd', '0.5'])))
+        for _ in range(5)]
+    st = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert [rc for rc, output, stderr in results] == [0] * 5
+    # three rounds of at most two
+    assert time.time() - st >= 1.5
+
+    spans, running = runs(log_file)
+    assert len(spans) == 5 and not running
+    events = sorted([(start, 1) for start, end in spans] + [(end, -1) for start, end in spans])
+    most = n = 0
+    for ts, step in events:
+        n += step
+        most = max(most, n)
+    assert most == 2
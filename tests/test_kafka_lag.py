@@ -0,0 +1,26 @@
+import kafka_lag
+from kgd_rows import kgd_result, kgd_row
+
+
+def sample(timestamp, offsets):
+    rows = [kgd_row(group='g', topic='t', partition=p, current_offset=c, log_end_offset=e,
+        lag=e - c, timestamp=timestamp) for p, (c, e) in enumerate(offsets)]
+    return kgd_result('g', timestamp, tuple(rows))
+
+
+def test_rates_are_returned_and_rows_left_alone():
+    tracker = kafka_lag.lag_tracker(max_age=600)
+    first = sample(1000, [(100, 150), (200, 200)])
+    row_rates, rollups = tracker.update(first.rows)
+    assert row_rates == [{}, {}]
+    assert rollups == [{'group': 'g', 'topic': 't', 'timestamp': 1000, 'partitions': 2, 'lag': 50}]
+
+    second = sample(11000, [(200, 300), (190, 210)])
+    docs = [row.to_doc() for row in second.rows]
+    row_rates, rollups = tracker.update(second.rows)
+    # partition 1's committed offset went backwards - no rates this cycle
+    assert row_rates == [{'consume_rate': 10.0, 'produce_rate': 15.0, 'lag_rate': 5.0}, {}]
+    assert tracker.resets == 1
+    assert rollups == [{'group': 'g', 'topic': 't', 'timestamp': 11000, 'partitions': 2, 'lag': 120,
+        'consume_rate': 10.0, 'produce_rate': 15.0, 'lag_rate': 5.0}]
+    assert [row.to_doc() for row in second.rows] == docs
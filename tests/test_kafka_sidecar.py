@@ -0,0 +1,125 @@
+import os
+import stat
+import sys
+
+import kafka_jmx
+
+
+# stands in for the java launcher. Launched as the sidecar (the last argument
+# is KafkaToolSidecar) it answers each command line with the framing
+# KafkaToolSidecar.java uses - "rc outlen errlen\n", stdout, stderr - and
+# dies half way through the reply to a 'die' command (a 'fail' command
+# exits 3); launched for a single
+# command it prints the command
+fake_java = """#!%(python)s
+import sys, time
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+if not sys.argv[-1].startswith('KafkaToolSidecar') and not sys.argv[-1].endswith('.java'):
+    out.write(('exec ' + ' '.join(sys.argv[-2:]) + '\\n').encode('utf-8'))
+    sys.exit(0)
+with open(%(starts)r, 'a') as f:
+    f.write('start\\n')
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    cmd_args = line.rstrip('\\n').split('\\t')
+    if (cmd_args[-1] == 'die'):
+        out.write(b'0 100 0\\nhalf a rep')
+        out.flush()
+        sys.exit(1)
+    if (cmd_args[-1] == 'hang'):
+        time.sleep(60)
+    output = ('sidecar ' + ' '.join(cmd_args) + '\\n').encode('utf-8')
+    stderr = b'warn\\n' if cmd_args[-1] == 'warn' else b''
+    out.write(('%%d %%d %%d\\n' %% (3 if cmd_args[-1] == 'fail' else 0, len(output), len(stderr))).encode('utf-8'))
+    out.write(output + stderr)
+    out.flush()
+"""
+
+
+def write_fake_java(tmp_path):
+    starts_file = str(tmp_path / 'starts')
+    script = tmp_path / 'java'
+    script.write_text(fake_java % {'python': sys.executable, 'starts': starts_file})
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script), starts_file
+
+
+def started(starts_file):
+    if not os.path.exists(starts_file):
+        return 0
+    with open(starts_file) as f:
+        return len(f.readlines())
+
+
+def fake_sidecar(tmp_path):
+    jexec, starts_file = write_fake_java(tmp_path)
+    source = str(tmp_path / 'KafkaToolSidecar.java')
+    return kafka_jmx.kafka_sidecar(jexec, ['-Xmx64m'], ['a.jar', 'b.jar'], source=source), starts_file
+
+
+def test_framed_replies(tmp_path):
+    sc, starts_file = fake_sidecar(tmp_path)
+    try:
+        assert sc.run(['kafka.admin.ConsumerGroupCommand', '--list']) == \
+            (0, b'sidecar kafka.admin.ConsumerGroupCommand --list\n', b'')
+        assert sc.run(['kafka.admin.TopicCommand', 'warn']) == \
+            (0, b'sidecar kafka.admin.TopicCommand warn\n', b'warn\n')
+        assert sc.run(['kafka.admin.TopicCommand', 'fail'])[0] == 3
+        # one helper answers every command
+        assert sc.starts == 1 and started(starts_file) == 1
+    finally:
+        sc.close()
+
+
+def test_restart_after_dying_mid_reply(tmp_path):
+    sc, starts_file = fake_sidecar(tmp_path)
+    try:
+        assert sc.run(['cmd', 'one'])[0] == 0
+        try:
+            sc.run(['cmd', 'die'])
+            assert False, "no sidecar_error"
+        except kafka_jmx.sidecar_error:
+            pass
+        # started again for the next command
+        assert sc.run(['cmd', 'two']) == (0, b'sidecar cmd two\n', b'')
+        assert sc.starts == 2 and started(starts_file) == 2
+    finally:
+        sc.close()
+
+
+def test_timeout_kills_the_sidecar(tmp_path):
+    sc, starts_file = fake_sidecar(tmp_path)
+    try:
+        assert sc.run(['cmd', 'hang'], timeout=1) == (None, None, None)
+        assert sc.run(['cmd', 'three'])[1] == b'sidecar cmd three\n'
+        assert sc.starts == 2
+    finally:
+        sc.close()
+
+
+def test_failed_start(tmp_path):
+    sc = kafka_jmx.kafka_sidecar(str(tmp_path / 'no-java'), [], [])
+    try:
+        sc.run(['cmd'])
+        assert False, "no sidecar_error"
+    except kafka_jmx.sidecar_error:
+        pass
+
+
+def test_command_falls_back_to_exec(tmp_path):
+    cmd = kafka_jmx.kafka_command(sidecar=True, max_procs=1)
+    cmd.jexec, starts_file = write_fake_java(tmp_path)
+    try:
+        assert cmd.kfk_exec('kafka.admin.ConsumerGroupCommand', 'ok') == \
+            b'sidecar kafka.admin.ConsumerGroupCommand ok\n'
+        # the helper died - the command is run in a JVM of its own, and the
+        # slot it held is given back first
+        assert cmd.kfk_exec('kafka.admin.ConsumerGroupCommand', 'die') == \
+            b'exec kafka.admin.ConsumerGroupCommand die\n'
+        assert cmd.kfk_exec('kafka.admin.ConsumerGroupCommand', 'again') == \
+            b'sidecar kafka.admin.ConsumerGroupCommand again\n'
+        assert started(starts_file) == 2
+    finally:
+        cmd.close()
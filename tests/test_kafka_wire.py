@@ -0,0 +1,283 @@
+import binascii
+import socket
+import struct
+import threading
+
+import pytest
+
+import kafka_wire
+
+
+# Response bodies (after the correlation id) as a broker returns them, for a
+# two broker cluster (broker-1:9092, broker-2:9092) with topics 'orders' (2
+# partitions) and 'payments', and a consumer group 'orders-app' with two
+# members:
+#
+#   metadata_all             Metadata v0, every topic ('staging' has
+#                            LEADER_NOT_AVAILABLE)
+#   metadata_topics          Metadata v0 for orders and payments
+#   list_groups_1/_2         ListGroups v0 from broker-1 and broker-2
+#   find_coordinator         FindCoordinator v0 - broker-2
+#   find_coordinator_loading FindCoordinator v0 - COORDINATOR_NOT_AVAILABLE
+#   describe_groups          DescribeGroups v0 - consumer-1 has orders 0-1,
+#                            consumer-2 has payments 0
+#   offset_fetch             OffsetFetch v2 - orders 0 at 1500, orders 1
+#                            with no commit, payments 0 at 42
+#   list_offsets_1/_2        ListOffsets v1 from broker-1 (orders 0: 1750)
+#                            and broker-2 (orders 1: 900, payments 0: 42)
+captured = {
+    'metadata_all': (
+        '0000000200000001000862726f6b65722d310000238400000002000862726f6b'
+        '65722d320000238400000003000000066f726465727300000002000000000000'
+        '0000000100000002000000010000000200000002000000010000000200000000'
+        '0001000000020000000200000002000000010000000100000002000000087061'
+        '796d656e74730000000100000000000000000002000000020000000200000001'
+        '0000000200000002000000010005000773746167696e6700000000'
+    ),
+    'metadata_topics': (
+        '0000000200000001000862726f6b65722d310000238400000002000862726f6b'
+        '65722d320000238400000002000000066f726465727300000002000000000000'
+        '0000000100000002000000010000000200000002000000010000000200000000'
+        '0001000000020000000200000002000000010000000100000002000000087061'
+        '796d656e74730000000100000000000000000002000000020000000200000001'
+        '000000020000000200000001'
+    ),
+    'list_groups_1': (
+        '000000000002000762696c6c696e670008636f6e73756d6572000a6f72646572'
+        '732d6170700008636f6e73756d6572'
+    ),
+    'list_groups_2': (
+        '000000000002000c636f6e6e6563742d73696e6b0007636f6e6e656374000a6f'
+        '72646572732d6170700008636f6e73756d6572'
+    ),
+    'find_coordinator': (
+        '000000000002000862726f6b65722d3200002384'
+    ),
+    'find_coordinator_loading': (
+        '000fffffffff0000ffffffff'
+    ),
+    'describe_groups': (
+        '000000010000000a6f72646572732d6170700006537461626c650008636f6e73'
+        '756d6572000572616e676500000002000f636f6e73756d65722d312d33663261'
+        '000a636f6e73756d65722d3100092f31302e312e322e330000001c0000000000'
+        '0200066f726465727300087061796d656e7473ffffffff0000001e0000000000'
+        '0100066f7264657273000000020000000000000001ffffffff000f636f6e7375'
+        '6d65722d322d39633164000a636f6e73756d65722d3200092f31302e312e322e'
+        '340000001c00000000000200066f726465727300087061796d656e7473ffffff'
+        'ff0000001c00000000000100087061796d656e74730000000100000000ffffff'
+        'ff'
+    ),
+    'offset_fetch': (
+        '0000000200066f7264657273000000020000000000000000000005dc00000000'
+        '00000001ffffffffffffffff0000000000087061796d656e7473000000010000'
+        '0000000000000000002a000000000000'
+    ),
+    'list_offsets_1': (
+        '0000000100066f726465727300000001000000000000ffffffffffffffff0000'
+        '0000000006d6'
+    ),
+    'list_offsets_2': (
+        '0000000200066f726465727300000001000000010000ffffffffffffffff0000'
+        '00000000038400087061796d656e747300000001000000000000ffffffffffff'
+        'ffff000000000000002a'
+    ),
+}
+
+captured_brokers = ['broker-1', 'broker-2']
+
+
+def string(v):
+    v = v.encode('utf-8')
+    return struct.pack('>h', len(v)) + v
+
+
+# Replays captured responses in order. Each request has to be the next
+# (api, version) in the script; the broker addresses in the responses are
+# rewritten to the stand-in's own, so the client follows them back to it.
+class replay_broker(object):
+
+    def _recv_exact(self, conn, n_bytes):
+        data = b''
+        while len(data) < n_bytes:
+            chunk = conn.recv(n_bytes - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _response(self, name):
+        body = binascii.unhexlify(''.join(captured[name]))
+        for host in captured_brokers:
+            body = body.replace(string(host) + struct.pack('>i', 9092),
+                string('127.0.0.1') + struct.pack('>i', self.port))
+        return body
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                size = self._recv_exact(conn, 4)
+                if size is None:
+                    return
+                request = self._recv_exact(conn, struct.unpack('>i', size)[0])
+                api_key, api_version, correlation_id, client_len = struct.unpack_from('>hhih', request)
+                with self._lock:
+                    if not self._script:
+                        self.errors.append("unexpected request %d v%d" % (api_key, api_version))
+                        return
+                    api, name = self._script.pop(0)
+                    if (kafka_wire.kafka_api[api] != (api_key, api_version)):
+                        self.errors.append("expected %s, got %d v%d" % (api, api_key, api_version))
+                        return
+                    self.requests.append((api, request[10 + client_len:]))
+                body = struct.pack('>i', correlation_id) + self._response(name)
+                conn.sendall(struct.pack('>i', len(body)) + body)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, addr = self._sock.accept()
+            except socket.error:
+                return
+            handler = threading.Thread(target=self._handle, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+    def close(self):
+        self._sock.close()
+
+    def __init__(self, script):
+        self._script = list(script)
+        self._lock = threading.Lock()
+        self.requests = []
+        self.errors = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(5)
+        self.port = self._sock.getsockname()[1]
+        server = threading.Thread(target=self._serve)
+        server.daemon = True
+        server.start()
+
+
+# starts a stand-in broker for a script of (api, captured response) pairs;
+# every scripted response has to be asked for
+@pytest.fixture
+def broker():
+    brokers = []
+
+    def start(*script):
+        b = replay_broker(script)
+        brokers.append(b)
+        return b
+    yield start
+    for b in brokers:
+        b.close()
+        assert b.errors == []
+        assert b._script == []
+
+
+def admin_client(b):
+    return kafka_wire.kafka_admin_client('127.0.0.1', b.port, timeout=5)
+
+
+def test_metadata(broker):
+    b = broker(('metadata', 'metadata_all'))
+    brokers, topics = admin_client(b).metadata()
+    assert brokers == {1: ('127.0.0.1', b.port), 2: ('127.0.0.1', b.port)}
+    # 'staging' came back with an error
+    assert topics == {'orders': {0: 1, 1: 2}, 'payments': {0: 2}}
+    # an empty topic array asks for every topic
+    assert b.requests == [('metadata', struct.pack('>i', 0))]
+
+
+def test_list_groups(broker):
+    b = broker(
+        ('metadata', 'metadata_all'),
+        ('list_groups', 'list_groups_1'),
+        ('list_groups', 'list_groups_2'))
+    assert admin_client(b).list_groups() == ['billing', 'connect-sink', 'orders-app']
+
+
+def test_find_coordinator(broker):
+    b = broker(
+        ('find_coordinator', 'find_coordinator'),
+        ('find_coordinator', 'find_coordinator_loading'))
+    admin = admin_client(b)
+    assert admin.find_coordinator('orders-app') == ('127.0.0.1', b.port)
+    with pytest.raises(kafka_wire.kafka_wire_error) as e:
+        admin.find_coordinator('orders-app')
+    assert e.value.error_code == 15
+    assert b.requests[0] == ('find_coordinator', string('orders-app'))
+
+
+def test_describe_group(broker):
+    b = broker(('describe_groups', 'describe_groups'))
+    g_desc = admin_client(b).describe_group('orders-app', coordinator=('127.0.0.1', b.port))
+    assert g_desc['state'] == 'Stable'
+    assert g_desc['protocol_type'] == 'consumer'
+    assert g_desc['members'] == [
+        {'member_id': 'consumer-1-3f2a', 'client_id': 'consumer-1', 'client_host': '/10.1.2.3',
+         'partitions': [('orders', 0), ('orders', 1)]},
+        {'member_id': 'consumer-2-9c1d', 'client_id': 'consumer-2', 'client_host': '/10.1.2.4',
+         'partitions': [('payments', 0)]},
+    ]
+    assert b.requests == [('describe_groups', struct.pack('>i', 1) + string('orders-app'))]
+
+
+def test_offset_fetch(broker):
+    b = broker(('offset_fetch', 'offset_fetch'))
+    committed = admin_client(b).offset_fetch('orders-app', coordinator=('127.0.0.1', b.port))
+    # orders 1 has no committed offset (-1)
+    assert committed == {('orders', 0): 1500, ('payments', 0): 42}
+    # a null topic array fetches every topic
+    assert b.requests == [('offset_fetch', string('orders-app') + struct.pack('>i', -1))]
+
+
+def test_log_end_offsets(broker):
+    b = broker(
+        ('metadata', 'metadata_topics'),
+        ('list_offsets', 'list_offsets_1'),
+        ('list_offsets', 'list_offsets_2'))
+    end_offsets = admin_client(b).log_end_offsets([('orders', 0), ('orders', 1), ('payments', 0)])
+    assert end_offsets == {('orders', 0): 1750, ('orders', 1): 900, ('payments', 0): 42}
+    # one request per partition leader, for the latest offset (-1)
+    latest = struct.pack('>q', -1)
+    assert [body for api, body in b.requests[1:]] == [
+        struct.pack('>ii', -1, 1) + string('orders') + struct.pack('>ii', 1, 0) + latest,
+        struct.pack('>ii', -1, 2) +
+            string('orders') + struct.pack('>ii', 1, 1) + latest +
+            string('payments') + struct.pack('>ii', 1, 0) + latest,
+    ]
+
+
+def test_describe_rows(broker):
+    b = broker(
+        ('find_coordinator', 'find_coordinator'),
+        ('describe_groups', 'describe_groups'),
+        ('offset_fetch', 'offset_fetch'),
+        ('metadata', 'metadata_topics'),
+        ('list_offsets', 'list_offsets_1'),
+        ('list_offsets', 'list_offsets_2'))
+    client = kafka_wire.consumer_group_client('127.0.0.1', b.port, timeout=5)
+    try:
+        result = client.describe('orders-app')
+    finally:
+        client.close()
+    assert result.group == 'orders-app'
+    rows = [(r.topic, r.partition, r.current_offset, r.log_end_offset, r.lag, r.consumer_id, r.host, r.client_id)
+        for r in result.rows]
+    assert rows == [
+        ('orders', 0, 1500, 1750, 250, 'consumer-1-3f2a', '/10.1.2.3', 'consumer-1'),
+        ('orders', 1, None, 900, None, 'consumer-1-3f2a', '/10.1.2.3', 'consumer-1'),
+        ('payments', 0, 42, 42, 0, 'consumer-2-9c1d', '/10.1.2.4', 'consumer-2'),
+    ]
+    assert all(r.timestamp == result.timestamp for r in result.rows)
+
+
+def test_describe_failure(broker):
+    b = broker(('find_coordinator', 'find_coordinator_loading'))
+    client = kafka_wire.consumer_group_client('127.0.0.1', b.port, timeout=5)
+    try:
+        assert client.describe('orders-app') is None
+    finally:
+        client.close()
@@ -0,0 +1,79 @@
+import pytest
+
+from kgd_rows import parse_kgd_output, as_kgd_row, kgd_row
+
+
+# kafka 0.9 ConsumerGroupCommand (zookeeper consumers): comma separated, the
+# offsets of a partition nothing has committed to yet are 'unknown'
+describe_0_9 = (
+    "GROUP, TOPIC, PARTITION, CURRENT OFFSET, LOG END OFFSET, LAG, OWNER\n"
+    "orders-app, orders, 0, 1500, 1750, 250, orders-app_host1-1461256789123-8a3b7c2d-0\n"
+    "orders-app, orders, 1, unknown, 900, unknown, orders-app_host1-1461256789123-8a3b7c2d-0\n"
+    "orders-app, orders, 2, 10, 10, 0, none\n"
+    "Could not fetch offset from zookeeper for group orders-app partition [orders,3] due to missing offset data in zookeeper.\n")
+
+# kafka 0.10.0/0.10.1: whitespace separated, consumer in an OWNER column
+describe_0_10 = (
+    "GROUP                          TOPIC                          PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG             OWNER\n"
+    "orders-app                     orders                         0          1500            1750            250             consumer-1_/10.1.2.3\n"
+    "orders-app                     orders                         1          unknown         900             unknown         consumer-1_/10.1.2.3\n"
+    "orders-app                     orders                         2          10              10              0               none\n"
+    "Consumer group `orders-app` is rebalancing.\n")
+
+# kafka 0.10.2 - 2.x (before 2.4): no GROUP column, the group comes from the
+# caller
+describe_0_10_2 = (
+    "Note: This will not show information about old Zookeeper-based consumers.\n"
+    "\n"
+    "TOPIC    PARTITION  CURRENT-OFFSET  LOG-END-OFFSET  LAG        CONSUMER-ID                                       HOST           CLIENT-ID\n"
+    "orders   0          1500            1750            250        consumer-1-5d8f0c1e-7a6b-4c1d-9e2f-0a1b2c3d4e5f   /10.1.2.3      consumer-1\n"
+    "orders   1          -               900             -          -                                                 -              -\n")
+
+
+def rows_of(raw_txt, group='ignored'):
+    return [(row.group, row.topic, row.partition, row.current_offset, row.log_end_offset, row.lag, row.consumer_id)
+        for row in parse_kgd_output(raw_txt, group=group, timestamp=1000)]
+
+
+@pytest.mark.parametrize('raw_txt, owner', [
+    (describe_0_9, 'orders-app_host1-1461256789123-8a3b7c2d-0'),
+    (describe_0_10, 'consumer-1_/10.1.2.3'),
+])
+def test_owner_layouts(raw_txt, owner):
+    # the GROUP column overrides the group passed in; status lines are
+    # skipped, and 'unknown' offsets left unset
+    assert rows_of(raw_txt) == [
+        ('orders-app', 'orders', 0, 1500, 1750, 250, owner),
+        ('orders-app', 'orders', 1, None, 900, None, owner),
+        ('orders-app', 'orders', 2, 10, 10, 0, 'none'),
+    ]
+
+
+def test_owner_layout_documents():
+    row = parse_kgd_output(describe_0_9.encode('utf-8'), group='ignored', timestamp=1000)[1]
+    assert row.to_doc() == {'group': 'orders-app', 'topic': 'orders', 'partition': 1, 'log_end_offset': 900,
+        'consumer_id': 'orders-app_host1-1461256789123-8a3b7c2d-0', 'timestamp': 1000}
+
+
+def test_consumer_id_layout():
+    rows = parse_kgd_output(describe_0_10_2, group='orders-app', timestamp=1000)
+    assert [row.to_doc() for row in rows] == [
+        {'group': 'orders-app', 'topic': 'orders', 'partition': 0, 'current_offset': 1500,
+         'log_end_offset': 1750, 'lag': 250, 'consumer_id': 'consumer-1-5d8f0c1e-7a6b-4c1d-9e2f-0a1b2c3d4e5f',
+         'host': '/10.1.2.3', 'client_id': 'consumer-1', 'timestamp': 1000},
+        {'group': 'orders-app', 'topic': 'orders', 'partition': 1, 'log_end_offset': 900, 'timestamp': 1000},
+    ]
+
+
+def test_no_output():
+    assert parse_kgd_output(None) is None
+    assert parse_kgd_output("Consumer group 'orders-app' does not exist.\n") == []
+
+
+def test_as_kgd_row():
+    row = as_kgd_row({'topic': 'orders', 'partition': '3', 'lag': 'unknown', 'owner': 'x', 'host': '-'},
+        group='orders-app', timestamp=1000)
+    assert isinstance(row, kgd_row)
+    assert row.to_doc() == {'group': 'orders-app', 'topic': 'orders', 'partition': 3, 'timestamp': 1000}
+    # a row's own group is kept
+    assert as_kgd_row(kgd_row(group='billing'), group='orders-app').group == 'billing'
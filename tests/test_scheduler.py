@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+import scheduler
+
+
+class fake_clock(object):
+
+    def __call__(self):
+        return self.now
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+
+def test_skips_missed_ticks():
+    clock = fake_clock()
+    sched = scheduler.interval_scheduler(10, clock=clock)
+    assert sched.start() == 0
+    # the cycle ran 25s - the ticks at 1010 and 1020 are skipped
+    clock.now = 1025.0
+    assert sched.next_delay(True) == 5
+    assert sched.stats() == {'runs': 1, 'failures': 0, 'overruns': 1, 'skipped': 2, 'backoff_skipped': 0}
+
+
+def test_run_ending_on_the_tick():
+    clock = fake_clock()
+    sched = scheduler.interval_scheduler(10, clock=clock)
+    sched.start()
+    # a run that ends exactly on the next tick starts the next one at once
+    clock.now = 1010.0
+    assert sched.next_delay(True) == 0
+    clock.now = 1012.0
+    assert sched.next_delay(True) == 8
+    assert sched.stats()['overruns'] == 0
+    assert sched.stats()['skipped'] == 0
+
+
+def test_counters():
+    clock = fake_clock()
+    sched = scheduler.interval_scheduler(10, clock=clock)
+    sched.start()
+    for ok, run_time in [(True, 2), (False, 3), (True, 31), (True, 4)]:
+        clock.now += run_time
+        clock.now += sched.next_delay(ok)
+    assert sched.stats() == {'runs': 4, 'failures': 1, 'overruns': 1, 'skipped': 3, 'backoff_skipped': 0}
+
+
+def test_backoff_grows_and_resets():
+    clock = fake_clock()
+    sched = scheduler.interval_scheduler(10, clock=clock)
+    sched.start()
+    delays = []
+    for ok in [False, False, False, False, True, False]:
+        clock.now += 1
+        delay = sched.next_delay(ok)
+        delays.append(delay)
+        clock.now += delay
+    # 1, 2, 4, 8 intervals (less the second the run took), back to one
+    # interval after a success, and starting over at one
+    assert delays == [9, 19, 39, 79, 9, 9]
+    assert sched.stats()['failures'] == 5
+    assert sched.stats()['backoff_skipped'] == 1 + 3 + 7
+
+
+def test_backoff_max():
+    clock = fake_clock()
+    sched = scheduler.interval_scheduler(10, backoff_max=35, clock=clock)
+    sched.start()
+    delays = []
+    for _ in range(6):
+        delay = sched.next_delay(False)
+        delays.append(delay)
+        clock.now += delay
+    # capped at 3 intervals - the whole intervals that fit in backoff_max
+    assert delays == [10, 20, 30, 30, 30, 30]
+
+
+def test_start_jitter(monkeypatch):
+    rnd = random.Random(7)
+    monkeypatch.setattr(scheduler.random, 'uniform', rnd.uniform)
+    offsets = []
+    for _ in range(200):
+        clock = fake_clock()
+        sched = scheduler.interval_scheduler(10, start_jitter=30, clock=clock)
+        offset = sched.start()
+        offsets.append(offset)
+        # the grid starts from the jittered first run
+        clock.now += offset + 2
+        assert sched.next_delay(True) == pytest.approx(8)
+    assert all(0 <= offset <= 30 for offset in offsets)
+    assert max(offsets) - min(offsets) > 20
+    # no jitter, no offset
+    assert scheduler.interval_scheduler(10, clock=fake_clock()).start() == 0
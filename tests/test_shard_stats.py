@@ -0,0 +1,106 @@
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('elasticsearch')
+import shard_stats
+
+from bench_shard_rollover import gen_shard_rows, list_rollover
+
+
+today = '-2018.07.31'
+tomorrow = '-2018.08.01'
+
+
+def shard_row(template, day_sfx, shard, prirep, node='node01', docs='100'):
+    return {
+        'index': template + day_sfx,
+        'shard': str(shard),
+        'prirep': prirep,
+        'state': 'STARTED',
+        'docs': docs,
+        'store': '2048',
+        'ip': '10.0.0.1',
+        'node': node
+    }
+
+
+def merged(rows):
+    return shard_stats.merge_shard_rollover(rows, today, tomorrow, cluster_name='voice', doc_ts_millis=1533074400000)
+
+
+def pushed(rows):
+    return sorted((sh['index']['name'], sh['shard']['shard_uiid'], sh['node']['name']) for sh in merged(rows))
+
+
+def test_shard_document():
+    sh_data, = merged([shard_row('filebeat_app', today, 3, 'r', docs='42')])
+    assert sh_data == {
+        'timestamp': 1533074400000,
+        'cluster': 'voice',
+        'node': {'name': 'node01', 'ip': '10.0.0.1'},
+        'index': {'name': 'filebeat_app-2018.07.31', 'template': 'filebeat_app'},
+        'shard': {
+            'shard_type': 'replica',
+            'shard_uiid': '003.r-filebeat_app',
+            'idx': '3',
+            'state': 'STARTED',
+            'doc_count': '42',
+            'storage_size': '2048'
+        }
+    }
+
+
+def test_next_day_replaces_current_day():
+    rows = [
+        shard_row('app', today, 0, 'p'),
+        shard_row('app', today, 0, 'r'),
+        shard_row('app', today, 1, 'p'),
+        shard_row('app', tomorrow, 0, 'p'),
+        shard_row('other', today, 0, 'p'),
+    ]
+    assert pushed(rows) == [
+        ('app-2018.07.31', '000.r-app', 'node01'),
+        ('app-2018.07.31', '001.p-app', 'node01'),
+        ('app-2018.08.01', '000.p-app', 'node01'),
+        ('other-2018.07.31', '000.p-other', 'node01'),
+    ]
+
+
+def test_current_day_after_next_day_dropped():
+    rows = [
+        shard_row('app', tomorrow, 0, 'p'),
+        shard_row('app', today, 0, 'p'),
+        shard_row('app', today, 0, 'r'),
+    ]
+    assert pushed(rows) == [
+        ('app-2018.07.31', '000.r-app', 'node01'),
+        ('app-2018.08.01', '000.p-app', 'node01'),
+    ]
+
+
+def test_replicas_share_a_key():
+    # two replicas of each shard - every one is kept, and the next day's
+    # replicas replace all of the current day's
+    rows = [
+        shard_row('app', today, 0, 'r', node='node01'),
+        shard_row('app', today, 0, 'r', node='node02'),
+        shard_row('app', today, 1, 'r', node='node01'),
+        shard_row('app', tomorrow, 0, 'r', node='node03'),
+        shard_row('app', today, 1, 'r', node='node02'),
+        shard_row('app', tomorrow, 0, 'r', node='node04'),
+        shard_row('app', today, 0, 'r', node='node05'),
+    ]
+    assert pushed(rows) == [
+        ('app-2018.07.31', '001.r-app', 'node01'),
+        ('app-2018.07.31', '001.r-app', 'node02'),
+        ('app-2018.08.01', '000.r-app', 'node03'),
+        ('app-2018.08.01', '000.r-app', 'node04'),
+    ]
+
+
+def test_matches_the_list_filter():
+    rows = gen_shard_rows(2000)
+    # the benchmark's rows, through the filter the merge replaced
+    expected = Counter(sh['shard']['shard_uiid'] for sh in list_rollover(rows, today, tomorrow))
+    assert Counter(sh['shard']['shard_uiid'] for sh in merged(rows)) == expected
@@ -0,0 +1,157 @@
+import gzip
+import io
+import json
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import simple_es
+
+
+class fake_es(object):
+    # records the posted bodies; fails the posts listed in fail_posts, and
+    # rejects documents whose 'reject' field is set
+    def post_bulk_body(self, bulk_payload):
+        self.posts.append(bulk_payload)
+        if (len(self.posts) in self.fail_posts):
+            raise requests.exceptions.ConnectionError("connection refused")
+        docs = [json.loads(line) for line in bulk_payload.splitlines()[1::2]]
+        items = []
+        for doc in docs:
+            if (doc.get('reject')):
+                items.append({'index': {'status': 400, 'error': {'type': 'mapper_parsing_exception'}}})
+            else:
+                items.append({'index': {'status': 201}})
+        return {'errors': any(doc.get('reject') for doc in docs), 'items': items}
+
+    def __init__(self, fail_posts=()):
+        self.posts = []
+        self.fail_posts = fail_posts
+
+
+def posted_docs(es):
+    return [[json.loads(line)['n'] for line in body.splitlines()[1::2]] for body in es.posts]
+
+
+def buf_action(index):
+    return simple_es.bulk_buffer(None, index=index)._action_line
+
+
+def test_posts_when_full_with_the_triggering_document():
+    es = fake_es()
+    buf = simple_es.bulk_buffer(es, index='idx', max_docs=3)
+    results = [buf.add({'n': n}, label=n) for n in range(7)]
+    assert results == [None, None, (3, []), None, None, (3, []), None]
+    assert buf.pending == 1
+    assert buf.flush() == (1, [])
+    assert buf.flush() == (0, [])
+    assert posted_docs(es) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_byte_limit_keeps_the_triggering_document():
+    es = fake_es()
+    doc_bytes = len(json.dumps({'n': 0})) + len(buf_action('idx')) + 2
+    buf = simple_es.bulk_buffer(es, index='idx', max_docs=100, max_bytes=doc_bytes * 2)
+    assert buf.add({'n': 0}, label=0) is None
+    assert buf.add({'n': 1}, label=1) is None
+    assert buf.add({'n': 2}, label=2) == (2, [])
+    assert buf.pending == 1
+    buf.flush()
+    assert posted_docs(es) == [[0, 1], [2]]
+
+
+def test_failed_request_reports_the_batch():
+    es = fake_es(fail_posts=(1,))
+    buf = simple_es.bulk_buffer(es, index='idx', max_docs=2)
+    assert buf.add({'n': 0}, label='a') is None
+    assert buf.add({'n': 1}, label='b') == (0, ['a', 'b'])
+    assert buf.add({'n': 2}, label='c') is None
+    assert buf.flush() == (1, [])
+
+
+def test_rejected_documents_are_reported_by_label():
+    es = fake_es()
+    buf = simple_es.bulk_buffer(es, index='idx', max_docs=10)
+    buf.add({'n': 0}, label='a')
+    buf.add({'n': 1, 'reject': True}, label='b')
+    buf.add({'n': 2}, label='c')
+    assert buf.flush() == (2, ['b'])
+
+
+class fake_response(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+# stands in for the requests.Session - records every request, and answers
+# each with reply
+class fake_session(object):
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(dict(kwargs, method=method, url=url))
+        return fake_response(json.dumps(self.reply).encode('utf-8'))
+
+    def close(self):
+        self.closed = True
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+        self.closed = False
+
+
+def session_es(reply=None, **kwargs):
+    es = simple_es.simple_es(server='es1', **kwargs)
+    es._session = fake_session({'errors': False, 'items': []} if reply is None else reply)
+    return es
+
+
+def test_bulk_body_plain():
+    es = session_es()
+    assert es.post_bulk_body(u'{"index": {}}\n{"n": "é"}\n') == {'errors': False, 'items': []}
+    req, = es._session.requests
+    assert (req['method'], req['url']) == ('POST', 'http://es1:9200/_bulk')
+    assert req['headers'] == {'Content-Type': 'application/x-ndjson'}
+    assert req['data'] == u'{"index": {}}\n{"n": "é"}\n'.encode('utf-8')
+
+
+def test_bulk_body_gzip():
+    es = session_es(bulk_gzip=True, gzip_level=9)
+    bulk_body = '\n'.join('{"index": {}}\n{"n": %d}' % n for n in range(200)) + '\n'
+    es.post_bulk_body(bulk_body)
+    req, = es._session.requests
+    assert req['headers'] == {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+    assert gzip.GzipFile(fileobj=io.BytesIO(req['data'])).read() == bulk_body.encode('utf-8')
+    assert len(req['data']) < len(bulk_body)
+    # the other requests aren't compressed
+    es.index_get('idx')
+    assert es._session.requests[1]['headers'] is None
+
+
+def test_https_and_verify():
+    es = session_es(reply={'version': {'number': '6.8.0'}}, scheme='https', port=9243,
+        verify='/etc/pki/ca.pem', auth=('kafka', 'secret'), timeout=5)
+    assert es.info() == {'version': {'number': '6.8.0'}}
+    es.index_bulk('idx', [{'n': 1}])
+    for req in es._session.requests:
+        assert req['url'].startswith('https://es1:9243')
+        assert (req['verify'], req['auth'], req['timeout']) == ('/etc/pki/ca.pem', ('kafka', 'secret'), 5)
+    assert es._session.requests[1]['url'] == 'https://es1:9243/_bulk'
+    es.close()
+    assert es._session.closed
+
+
+def test_connection_pool_adapter():
+    es = simple_es.simple_es(server='es1', pool_size=7)
+    try:
+        http_adapter = es._session.get_adapter('http://es1:9200/_bulk')
+        https_adapter = es._session.get_adapter('https://es1:9200/_bulk')
+        # one pool for the server, shared by both schemes
+        assert http_adapter is https_adapter
+        assert isinstance(http_adapter, HTTPAdapter)
+        assert http_adapter._pool_maxsize == 7
+        assert http_adapter._pool_connections == 1
+        assert http_adapter.poolmanager.connection_pool_kw['maxsize'] == 7
+    finally:
+        es.close()
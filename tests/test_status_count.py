@@ -0,0 +1,458 @@
+import json
+
+import pytest
+
+elasticsearch = pytest.importorskip('elasticsearch')
+pytest.importorskip('regex')
+import status_count
+
+
+minute = 60 * 1000
+
+
+# answers the status aggregation for any window with one status bucket
+# counting the window's minutes, and one beat.name bucket under it;
+# searches for the windows in fail raise fail_with (a connection error). Bulk requests
+# are kept as lists of documents - documents whose (interval, @timestamp)
+# is in reject are rejected, and ones in crash raise.
+class fake_es(object):
+
+    def search(self, index=None, body=None):
+        if ('aggs' in body and 'last' in body['aggs']):
+            return self.last_search(body)
+        window = (body['query']['range']['@timestamp']['gte'], body['query']['range']['@timestamp']['lte'])
+        self.searches.append(window)
+        if (window[1] in self.fail):
+            raise self.fail_with
+        doc_count = window[1] // minute
+        composite = body['aggs']['status'].get('composite')
+        if (composite is None):
+            buckets = [{'key': 'ok', 'doc_count': doc_count,
+                'beat.name': {'buckets': [{'key': 'host-a', 'doc_count': doc_count}]}}]
+        elif (len(composite['sources']) == 1):
+            buckets = [{'key': {'status': 'ok'}, 'doc_count': doc_count}]
+        else:
+            buckets = []
+        return {'timed_out': False, 'aggregations': {'status': {'buckets': buckets}}}
+
+    # the newest @timestamp for an interval in the summary index
+    def last_search(self, body):
+        interval_duration = body['query']['term']['interval']
+        if (self.summary is None):
+            raise elasticsearch.NotFoundError('no such index')
+        return {'aggregations': {'last': {'value': self.summary.get(interval_duration)}}}
+
+    def bulk(self, body=None):
+        docs = [json.loads(line) for line in body.splitlines()[1::2]]
+        if any((doc['interval'], doc['@timestamp']) in self.crash for doc in docs):
+            raise RuntimeError('crashed')
+        items = []
+        for doc in docs:
+            if ((doc['interval'], doc['@timestamp']) in self.reject):
+                items.append({'index': {'status': 400, 'error': {'type': 'rejected'}}})
+            else:
+                items.append({'index': {'status': 201}})
+        self.bulks.append([doc for doc, item in zip(docs, items) if 'error' not in item['index']])
+        return {'errors': any('error' in item['index'] for item in items), 'items': items}
+
+    def __init__(self, fail=(), summary=None):
+        self.fail = set(fail)
+        self.fail_with = elasticsearch.ConnectionError('search failed')
+        self.summary = summary
+        self.reject = set()
+        self.crash = set()
+        self.searches = []
+        self.bulks = []
+
+
+# (@timestamp, interval) of every indexed window
+def indexed(es):
+    return sorted(set((doc['@timestamp'], doc['interval']) for docs in es.bulks for doc in docs))
+
+
+# the indexed documents of a window, as {(status, sub-key value): count}
+def window_counts(es, interval_duration, window_end):
+    counts = {}
+    for docs in es.bulks:
+        for doc in docs:
+            if (doc['interval'] == interval_duration and doc['@timestamp'] == window_end):
+                key = (doc['status'], doc.get('beat.name'))
+                assert key not in counts
+                counts[key] = doc.get('doc_count', doc.get('doc_count_total'))
+    return counts
+
+
+def test_index_mappings():
+    properties = status_count.index_mappings['mappings']['doc']['properties']
+    assert properties['doc_count'] == {'type': 'long'}
+    assert properties['doc_count_total'] == {'type': 'long'}
+
+
+def test_backfill_windows():
+    # 10:07:30 - the last closed 5m boundary is 10:05, and the windows end
+    # one interval before it
+    now = 10 * 3600 + 7 * 60 + 30.5
+    windows = status_count.backfill_windows('5m', 3, now=now)
+    assert windows == [
+        ((10 * 60 - 5) * minute, (10 * 60) * minute),
+        ((10 * 60 - 10) * minute, (10 * 60 - 5) * minute),
+        ((10 * 60 - 15) * minute, (10 * 60 - 10) * minute),
+    ]
+    assert all(isinstance(ts, int) for window in windows for ts in window)
+    # a time on the boundary itself
+    assert status_count.backfill_windows('1h', 1, now=7200) == [(0, 3600 * 1000)]
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = str(tmp_path / 'backfill.checkpoint')
+    assert status_count.load_checkpoint(checkpoint, '5m') == set()
+    status_count.save_checkpoint(checkpoint, '5m', set([300000, 600000]))
+    assert status_count.load_checkpoint(checkpoint, '5m') == set([300000, 600000])
+    # another interval's checkpoint is ignored
+    assert status_count.load_checkpoint(checkpoint, '1h') == set()
+
+
+@pytest.mark.parametrize('page_size', [None, 10])
+def test_backfill_resumes_from_checkpoint(tmp_path, page_size):
+    checkpoint = str(tmp_path / 'backfill.checkpoint')
+    windows = status_count.backfill_windows('5m', 6, now=3600)
+    failed_end = windows[2][1]
+
+    es = fake_es(fail=[failed_end])
+    completed, failed = status_count.run_backfill(es, '5m', windows, concurrency=2,
+        checkpoint_file=checkpoint, bulk_max_docs=4, page_size=page_size)
+    assert failed == set([failed_end])
+    assert completed == set(w[1] for w in windows) - failed
+    assert indexed(es) == sorted((w[1], '5m') for w in windows if w[1] != failed_end)
+
+    # the next run only queries the window that failed
+    es = fake_es()
+    completed, failed = status_count.run_backfill(es, '5m', windows, concurrency=2,
+        checkpoint_file=checkpoint, bulk_max_docs=4, page_size=page_size)
+    assert set(window[1] for window in es.searches) == set([failed_end])
+    assert indexed(es) == [(failed_end, '5m')]
+    assert failed == set()
+    assert status_count.load_checkpoint(checkpoint, '5m') == set(w[1] for w in windows)
+
+
+# serves the status/beat.name composite aggregation as pages of buckets,
+# keyed by the after key asked for; the status-only and other sub-key
+# aggregations are empty. after_key is left out of the responses when
+# with_after_key is False, as pre-6.3 servers do.
+class composite_pages_es(object):
+
+    def search(self, index=None, body=None):
+        composite = body['aggs']['status']['composite']
+        after = composite.get('after')
+        sources = [list(source.keys())[0] for source in composite['sources']]
+        self.searches.append((sources, after))
+        if (sources != ['status', 'beat.name']):
+            return {'timed_out': False, 'aggregations': {'status': {'buckets': []}}}
+        page = self.pages[None if after is None else tuple(sorted(after.items()))]
+        aggregation = {'buckets': [{'key': dict(key), 'doc_count': n} for key, n in page]}
+        if (self.with_after_key and page):
+            aggregation['after_key'] = dict(page[-1][0])
+        return {'timed_out': False, 'aggregations': {'status': aggregation}}
+
+    def __init__(self, pages, with_after_key=True):
+        self.with_after_key = with_after_key
+        # after key -> page of (key, doc_count)
+        self.pages = {}
+        after = None
+        for page in pages:
+            page = [(tuple(sorted(key.items())), n) for key, n in page]
+            self.pages[after] = page
+            after = page[-1][0]
+        self.searches = []
+
+
+host_pages = [
+    [({'status': 'ok', 'beat.name': 'host-a'}, 4), ({'status': 'ok', 'beat.name': 'host-b'}, 3)],
+    [({'status': 'ok', 'beat.name': 'host-c'}, 2), ({'status': 'error', 'beat.name': 'host-a'}, 1)],
+    [({'status': 'error', 'beat.name': 'host-b'}, 5)],
+]
+
+
+@pytest.mark.parametrize('with_after_key', [True, False])
+def test_composite_paging(with_after_key):
+    es = composite_pages_es(host_pages, with_after_key=with_after_key)
+    docs = list(status_count.iter_composite_docs(es, '5m', hm(10, 0), hm(10, 5), page_size=2))
+    # the composite key is popped apart into status and the sub-key
+    assert docs == [
+        {'status': status, 'beat.name': host, 'doc_count': n, '@timestamp': hm(10, 5), 'interval': '5m'}
+        for status, host, n in [('ok', 'host-a', 4), ('ok', 'host-b', 3), ('ok', 'host-c', 2),
+            ('error', 'host-a', 1), ('error', 'host-b', 5)]]
+    # three pages of beat.name buckets - the short third page is the last
+    host_searches = [after for sources, after in es.searches if sources == ['status', 'beat.name']]
+    assert host_searches == [
+        None,
+        {'status': 'ok', 'beat.name': 'host-b'},
+        {'status': 'error', 'beat.name': 'host-a'}]
+    # every other aggregation stopped at its empty first page
+    assert len(es.searches) == len(status_count.agg_keys) + 3
+
+
+def test_composite_status_totals():
+    page = {'timed_out': False, 'interval': '5m', 'interval_timestamp': hm(10, 5),
+        'aggregations': {'status': {'buckets': [{'key': {'status': 'ok'}, 'doc_count': 7}]}}}
+    assert status_count.reindex_aggregation(page) == [
+        {'status': 'ok', 'doc_count_total': 7, '@timestamp': hm(10, 5), 'interval': '5m'}]
+
+
+@pytest.mark.parametrize('page_size', [None, 10])
+def test_backfill_window_search_error(page_size):
+    # a 5xx from the search fails its window, not the backfill
+    windows = status_count.backfill_windows('5m', 4, now=3600)
+    es = fake_es(fail=[windows[1][1]])
+    es.fail_with = elasticsearch.TransportError(500, 'search_phase_execution_exception', {})
+    completed, failed = status_count.run_backfill(es, '5m', windows, concurrency=2, page_size=page_size)
+    assert failed == set([windows[1][1]])
+    assert completed == set(w[1] for w in windows) - failed
+
+
+def hm(hours, minutes):
+    return (hours * 60 + minutes) * minute
+
+
+class daemon_stopped(Exception):
+    pass
+
+
+# time.time()/time.sleep() for status_count on a clock that only moves when
+# slept on
+class fake_clock(object):
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def __init__(self, now):
+        self.now = now
+        self.slept = []
+
+
+# runs the daemon for n_ticks ticks on a fake clock starting at now
+# (seconds, or a fake_clock); between_ticks(tick) is called after each
+# tick. Returns each tick's ok flag.
+def run_daemon_ticks(monkeypatch, es, now, n_ticks, between_ticks=None, **kwargs):
+    if isinstance(now, fake_clock):
+        clock = now
+    else:
+        clock = fake_clock(now)
+    ticks = []
+
+    class fake_scheduler(object):
+
+        def start(self):
+            return 0
+
+        def wait(self, ok):
+            ticks.append(ok)
+            if (between_ticks is not None):
+                between_ticks(len(ticks))
+            if (len(ticks) >= n_ticks):
+                raise daemon_stopped()
+            clock.sleep(self.interval)
+
+        def __init__(self, interval, name=None):
+            self.interval = interval
+
+    monkeypatch.setattr(status_count, 'time', clock)
+    monkeypatch.setattr(status_count.scheduler, 'interval_scheduler', fake_scheduler)
+    with pytest.raises(daemon_stopped):
+        status_count.run_daemon(es, **kwargs)
+    return ticks
+
+
+def write_state(state_file, state):
+    with open(state_file, 'w') as f:
+        json.dump(state, f)
+
+
+def read_state(state_file):
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def test_daemon_resumes_from_index(monkeypatch, tmp_path):
+    # no state file - each interval starts after the newest window in the
+    # summary index
+    state_file = str(tmp_path / 'daemon.state')
+    es = fake_es(summary={'5m': hm(10, 30), '15m': hm(10, 15)})
+    run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+        durations=['5m', '15m'], state_file=state_file)
+    assert indexed(es) == [
+        (hm(10, 30), '15m'), (hm(10, 35), '5m'), (hm(10, 40), '5m'), (hm(10, 45), '15m'), (hm(10, 45), '5m')]
+    assert read_state(state_file) == {'5m': hm(10, 45), '15m': hm(10, 45)}
+
+
+@pytest.mark.parametrize('summary', [None, {}])
+def test_daemon_starts_with_last_closed_window(monkeypatch, tmp_path, summary):
+    # nothing indexed yet (or no summary index at all) - only the most
+    # recently closed window is queried
+    state_file = str(tmp_path / 'daemon.state')
+    es = fake_es(summary=summary)
+    run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+        durations=['5m', '1h'], state_file=state_file)
+    assert indexed(es) == [(hm(10, 0), '1h'), (hm(10, 45), '5m')]
+
+
+def test_daemon_state_file_first(monkeypatch, tmp_path):
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 40)})
+    es = fake_es(summary={'5m': hm(10, 0)})
+    run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+        durations=['5m'], state_file=state_file)
+    assert indexed(es) == [(hm(10, 45), '5m')]
+
+
+def test_daemon_settle(monkeypatch, tmp_path):
+    # started at 10:45:30 with settle=60 - the 10:45 window hasn't settled
+    # yet, so the first tick waits for 10:46
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 35), '1h': hm(10, 0)})
+    clock = fake_clock(hm(10, 45) // 1000 + 30)
+    es = fake_es()
+
+    def between_ticks(tick):
+        ticks_at.append(clock.now)
+        windows_at.append(indexed(es))
+
+    ticks_at = []
+    windows_at = []
+    run_daemon_ticks(monkeypatch, es, clock, 3, between_ticks=between_ticks,
+        durations=['5m', '1h'], state_file=state_file, settle=60)
+    assert clock.slept[0] == 30
+    assert ticks_at == [hm(10, 46) // 1000, hm(10, 51) // 1000, hm(10, 56) // 1000]
+    assert windows_at[0] == [(hm(10, 40), '5m'), (hm(10, 45), '5m')]
+    assert windows_at[2][-1] == (hm(10, 55), '5m')
+    # the 11:00 window isn't queried before 11:01
+    assert (hm(11, 0), '1h') not in windows_at[2]
+
+
+def test_daemon_hour_window_settles(monkeypatch, tmp_path):
+    # ticks at 10:47 and 11:02 with settle=120 - the 11:00 hour window goes
+    # in on the second
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'15m': hm(10, 30), '1h': hm(10, 0)})
+    es = fake_es()
+
+    def between_ticks(tick):
+        windows_at.append(indexed(es))
+
+    windows_at = []
+    run_daemon_ticks(monkeypatch, es, hm(10, 47) // 1000, 2, between_ticks=between_ticks,
+        durations=['15m', '1h'], state_file=state_file, settle=120)
+    assert windows_at == [
+        [(hm(10, 45), '15m')],
+        [(hm(10, 45), '15m'), (hm(11, 0), '15m'), (hm(11, 0), '1h')]]
+
+
+def test_rollup_window_ends():
+    rollups = status_count.interval_rollup(['15m', '1h'])
+    for fine_end in (hm(10, 5), hm(10, 10), hm(10, 15), hm(10, 20)):
+        rollups.add({'status': 'ok', '@timestamp': fine_end, 'interval': '5m', 'doc_count_total': 1})
+    # the fine window ending on a coarse boundary belongs to the coarse
+    # window ending there
+    assert sorted(rollups._windows.keys()) == [
+        ('15m', hm(10, 15)), ('15m', hm(10, 30)), ('1h', hm(11, 0))]
+    assert [(d, end, docs[0]['doc_count_total']) for d, end, docs in rollups.closed(hm(10, 15))] == [
+        ('15m', hm(10, 15), 3)]
+
+
+def test_rollup_sums_by_key():
+    rollups = status_count.interval_rollup(['15m'])
+    for fine_end in (hm(10, 5), hm(10, 10), hm(10, 15)):
+        for status, host, count in (('ok', 'host-a', 2), ('ok', 'host-b', 1), ('error', 'host-a', 5)):
+            rollups.add({'status': status, '@timestamp': fine_end, 'interval': '5m',
+                'beat.name': host, 'doc_count': count})
+        rollups.add({'status': 'ok', '@timestamp': fine_end, 'interval': '5m', 'doc_count_total': 3})
+        # not closed until the fine window on the boundary is in
+        if (fine_end < hm(10, 15)):
+            assert rollups.closed(fine_end) == []
+    (interval_duration, c_end, c_docs), = rollups.closed(hm(10, 15))
+    assert (interval_duration, c_end) == ('15m', hm(10, 15))
+    assert set((doc['status'], doc.get('beat.name'), doc.get('doc_count'), doc.get('doc_count_total'),
+        doc['@timestamp'], doc['interval']) for doc in c_docs) == set([
+        ('ok', 'host-a', 6, None, hm(10, 15), '15m'),
+        ('ok', 'host-b', 3, None, hm(10, 15), '15m'),
+        ('error', 'host-a', 15, None, hm(10, 15), '15m'),
+        ('ok', None, None, 9, hm(10, 15), '15m'),
+    ])
+    assert rollups.closed(hm(11, 0)) == []
+
+
+# the count a rolled up window should have: the fake's fine counts summed
+def rolled_up(c_end, c_minutes, f_minutes=5):
+    return sum((c_end - n * f_minutes * minute) // minute for n in range(c_minutes // f_minutes))
+
+
+def test_rollup_replays_from_coarse_state(monkeypatch, tmp_path):
+    # stopped after the 10:40 fine window, with the 15m window to 10:30
+    # indexed - 10:35 and 10:40 are queried again but not re-indexed
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 40), '15m': hm(10, 30)})
+    es = fake_es()
+    ticks = run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+        durations=['5m', '15m'], state_file=state_file, rollup=True)
+    assert ticks == [True]
+    assert [window[1] for window in es.searches] == [hm(10, 35), hm(10, 40), hm(10, 45)]
+    assert indexed(es) == [(hm(10, 45), '15m'), (hm(10, 45), '5m')]
+    total = rolled_up(hm(10, 45), 15)
+    assert window_counts(es, '15m', hm(10, 45)) == {('ok', None): total, ('ok', 'host-a'): total}
+    assert read_state(state_file) == {'5m': hm(10, 45), '15m': hm(10, 45)}
+
+
+def test_rollup_fine_state_behind_coarse(monkeypatch, tmp_path):
+    # the fine state lags the coarse one - the fine windows are indexed from
+    # the fine state, and the coarse window the replay starts partway
+    # through (10:30, already indexed) is left alone
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 20), '15m': hm(10, 30)})
+    es = fake_es()
+    run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+        durations=['5m', '15m'], state_file=state_file, rollup=True)
+    assert [window[1] for window in es.searches] == [hm(10, 25), hm(10, 30), hm(10, 35), hm(10, 40), hm(10, 45)]
+    assert indexed(es) == [
+        (hm(10, 25), '5m'), (hm(10, 30), '5m'), (hm(10, 35), '5m'), (hm(10, 40), '5m'),
+        (hm(10, 45), '15m'), (hm(10, 45), '5m')]
+    assert read_state(state_file) == {'5m': hm(10, 45), '15m': hm(10, 45)}
+
+
+def test_rollup_retries_failed_bulk(monkeypatch, tmp_path):
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 30), '15m': hm(10, 30)})
+    es = fake_es()
+    # the 10:45 rollup is rejected until the third tick
+    es.reject.add(('15m', hm(10, 45)))
+
+    def between_ticks(tick):
+        if (tick == 2):
+            es.reject.clear()
+
+    ticks = run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 4, between_ticks=between_ticks,
+        durations=['5m', '15m'], state_file=state_file, rollup=True)
+    assert ticks == [False, False, True, True]
+    # 10:45 went in on the third tick, ahead of 11:00 - each fine window was
+    # only queried once
+    assert [window[1] for window in es.searches] == [
+        hm(10, 35), hm(10, 40), hm(10, 45), hm(10, 50), hm(10, 55), hm(11, 0)]
+    rollup_order = [docs[0]['@timestamp'] for docs in es.bulks if docs and docs[0]['interval'] == '15m']
+    assert rollup_order == [hm(10, 45), hm(11, 0)]
+    assert window_counts(es, '15m', hm(10, 45))[('ok', None)] == rolled_up(hm(10, 45), 15)
+    assert read_state(state_file) == {'5m': hm(11, 0), '15m': hm(11, 0)}
+
+
+def test_rollup_state_written_per_fine_window(monkeypatch, tmp_path):
+    state_file = str(tmp_path / 'daemon.state')
+    write_state(state_file, {'5m': hm(10, 30), '15m': hm(10, 30)})
+    es = fake_es()
+    es.crash.add(('5m', hm(10, 40)))
+    with pytest.raises(RuntimeError):
+        run_daemon_ticks(monkeypatch, es, hm(10, 46) // 1000, 1,
+            durations=['5m', '15m'], state_file=state_file, rollup=True)
+    # 10:35 was indexed before the crash
+    assert read_state(state_file) == {'5m': hm(10, 35), '15m': hm(10, 30)}
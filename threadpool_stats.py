@@ -6,7 +6,9 @@ import time
 import requests
 import elasticsearch
 import regex
-import threading
+
+import es_bulk
+import collector
 
 # local log config
 from lconfig import *
@@ -60,127 +62,84 @@ PUT test_thread_pool_stats
 # port po The bound transport port for the current node
 
 
-def threaded(fn):
-    def wrapper(*k, **kw):
-        t = threading.Thread(target=fn, args=k, kwargs=kw)
-        t.setDaemon(True)
-        t.start()
-        return t
-    return wrapper
+# a single thread pool collection cycle - scheduled by the collector engine
+def run_stat_query(source_es, dest_es, cluster_name=None,
+        bulk_max_docs=1000, bulk_max_bytes=5*1024*1024):
+
+    log = logging.getLogger(__name__)
 
-@threaded
-def run_stat_query(source_es, dest_es, cluster_name=None, interval=60):
+    _st = time.time()
+    es_statinfo = source_es.cat.thread_pool(
+        h='name,node_name,host,type,active,size,queue,queue_size,rejected,largest,completed',
+        v=True,
+        format='json')
+    _se = time.time()
+    log.info('%s %r  %2.2f ms' % (cluster_name, '.cat.thread_pool', (_se - _st) * 1000))
+
+    doc_ts_millis = int(_se * 1000)
+
+    # add the cluster info to each item
+    # ... and add in the index prefix
+    # every row from the poll is grouped into _bulk requests; a rejected
+    # row is reported by its thread_id only
+    idx_writer = es_bulk.bulk_writer(
+        dest_es,
+        index="test_thread_pool_stats",
+        doc_type='thread_pool',
+        max_docs=bulk_max_docs,
+        max_bytes=bulk_max_bytes)
+    stat_docs = ({
+            'timestamp': doc_ts_millis,
+            'thread_id': "%s_%s" % (_stat['name'], _stat['node_name']),
+            'node_name': _stat['node_name'],
+            'name': _stat['name'],
+            'type': _stat['type'],
+            'queue': _stat['queue'],
+            'queue_size': _stat['queue_size'],
+            'active': _stat['active'],
+            'completed': _stat['completed'],
+            'rejected': _stat['rejected'],
+            'largest': _stat['largest'],
+            'size': _stat['size']
+        } for _stat in es_statinfo)
+    docs_indexed, docs_failed = idx_writer.add_all(
+        stat_docs,
+        label_of=lambda stat_data: stat_data['thread_id'])
+    log.info('%s %r  %d docs  %2.2f ms' % (cluster_name, '_bulk', docs_indexed, (time.time() - _se) * 1000))
+    if (docs_failed):
+        log.error("Error posting thread pool data for: %s" %
+            ', '.join(docs_failed))
+
+
+# register a thread pool stats poller for every source cluster
+def add_stat_pollers(engine, clusters, es_cred, interval=30,
+        dest_hosts=[{'host':'localhost', 'port': '9200'}]):
 
     log = logging.getLogger(__name__)
-    _nextrun = time.time()
-    while True:
-
-        _st = time.time()
-        try:
-            es_statinfo = source_es.cat.thread_pool(
-                h='name,node_name,host,type,active,size,queue,queue_size,rejected,largest,completed',
-                v=True,
-                format='json')
-        except (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout) as e:
-            log.warn("connection error %s" % str(e))
-            continue
-        _se = time.time()
-        log.info('%r  %2.2f ms' % ('.cat.thread_pool', (_se - _st) * 1000))
-
-        doc_ts_millis = int(_se * 1000)
-
-       # pprint (es_shardinfo)
-       # sys.exit(0)
-        # add the cluster info to each item
-        # ... and add in the index prefix
-        for _stat in es_statinfo:
-            stat_data = {
-                'timestamp': doc_ts_millis,
-                'thread_id': "%s_%s" % (_stat['name'], _stat['node_name']),
-                'node_name': _stat['node_name'],
-                'name': _stat['name'],
-                'type': _stat['type'],
-                'queue': _stat['queue'],
-                'queue_size': _stat['queue_size'],
-                'active': _stat['active'],
-                'completed': _stat['completed'],
-                'rejected': _stat['rejected'],
-                'largest': _stat['largest'],
-                'size': _stat['size']
-            }
-
-            try:
-                dest_es.index(
-                    index="test_thread_pool_stats",
-                    doc_type='thread_pool',
-                    body=json.dumps(stat_data))
-            except (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout) as e:
-                log.error("Error posting thread pool %s data %s" %
-                    (stat_data['thread_id'], str(e)))
-                pass
-
-        _nextrun = _nextrun + interval
-        # if time.sleep() is called on a negative number, the routine fails
-        # to return - so ensure that we're not going to lock up the thread
-        # if one of the preceding calls takes unexpectedly long to return
-        # and overruns the interval
-        sleep_intv = _nextrun - time.time()
-        if (sleep_intv > 0):
-            time.sleep(sleep_intv)
+    # every poller writes through the one shared monitoring cluster client
+    test_es = collector.monitoring_client(
+        dest_hosts, es_cred, maxsize=engine.max_workers)
 
+    for cluster_name in clusters.keys():
 
-def main():
+        es = collector.source_client(cluster_name, clusters[cluster_name], es_cred)
 
-    log = logging.getLogger(__name__)
-    es_cred = None
-    try:
-#        with open('auth.json') as f:
-#            es_cred = json.load(f)
-        with open('auth.yml') as f:
-            es_cred = yaml.load(f)['creds']
-    except Exception as e:
-        # log error
-        raise e
+        log.info("adding %s thread pool monitor" % cluster_name)
+        engine.add_poller(
+            'thread_pool_stats', cluster_name, interval,
+            run_stat_query,
+            es,
+            test_es,
+            cluster_name=cluster_name)
 
-    with open('_clusters.yml') as f:
-        clusters = yaml.load(f)
 
-    cluster_threads = []
+def main():
 
-    for cluster_name in clusters.keys():
+    es_cred, clusters = collector.load_config()
 
-        es = elasticsearch.Elasticsearch(
-            hosts=clusters[cluster_name],
-            sniff_on_start=False,
-            sniff_on_connection_fail=False,
-            http_auth=(es_cred['user'], es_cred['pass']))
-
-        test_es = elasticsearch.Elasticsearch(
-            hosts=[{'host':'localhost', 'port': '9200'}],
-            sniff_on_start=False,
-            sniff_on_connection_fail=False,
-            http_auth=(es_cred['user'], es_cred['pass']))
-
-        log.info("launching %s monitor" % cluster_name)
-        cluster_threads.append(
-            run_stat_query(
-                es,
-                test_es,
-                cluster_name=cluster_name,
-                interval=30))
-
-    # Thread startup is done - monitor the active threads
-    log.info("Threads: %s", repr(cluster_threads))
-    while True:
-        log.debug("main thread check-in: %d worker threads active" %
-            (threading.active_count() - 1))
-        threads_active = 0
-        for c_thread in cluster_threads:
-            c_thread.join(1)
-        if (threading.active_count() == 1):
-            # TODO: restart any threads that have died
-            break
-        time.sleep(15)
+    engine = collector.collector_engine()
+    add_stat_pollers(engine, clusters, es_cred, interval=30)
+    engine.run()
 
 if __name__ == '__main__':
     main()